@@ -1,17 +1,23 @@
 import os
+from collections import deque
+from timeit import default_timer
 import OpenGL.GL as gl
 import numpy as np
 from PySide import QtCore
 from objects import Camera
 import material
+import lod
 from loader import loadTexture
 import controls
+from scheduler import SCENE_DIRT
+from profiling import PROFILER, timed
+from resources import GPU
 
 
 class App(QtCore.QObject):
 
     drawSignal = QtCore.Signal((material.BaseMaterial, bool))
-    updateSampleSignal = QtCore.Signal(int)
+    updateTimeSignal = QtCore.Signal(float)
 
     def __init__(self, viewer, viewportCoords=None):
         super(App, self).__init__()
@@ -23,6 +29,18 @@ class App(QtCore.QObject):
             self.viewportCoords = [0, 0, self.viewer.width(), self.viewer.height()]
 
         self.root = None
+        self.currentTime = 0.
+
+        # streamed meshes waiting for their gpu buffers, drained a few per
+        # frame within uploadBudget seconds
+        self.uploadQueue = deque()
+        self.uploadBudget = .008
+        # meshes with lod levels ready, they go up once uploadQueue is empty
+        self.lodQueue = deque()
+        # set by the viewer while playback drops frames, lods go coarse then
+        self.playbackBehind = False
+        # seconds without wheel events before a wheel zoom counts as done
+        self.settleDelay = .25
 
         self.drawGrid = False
         self.grid = Grid()
@@ -36,7 +54,13 @@ class App(QtCore.QObject):
         self.currentBrush = self.brushes['default']
         self.activeMesh = None
 
-        self.material = material.MatcapMaterial()
+        # the smooth preview only compiles when it is first switched on
+        self.materials = {
+            'flat': material.MatcapMaterial(),
+            'smooth': material.SmoothPreviewMaterial(),
+        }
+        self.material = self.materials['flat']
+        self.sceneCache = SceneCache()
 
         self.interactiveCamera = Camera('/interactiveCamera')
         self.interactiveCamera.aspect = self.viewportCoords[2] / float(self.viewportCoords[3])
@@ -44,8 +68,14 @@ class App(QtCore.QObject):
         self.currentCamera = self.interactiveCamera
 
     def setActiveMesh(self, activeMesh):
+        # the edited mesh is drawn at full detail, the cached scene has to
+        # match it for the highlight pass
+        for mesh in (self.activeMesh, activeMesh):
+            if mesh is not None and len(mesh.lodBuffers) > 0:
+                self.markDirty('scene')
         self.activeMesh = activeMesh
         self.currentBrush.setActiveMesh(activeMesh)
+        self.markDirty('brush')
 
     def setMode(self, mode):
         radius = self.currentBrush.radius
@@ -57,18 +87,100 @@ class App(QtCore.QObject):
             self.currentBrush.updateRadius(radius)
         self.currentBrush.setActiveMesh(self.activeMesh)
         self.currentCamera.cameraChanged()
-        self.viewer.update()
+        self.markDirty('brush', 'pins')
+
+    def markDirty(self, *kinds):
+        self.viewer.scheduler.markDirty(*kinds)
+
+    def collectBrushDirt(self):
+        self.markDirty(*self.currentBrush.takeDirty())
+
+    def clearPins(self):
+        brush = self.brushes['rubber']
+        brush.clearPins()
+        self.markDirty(*brush.takeDirty())
+
+    def undo(self):
+        self.currentBrush.undo()
+        self.collectBrushDirt()
+
+    def redo(self):
+        self.currentBrush.redo()
+        self.collectBrushDirt()
 
     def setRoot(self, root):
+        if self.root is not None:
+            self.drawSignal.disconnect(self.root.drawSlot)
+            self.updateTimeSignal.disconnect(self.root.updateTimeSlot)
+            self.viewer.makeCurrent()
+            # pins, the solver and the undo history all point into the old
+            # meshes, and undo would re-init a released one
+            self.clearPins()
+            for brush in self.brushes.values():
+                brush.setActiveMesh(None)
+            # the old scene's buffers go back to the pool for the new one
+            self.root.release()
+        self.uploadQueue.clear()
+        self.lodQueue.clear()
+        self.setActiveMesh(None)
+
         root.rootInit()
         self.drawSignal.connect(root.drawSlot)
-        self.updateSampleSignal.connect(root.updateSampleSlot)
+        self.updateTimeSignal.connect(root.updateTimeSlot)
         self.root = root
 
+    def addBranches(self, branches):
+        for branch in branches:
+            self.root.addBranch(branch)
+            if branch.kind == 'PolyMesh':
+                self.uploadQueue.append(branch)
+            else:
+                self.root.connectBranch(branch)
+                branch.updateTimeSlot(self.currentTime)
+        self.markDirty('scene')
+
+    def addLods(self, meshes):
+        self.lodQueue.extend(meshes)
+        self.markDirty('scene')
+
+    @timed('App.processUploads')
+    def processUploads(self):
+        # always makes progress, at least one mesh goes up per frame
+        start = default_timer()
+        count = 0
+        while len(self.uploadQueue) > 0:
+            mesh = self.uploadQueue.popleft()
+            mesh.init()
+            self.root.connectBranch(mesh)
+            mesh.updateTimeSlot(self.currentTime)
+            count += 1
+            if default_timer() - start > self.uploadBudget:
+                break
+        while len(self.uploadQueue) == 0 and len(self.lodQueue) > 0:
+            self.lodQueue.popleft().uploadLods()
+            count += 1
+            if default_timer() - start > self.uploadBudget:
+                break
+        if len(self.uploadQueue) > 0 or len(self.lodQueue) > 0:
+            self.markDirty('scene')
+        return count
+
+    def updateLodView(self):
+        camera = self.currentCamera
+        brushing = self.currentBrush.active and self.activeMesh is not None
+        self.root.lodView = lod.LodView(
+            camera.cameraPosition(),
+            camera.fov,
+            self.viewportCoords[3],
+            coarse=camera.navigating or camera.wheeling or self.playbackBehind,
+            fullDetail=self.activeMesh if brushing else None
+        )
+
     def resize(self, viewportCoords=None):
         if viewportCoords is not None:
             self.viewportCoords = viewportCoords
         gl.glViewport(*self.viewportCoords)
+        self.setupMaterial()
 
         self.currentCamera.aspect = self.viewportCoords[2] / float(self.viewportCoords[3])
         self.currentCamera.cameraChanged()
@@ -104,19 +216,57 @@ class App(QtCore.QObject):
         )
         gl.glUseProgram(0)
 
-        self.viewer.update()
+        self.markDirty('camera')
 
     def initSlot(self):
         self.grid.init()
         self.currentBrush.init()
+        self.sceneCache.init()
         self.init()
 
-    def drawSlot(self):
-        self.draw()
+    def drawSlot(self, dirty):
+        self.draw(dirty)
+
+    def cacheSamples(self, quantization='int16', errorBound=None):
+        rawBytes = 0
+        storedBytes = 0
+        maxError = 0.
+        meshCount = 0
+        for branch in self.root.map.values():
+            if branch.kind != 'PolyMesh' or branch.pointProp is None:
+                continue
+            stats = branch.cacheSamples(quantization, errorBound)
+            if stats is None:
+                continue
+            meshCount += 1
+            rawBytes += stats['rawBytes']
+            storedBytes += stats['storedBytes']
+            maxError = max(maxError, stats['maxError'])
+        return {
+            'meshes': meshCount,
+            'rawBytes': rawBytes,
+            'storedBytes': storedBytes,
+            'maxError': maxError,
+        }
+
+    def updateTimeSlot(self, time):
+        # the scene is only redrawn when some mesh actually got new points,
+        # otherwise the frame is just the cached image again
+        self.currentTime = time
+        uploads = self.root.sampleUploads if self.root is not None else 0
+        self.updateTimeSignal.emit(time)
+        self.updateTime(time)
+        if self.root is None or self.root.sampleUploads != uploads:
+            self.markDirty('time', 'sample')
+        else:
+            self.markDirty('time')
 
-    def updateSampleSlot(self, sampleIndex):
-        self.updateSampleSignal.emit(sampleIndex)
-        self.updateSample(sampleIndex)
+    def motionStats(self):
+        counts = {'static': 0, 'piecewise': 0, 'animated': 0, None: 0}
+        for branch in self.root.map.values():
+            if branch.kind == 'PolyMesh':
+                counts[branch.motion] += 1
+        return counts
 
     def init(self):
         gl.glFrontFace(gl.GL_CW)
@@ -131,24 +281,131 @@ class App(QtCore.QObject):
         gl.glViewport(*self.viewportCoords)
 
         thisDir = os.getcwd()
-        gl.glUseProgram(self.material.shaderProg)
-        texLoc = gl.glGetUniformLocation(self.material.shaderProg, 'matcap')
         loadTexture(gl.GL_TEXTURE1, os.path.join(thisDir, 'res', 'matcap.png'))
-        gl.glUniform1i(texLoc, 1)
-        gl.glUseProgram(0)
+        self.setupMaterial()
 
-    def draw(self):
-        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+    def setupMaterial(self):
+        gl.glUseProgram(self.material.shaderProg)
+        gl.glUniform1i(gl.glGetUniformLocation(self.material.shaderProg, 'matcap'), 1)
+        gl.glUniform2f(
+            gl.glGetUniformLocation(self.material.shaderProg, 'viewportSize'),
+            float(self.viewportCoords[2]),
+            float(self.viewportCoords[3])
+        )
+        gl.glUseProgram(0)
 
-        if self.drawGrid:
-            self.grid.draw()
+    def setSmoothPreview(self, enabled):
+        # the new program needs the matcap, viewport and camera uniforms
+        self.material = self.materials['smooth' if enabled else 'flat']
+        self.setupMaterial()
+        self.currentCamera.cameraChanged()
+        self.markDirty('scene')
 
-        self.drawSignal.emit(self.material, True)
+    def setGeodesicFalloff(self, enabled):
+        if enabled:
+            # scipy factors the geodesics, better to fail here than on the
+            # next mouse move
+            import scipy.sparse.linalg
+        for brush in self.brushes.values():
+            brush.setGeodesicFalloff(enabled)
+            self.markDirty(*brush.takeDirty())
+
+    @timed('App.draw')
+    def draw(self, dirty=SCENE_DIRT):
+        PROFILER.collectGPU()
+        uploaded = self.processUploads() if len(self.uploadQueue) + len(self.lodQueue) > 0 else 0
+
+        # the scene is only re-rendered when something in it changed,
+        # otherwise the cached image is copied back and the overlay redrawn
+        width, height = self.viewportCoords[2], self.viewportCoords[3]
+        if not self.sceneCache.valid(width, height) or len(dirty & SCENE_DIRT) > 0 or uploaded > 0:
+            PROFILER.gpuBegin('GPU scene')
+            self.sceneCache.begin(width, height)
+            gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+
+            if self.drawGrid:
+                self.grid.draw()
+
+            self.updateHit(highlight=False)
+            if self.root is not None:
+                self.updateLodView()
+            self.drawSignal.emit(self.material, True)
+            self.sceneCache.end()
+            PROFILER.gpuEnd()
+
+        PROFILER.gpuBegin('GPU overlay')
+        self.sceneCache.blit()
+        self.drawOverlay()
+        PROFILER.gpuEnd()
+
+    def drawOverlay(self):
+        # the hovered mesh is drawn again with the brush highlight, LEQUAL lets
+        # it land exactly on its own cached depth
+        if self.activeMesh is not None and self.currentBrush.active:
+            # the footprint replaces the straight line highlight
+            self.updateHit(highlight=not self.currentBrush.geodesicFalloff)
+            gl.glDepthFunc(gl.GL_LEQUAL)
+            self.activeMesh.drawSlot(self.material, self.activeMesh.visible)
+            gl.glDepthFunc(gl.GL_LESS)
         self.currentBrush.draw()
 
-    def updateHit(self):
+    @timed('App.mouseMove')
+    def mouseMove(self, x, y, modifiers, buttons, dx, dy):
+        camera = self.currentCamera
+        hit = False
+        if modifiers != QtCore.Qt.AltModifier and not camera.navigating:
+            hit = self.currentBrush.mouseMoveEvent(
+                x, y,
+                modifiers, buttons,
+                self.viewportCoords,
+                camera.viewMatrix(),
+                camera.projectionMatrix(),
+                camera.cameraPosition(),
+                camera.upsign,
+                dx, dy
+            )
+        if (not hit or camera.navigating) and not self.currentBrush.operating:
+            camera.mouseMoveEvent(buttons, dx, dy)
+
+        self.collectBrushDirt()
+
+    def mousePress(self, x, y, modifiers, buttons):
+        if modifiers != QtCore.Qt.AltModifier and not self.currentCamera.navigating:
+            self.currentBrush.handleMouseButton(x, y, modifiers, buttons, 0, 0)
+            self.currentBrush.mousePress(modifiers, buttons)
+        self.collectBrushDirt()
+
+    def mouseRelease(self):
+        self.currentBrush.mouseRelease()
+        self.collectBrushDirt()
+        self.settle()
+
+    def settle(self):
+        # back to full detail as soon as the view settles
+        camera = self.currentCamera
+        if camera.navigating or camera.wheeling:
+            camera.navigating = False
+            camera.wheeling = False
+            self.markDirty('scene')
+
+    def keyPress(self, key, modifiers):
+        # returns whether the key was used
+        if key == QtCore.Qt.Key_Z and modifiers == QtCore.Qt.ControlModifier:
+            self.undo()
+        elif key == QtCore.Qt.Key_Z and modifiers == (QtCore.Qt.ControlModifier | QtCore.Qt.ShiftModifier):
+            self.redo()
+        else:
+            return False
+        return True
+
+    def wheel(self, delta, modifiers):
+        # the caller settles the view once the wheel has been still for
+        # settleDelay seconds
+        self.currentCamera.wheel(delta, modifiers)
+
+    def updateHit(self, highlight=True):
         gl.glUseProgram(self.material.shaderProg)
-        if not self.currentBrush.active:
+        if not self.currentBrush.active or not highlight:
             gl.glUniform3f(
                 gl.glGetUniformLocation(self.material.shaderProg, 'hitPos'),
                 -1000., -1000., -1000.
@@ -168,10 +425,69 @@ class App(QtCore.QObject):
             )
         gl.glUseProgram(0)
 
-    def updateSample(self, sampleIndex):
+    def updateTime(self, time):
         pass
 
 
+class SceneCache(QtCore.QObject):
+    # offscreen color and depth of the last full scene render
+    def __init__(self, defaultFramebuffer=0):
+        super(SceneCache, self).__init__()
+        self.defaultFramebuffer = defaultFramebuffer
+        self.fbo = None
+        self.colorBuffer = None
+        self.depthBuffer = None
+        self.width = 0
+        self.height = 0
+        self.filled = False
+
+    def init(self):
+        self.fbo = GPU.track('framebuffer', gl.glGenFramebuffers(1), 'framebuffers')
+        self.colorBuffer = GPU.track('renderbuffer', gl.glGenRenderbuffers(1), 'framebuffers')
+        self.depthBuffer = GPU.track('renderbuffer', gl.glGenRenderbuffers(1), 'framebuffers')
+
+    def valid(self, width, height):
+        return self.filled and self.width == width and self.height == height
+
+    def allocate(self, width, height):
+        gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, self.colorBuffer)
+        gl.glRenderbufferStorage(gl.GL_RENDERBUFFER, gl.GL_RGBA8, width, height)
+        # has to match the window's depth format for the depth blit
+        gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, self.depthBuffer)
+        gl.glRenderbufferStorage(gl.GL_RENDERBUFFER, gl.GL_DEPTH24_STENCIL8, width, height)
+        gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, 0)
+
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fbo)
+        gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, gl.GL_RENDERBUFFER, self.colorBuffer)
+        gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER, gl.GL_DEPTH_STENCIL_ATTACHMENT, gl.GL_RENDERBUFFER, self.depthBuffer)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.defaultFramebuffer)
+        GPU.resize('renderbuffer', self.colorBuffer, width * height * 4)
+        GPU.resize('renderbuffer', self.depthBuffer, width * height * 4)
+
+        self.width = width
+        self.height = height
+
+    def begin(self, width, height):
+        if self.width != width or self.height != height:
+            self.allocate(width, height)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fbo)
+
+    def end(self):
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.defaultFramebuffer)
+        self.filled = True
+
+    def blit(self):
+        gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, self.fbo)
+        gl.glBindFramebuffer(gl.GL_DRAW_FRAMEBUFFER, self.defaultFramebuffer)
+        gl.glBlitFramebuffer(
+            0, 0, self.width, self.height,
+            0, 0, self.width, self.height,
+            gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT,
+            gl.GL_NEAREST
+        )
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.defaultFramebuffer)
+
+
 class Grid(QtCore.QObject):
     def __init__(self, color=[1., 1., 1., .23]):
         coords = np.arange(-50, 51, 10)
@@ -194,17 +510,10 @@ class Grid(QtCore.QObject):
         self.color = color
 
     def init(self):
-        self.vao = gl.glGenVertexArrays(1)
+        self.vao = GPU.createVertexArray('grid')
         gl.glBindVertexArray(self.vao)
 
-        self.vboVerts = gl.glGenBuffers(1)
-        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vboVerts)
-        gl.glBufferData(
-            gl.GL_ARRAY_BUFFER,
-            self.verts.nbytes,
-            self.verts,
-            gl.GL_STATIC_DRAW
-        )
+        self.vboVerts = GPU.createBuffer(gl.GL_ARRAY_BUFFER, self.verts, gl.GL_STATIC_DRAW, 'grid')
 
         gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
         gl.glBindVertexArray(0)
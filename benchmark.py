@@ -0,0 +1,416 @@
+import sys
+import json
+import time
+import argparse
+import platform
+from timeit import default_timer
+import numpy as np
+from PySide import QtCore
+from external import igl
+from common import normalize, LazyReport
+from objects import Branch, PolyMesh, Camera
+from loader import parseProperties
+from controls import BrushBase
+from operators import Rubber, rotationMatrix
+
+
+# grid resolution of each size, the other generators are scaled to about
+# the same number of vertices
+SIZES = {
+    'small': 64,
+    'medium': 256,
+    'large': 768,
+}
+
+
+def gridMesh(resolution):
+    # quads on a slightly wavy plane
+    x, y = np.meshgrid(np.arange(resolution), np.arange(resolution))
+    points = np.stack([x.ravel(), np.sin(x.ravel() * .2) * np.cos(y.ravel() * .2), y.ravel()], axis=1)
+    ids = np.arange(resolution * resolution).reshape(resolution, resolution)
+    quads = np.stack([ids[:-1, :-1], ids[1:, :-1], ids[1:, 1:], ids[:-1, 1:]], axis=2).reshape(-1, 4)
+    counts = np.full(quads.shape[0], 4, np.uint32)
+    return points.astype(np.float32) * 10. / resolution, counts, quads.ravel().astype(np.uint32)
+
+
+def sphereMesh(resolution):
+    # uv sphere, quads with triangle fans at the poles
+    rings = max(3, resolution // 2)
+    theta, phi = np.meshgrid(np.linspace(0., 2. * np.pi, resolution, endpoint=False), np.linspace(0., np.pi, rings + 1)[1:-1])
+    points = np.stack([np.sin(phi) * np.cos(theta), np.cos(phi), np.sin(phi) * np.sin(theta)], axis=2).reshape(-1, 3)
+    points = np.concatenate([[[0., 1., 0.]], points, [[0., -1., 0.]]]) * 5.
+    south = points.shape[0] - 1
+
+    ids = np.arange(1, south).reshape(rings - 1, resolution)
+    after = np.roll(ids, -1, axis=1)
+    quads = np.stack([ids[:-1], ids[1:], after[1:], after[:-1]], axis=2).reshape(-1, 4)
+    top = np.stack([np.zeros(resolution, np.int64), ids[0], after[0]], axis=1)
+    bottom = np.stack([np.full(resolution, south), after[-1], ids[-1]], axis=1)
+
+    indices = np.concatenate([top.ravel(), quads.ravel(), bottom.ravel()])
+    counts = np.concatenate([np.full(resolution, 3), np.full(quads.shape[0], 4), np.full(resolution, 3)])
+    return points.astype(np.float32), counts.astype(np.uint32), indices.astype(np.uint32)
+
+
+def soupMesh(resolution, seed=0):
+    # disconnected n-gons of 3 to 8 sides, counts change from face to face
+    random = np.random.RandomState(seed)
+    counts = random.randint(3, 9, resolution * resolution // 5).astype(np.uint32)
+    angles = np.concatenate([np.arange(count) * 2. * np.pi / count for count in counts])
+    centers = np.repeat(random.uniform(-5., 5., (counts.shape[0], 3)), counts, axis=0)
+    points = centers + np.stack([np.cos(angles), np.sin(angles), np.zeros_like(angles)], axis=1) * .05
+    return points.astype(np.float32), counts, np.arange(points.shape[0], dtype=np.uint32)
+
+
+MESHES = {
+    'grid': gridMesh,
+    'sphere': sphereMesh,
+    'soup': soupMesh,
+}
+
+
+def triangles(counts, indices):
+    # fan triangulation, what prepMesh ends up with
+    faces = np.split(indices, np.cumsum(counts)[:-1])
+    return np.array([
+        [face[0], face[i], face[i + 1]] for face in faces for i in range(1, len(face) - 1)
+    ], np.uint32)
+
+
+def loadedMesh(points, counts, indices, path='/bench/mesh'):
+    # a mesh as the loader leaves it, before prepMesh
+    mesh = PolyMesh(path)
+    mesh.points = points.copy()
+    mesh.counts = counts
+    mesh.indices = indices
+    mesh.pointProp = SyntheticProperty('P', [points.ravel().tolist()])
+    return mesh
+
+
+def preparedMesh(points, triangleIDs, path='/bench/mesh'):
+    # enough of prepMesh for picking without going through igl
+    mesh = PolyMesh(path)
+    mesh.points = points.copy()
+    mesh.trimap = triangleIDs
+    mesh.triCount = triangleIDs.size
+    mesh.offsets = np.zeros_like(points)
+    mesh.matrix = np.identity(4, np.float32)
+    return mesh
+
+
+class SyntheticProperty(object):
+    # the part of the alembic property api loader.parseProperties uses,
+    # values come back as flat lists like they do from the bindings
+    def __init__(self, name, samples=None, children=None):
+        self.name = name
+        self.samples = samples
+        self.children = children
+
+    def isCompound(self):
+        return self.children is not None
+
+    def getName(self):
+        return self.name
+
+    def getPropertyNames(self):
+        return [child.name for child in self.children]
+
+    def getProperty(self, name):
+        for child in self.children:
+            if child.name == name:
+                return child
+        return None
+
+    def getValues(self, index=0):
+        return self.samples[index]
+
+    def getNbStoredSamples(self):
+        return len(self.samples)
+
+
+def hierarchy(count, fanout=8):
+    # a balanced tree of count objects, returns the paths and whether each
+    # one has children. those become xforms, the leaves meshes
+    paths = []
+    for index in range(count):
+        parent = paths[(index - 1) // fanout] if index > 0 else ''
+        paths.append('%s/node%d' % (parent, index))
+    return paths, [fanout * index + 1 < count for index in range(count)]
+
+
+def meshProperties(points, counts, indices):
+    lo = points.min(axis=0)
+    hi = points.max(axis=0)
+    return [
+        SyntheticProperty('.geom', children=[
+            SyntheticProperty('P', [points.ravel().tolist()]),
+            SyntheticProperty('.faceIndices', [indices.tolist()]),
+            SyntheticProperty('.faceCounts', [counts.tolist()]),
+            SyntheticProperty('.selfBnds', [lo.tolist() + hi.tolist()]),
+            SyntheticProperty('uv', children=[
+                SyntheticProperty('.vals', [[0., 0.] * 4]),
+                SyntheticProperty('.indices', [[0, 1, 2, 3]]),
+            ]),
+        ]),
+    ]
+
+
+def xformProperties():
+    return [SyntheticProperty('.xform', [np.identity(4).ravel().tolist()])]
+
+
+BENCHMARKS = []
+
+
+def benchmark(name, requires=None):
+    # registers func(size) -> (setup, run). setup runs untimed before every
+    # repeat and its result is handed to run
+    def register(func):
+        BENCHMARKS.append((name, func, requires))
+        return func
+    return register
+
+
+@benchmark('common.normalize')
+def normalizeBenchmark(size):
+    vectors = np.random.RandomState(0).normal(size=(SIZES[size] ** 2, 3))
+    return None, lambda state: normalize(vectors)
+
+
+def prepMeshBenchmark(kind):
+    def make(size):
+        points, counts, indices = MESHES[kind](SIZES[size])
+        return (
+            lambda: loadedMesh(points, counts, indices),
+            lambda mesh: mesh.prepMesh()
+        )
+    return make
+
+
+for kind in sorted(MESHES.keys()):
+    benchmark('PolyMesh.prepMesh/%s' % kind, requires=igl)(prepMeshBenchmark(kind))
+
+
+@benchmark('loader.parseProperties/hierarchy')
+def parsePropertiesBenchmark(size):
+    paths, interior = hierarchy(SIZES[size] * 4)
+    points, counts, indices = gridMesh(8)
+    properties = dict(
+        (path, xformProperties() if isXform else meshProperties(points, counts, indices))
+        for path, isXform in zip(paths, interior)
+    )
+
+    def setup():
+        return [
+            (path, Branch(path) if isXform else PolyMesh(path))
+            for path, isXform in zip(paths, interior)
+        ]
+
+    def run(branches):
+        report = LazyReport()
+        for path, branch in branches:
+            for prop in properties[path]:
+                parseProperties(prop, path, branch.kind, branch, report=report)
+    return setup, run
+
+
+def rubberSetup(size):
+    points, counts, indices = gridMesh(SIZES[size])
+    mesh = loadedMesh(points, counts, indices)
+    mesh.prepMesh()
+    # solves are measured without the upload, there is no gl context here
+    mesh.updateOffsets = lambda vertIDs=None: None
+
+    rubber = Rubber()
+    rubber.activeMesh = mesh
+    resolution = SIZES[size]
+    rubber.pinVertIDs = np.array([0, resolution - 1, resolution * resolution // 2 + resolution // 2], np.int64)
+    rubber.pinCoords = mesh.points[rubber.pinVertIDs].astype(np.float64)
+    return rubber
+
+
+@benchmark('Rubber.preCompute', requires=igl)
+def preComputeBenchmark(size):
+    return lambda: rubberSetup(size), lambda rubber: rubber.preCompute()
+
+
+@benchmark('Rubber.solveDelta', requires=igl)
+def solveDeltaBenchmark(size):
+    def setup():
+        rubber = rubberSetup(size)
+        rubber.preCompute()
+        return rubber
+
+    def run(rubber):
+        # a short drag of the last pin
+        for step in range(10):
+            rubber.solveDelta(len(rubber.pinCoords) - 1, .001, .001, np.array([0., 50., 0.]), 1.)
+    return setup, run
+
+
+@benchmark('Rubber.transformPins', requires=igl)
+def transformPinsBenchmark(size):
+    def setup():
+        rubber = rubberSetup(size)
+        rubber.preCompute()
+        return rubber
+
+    def run(rubber):
+        # every pin spun about their centre, one solve per step like a drag
+        rotate = rotationMatrix([0., 1., 0.], .01)
+        pinIndices = np.arange(rubber.pinCoords.shape[0])
+        for step in range(10):
+            rubber.transformPins(pinIndices, rotate=rotate)
+    return setup, run
+
+
+@benchmark('BrushBase.mouseMoveEvent/pick')
+def pickBenchmark(size):
+    points, counts, indices = sphereMesh(SIZES[size])
+    triangleIDs = triangles(counts, indices)
+    viewport = [0, 0, 1280, 720]
+
+    camera = Camera('/bench/camera')
+    camera.target = np.zeros(3, np.float32)
+    camera.radius = 20.
+    camera.aspect = viewport[2] / float(viewport[3])
+    view = camera.viewMatrix()
+    projection = camera.projectionMatrix()
+    position = camera.cameraPosition()
+    # a stroke onto the sphere, across and off it again, two pixels per
+    # event. the sphere is about 350 pixels in radius, so roughly a third of
+    # the events miss and leaving it times the ring miss fallback
+    stroke = [(x, 360 + (x - 640) // 4) for x in range(160, 1120, 2)]
+
+    def setup():
+        brush = BrushBase()
+        brush.setActiveMesh(preparedMesh(points, triangleIDs))
+        return brush
+
+    def run(brush):
+        for x, y in stroke:
+            brush.mouseMoveEvent(
+                x, y, QtCore.Qt.NoModifier, QtCore.Qt.NoButton,
+                viewport, view, projection, position, camera.upsign, 0., 0.
+            )
+    return setup, run
+
+
+def missing(module):
+    # why a benchmark can't run here, None when it can
+    if module is None:
+        return None
+    try:
+        module.load()
+    except ImportError as error:
+        return str(error)
+    return None
+
+
+def measure(setup, run, repeat):
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        start = default_timer()
+        run(state)
+        times.append(default_timer() - start)
+    return times
+
+
+def runBenchmarks(sizes, repeat=5, pattern=None, out=sys.stdout):
+    results = {}
+    skipped = {}
+    for name, make, requires in BENCHMARKS:
+        if pattern is not None and pattern not in name:
+            continue
+        reason = missing(requires)
+        for size in sizes:
+            key = '%s[%s]' % (name, size)
+            if reason is not None:
+                skipped[key] = reason
+                continue
+            setup, run = make(size)
+            times = measure(setup, run, repeat)
+            results[key] = {
+                'min': min(times),
+                'median': float(np.median(times)),
+                'mean': float(np.mean(times)),
+                'repeat': repeat,
+            }
+            out.write('%-48s %10.2f ms  (median %.2f)\n' % (key, results[key]['min'] * 1000., results[key]['median'] * 1000.))
+    for key in sorted(skipped.keys()):
+        out.write('%-48s skipped, %s\n' % (key, skipped[key]))
+
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+        'skipped': skipped,
+    }
+
+
+def compare(baseline, current, threshold=.1, metric='min'):
+    # returns (name, before, after, change) for every benchmark both runs
+    # have and the names that got slower by more than threshold
+    rows = []
+    regressions = []
+    for name in sorted(set(baseline['results'].keys()) & set(current['results'].keys())):
+        before = baseline['results'][name][metric]
+        after = current['results'][name][metric]
+        change = after / before - 1. if before > 0 else 0.
+        rows.append((name, before, after, change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='time the hot paths on synthetic meshes')
+    commands = parser.add_subparsers(dest='command')
+
+    runParser = commands.add_parser('run', help='run the benchmarks and write the results as json')
+    runParser.add_argument('--output', default='benchmark.json')
+    runParser.add_argument('--sizes', nargs='+', choices=sorted(SIZES.keys()), default=['small', 'medium'])
+    runParser.add_argument('--repeat', type=int, default=5)
+    runParser.add_argument('--filter', default=None, help='only benchmarks with this in their name')
+
+    compareParser = commands.add_parser('compare', help='compare two result files')
+    compareParser.add_argument('baseline')
+    compareParser.add_argument('current')
+    compareParser.add_argument('--threshold', type=float, default=.1, help='relative slowdown that counts as a regression')
+    compareParser.add_argument('--metric', choices=['min', 'median', 'mean'], default='min')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        report = runBenchmarks(args.sizes, args.repeat, args.filter)
+        with open(args.output, 'w') as outFile:
+            json.dump(report, outFile, indent=2, sort_keys=True)
+        return 0
+
+    if args.command == 'compare':
+        with open(args.baseline) as inFile:
+            baseline = json.load(inFile)
+        with open(args.current) as inFile:
+            current = json.load(inFile)
+        rows, regressions = compare(baseline, current, args.threshold, args.metric)
+        for name, before, after, change in rows:
+            flag = 'REGRESSION' if name in regressions else ('faster' if change < -args.threshold else '')
+            sys.stdout.write('%-48s %10.2f ms %10.2f ms  %+6.1f%%  %s\n' % (
+                name, before * 1000., after * 1000., change * 100., flag
+            ))
+        sys.stdout.write('%d of %d benchmarks regressed by more than %.0f%%\n' % (
+            len(regressions), len(rows), args.threshold * 100.
+        ))
+        return 1 if len(regressions) > 0 else 0
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -5,3 +5,77 @@ def normalize(a, axis=-1, order=2):
     l2 = np.atleast_1d(np.linalg.norm(a, order, axis))
     l2[l2 == 0] = 1
     return a / np.expand_dims(l2, axis)
+
+
+class LazyValue(object):
+    # a read that only happens the first time somebody asks for the value.
+    # reads are counted on the report the value was created with
+    def __init__(self, read, name=None, report=None):
+        self.read = read
+        self.name = name
+        self.report = report
+        self.loaded = False
+        self.value = None
+        if report is not None:
+            report.deferred(name)
+
+    def get(self):
+        if not self.loaded:
+            self.value = self.read()
+            self.read = None
+            self.loaded = True
+            if self.report is not None:
+                self.report.materialized(self.name)
+        return self.value
+
+    def map(self, convert):
+        return LazyValue(lambda: convert(self.get()))
+
+
+class LazyAttribute(object):
+    # class level descriptor, a LazyValue assigned to the attribute is
+    # resolved and replaced by its value on first access
+    def __init__(self, name):
+        self.key = '_lazy_' + name
+
+    def __get__(self, obj, objType=None):
+        if obj is None:
+            return self
+        value = obj.__dict__.get(self.key)
+        if isinstance(value, LazyValue):
+            value = value.get()
+            obj.__dict__[self.key] = value
+        return value
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.key] = value
+
+    def __delete__(self, obj):
+        obj.__dict__.pop(self.key, None)
+
+
+class LazyReport(object):
+    # how many of the deferred reads of each property actually happened
+    def __init__(self):
+        self.counts = {}
+
+    def deferred(self, name):
+        self.counts.setdefault(name, [0, 0])[0] += 1
+
+    def materialized(self, name):
+        self.counts.setdefault(name, [0, 0])[1] += 1
+
+    def totals(self):
+        deferred = sum(counts[0] for counts in self.counts.values())
+        materialized = sum(counts[1] for counts in self.counts.values())
+        return deferred, materialized
+
+    def summary(self):
+        deferred, materialized = self.totals()
+        return 'read %d of %d properties' % (materialized, deferred)
+
+    def report(self):
+        lines = [self.summary()]
+        for name, (deferred, materialized) in sorted(self.counts.items()):
+            lines.append('  %-24s %6d / %d' % (name, materialized, deferred))
+        return '\n'.join(lines)
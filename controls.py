@@ -2,9 +2,11 @@ import OpenGL.GL as gl
 import numpy as np
 from PySide import QtCore, QtGui
 import material
-from external import igl
 from common import normalize
+from spatial import unproject, CoherentPicker, FALLOFFS
 import operators
+from profiling import PROFILER
+from resources import GPU
 
 
 class BrushBase(QtCore.QObject):
@@ -13,35 +15,76 @@ class BrushBase(QtCore.QObject):
         self.radius = radius
 
         self.lastHit = None
+        # the hit triangle's corners and barycentric weights, lastHitID is
+        # the corner nearest to the hit
         self.lastHitID = None
+        self.lastHitFace = None
+        self.lastHitWeights = None
         self.activeMesh = None
 
+        # tests the triangles around the previous hit before a full query
+        self.coherentPicking = True
+        self.picker = CoherentPicker()
+        # measure the brush radius along the surface instead of straight,
+        # the vertices under the brush are shown while it is on
+        self.geodesicFalloff = False
+        self.footprint = BrushFootprint()
+
         self.active = False
         self.adjustingRadius = False
         self.operating = False
         self.alternative = False
         self.matrix = None
 
+        # what the last events changed, collected by App for the scheduler
+        self.dirty = set()
+
+    def markDirty(self, *kinds):
+        self.dirty.update(kinds)
+
+    def takeDirty(self):
+        dirty = self.dirty
+        self.dirty = set()
+        return dirty
+
     def setActiveMesh(self, activeMesh):
+        # the last hit indexes the previous mesh
+        if activeMesh is not self.activeMesh:
+            self.active = False
         self.activeMesh = activeMesh
+        self.picker.reset()
 
     def init(self):
-        pass
+        self.footprint.init()
 
     def updateViewProjection(self, view, projection):
-        pass
+        self.footprint.updateViewProjection(view, projection)
 
     def updateRadius(self, radius):
+        changed = radius != self.radius
         self.radius = radius
+        if changed:
+            self.markDirty('brush')
+            if self.geodesicFalloff and self.active:
+                self.updateFootprint()
 
     def mouseMove(self):
         pass
         # TODO tidy up event handling
 
-    def mousePress(self):
+    def mousePress(self, modifiers, buttons):
         pass
         # TODO tidy up event handling
 
+    def mouseRelease(self):
+        pass
+
+    def undo(self):
+        return False
+
+    def redo(self):
+        return False
+
     def handleMouseButton(self, x, y, modifiers, buttons, dx, dy):
         self.operating = False
         if buttons == QtCore.Qt.LeftButton:
@@ -68,25 +111,28 @@ class BrushBase(QtCore.QObject):
 
         mX = float(x)
         mY = float(viewportCoords[3] - y)
+        previous = (self.active, self.lastHit)
 
-        model = igl.eigen.MatrixXd(self.activeMesh.matrix.T.astype(float).tolist())
-        view = igl.eigen.MatrixXd(viewMatrix.T.astype(float).tolist())
-        projection = igl.eigen.MatrixXd(projectionMatrix.T.astype(float).tolist())
-        viewport = igl.eigen.MatrixXd(map(float, viewportCoords))
-
-        barycentricCoords = igl.eigen.MatrixXd()
+        model = self.activeMesh.matrix.reshape(4, 4).T
+        view = viewMatrix.T
+        projection = projectionMatrix.T
 
         # Cast a ray in the view direction starting from the mouse position
-        hitIDs = igl.eigen.MatrixXi([-1])
-        coord = igl.eigen.MatrixXd([mX, mY])
-        hit = igl.unproject_onto_mesh(coord, view * model, projection, viewport, self.activeMesh.V, self.activeMesh.F, hitIDs, barycentricCoords)
+        with PROFILER.scope('BrushBase.pick'):
+            origin, direction = unproject(mX, mY, viewportCoords, np.dot(view, model), projection)
+            if self.coherentPicking:
+                hitID, barycentricCoords, _ = self.picker.intersect(self.activeMesh, origin, direction)
+            else:
+                hitID, barycentricCoords, _ = self.activeMesh.getBVH().intersect(origin, direction)
+        hit = hitID != -1
 
-        hitID = hitIDs[0, 0]
         if hit and hitID != -1:
             face = self.activeMesh.points[self.activeMesh.trimap[hitID]] + self.activeMesh.offsets[self.activeMesh.trimap[hitID]]
             hitPos = face[0] * barycentricCoords[0] + face[1] * barycentricCoords[1] + face[2] * barycentricCoords[2]
             self.lastHit = hitPos.astype(float).tolist()
-            self.lastHitID = int(self.activeMesh.trimap[hitID][0])
+            self.lastHitFace = self.activeMesh.trimap[hitID]
+            self.lastHitWeights = barycentricCoords
+            self.lastHitID = int(self.lastHitFace[np.argmin(np.linalg.norm(face - hitPos, axis=1))])
             self.lastHitNormal = normalize(np.cross(face[1] - face[0], face[2] - face[0]))[0]
             self.active = True
 
@@ -98,6 +144,11 @@ class BrushBase(QtCore.QObject):
         else:
             self.active = False
 
+        if (self.active, self.lastHit) != previous:
+            self.markDirty('brush')
+            if self.geodesicFalloff and self.active:
+                self.updateFootprint()
+
         if hit:
             self.handleMouseButton(x, y, modifiers, buttons, dx, dy)
         else:
@@ -106,11 +157,53 @@ class BrushBase(QtCore.QObject):
 
         return hit
 
+    def verticesUnderBrush(self, falloff='smooth'):
+        # vertex ids within radius of the last hit with their falloff weights
+        if self.activeMesh is None or not self.active:
+            return np.zeros(0, np.int64), np.zeros(0)
+        if not self.geodesicFalloff:
+            vertIDs, weights, distances = self.activeMesh.getSpatialGrid().query(self.lastHit, self.radius, falloff)
+            return vertIDs, weights
+
+        # distance from the hit point, blended from the distances of the hit
+        # triangle's corners. the fields come from the undeformed mesh, see
+        # getGeodesics, so vertices are taken straight from them rather than
+        # from the grid, which indexes the deformed positions
+        geodesics = self.activeMesh.getGeodesics()
+        distances = sum(
+            weight * geodesics.distances(vertID)
+            for vertID, weight in zip(self.lastHitFace, self.lastHitWeights)
+        )
+        vertIDs = np.nonzero(distances <= self.radius)[0]
+        weights = FALLOFFS[falloff](distances[vertIDs] / max(self.radius, 1e-12))
+        return vertIDs, weights
+
+    def updateFootprint(self):
+        if self.activeMesh is None:
+            return
+        vertIDs, weights = self.verticesUnderBrush()
+        positions = self.activeMesh.points[vertIDs]
+        if self.activeMesh.offsets is not None:
+            positions = positions + self.activeMesh.offsets[vertIDs]
+        self.footprint.setPoints(positions, weights, self.activeMesh.matrix)
+
+    def setGeodesicFalloff(self, enabled):
+        self.geodesicFalloff = enabled
+        if enabled and self.active:
+            self.updateFootprint()
+        self.markDirty('brush')
+
     def draw(self):
-        pass
+        # hidden while a stroke moves the surface away from it
+        if self.geodesicFalloff and self.active and not self.operating:
+            self.footprint.draw()
 
 
 class PinPoint(QtCore.QObject):
+    # one program for the cursor and every pin, each holds a reference to it
+    # from init to release
+    sharedMaterial = None
+
     def __init__(self, color=[1., 0., 0., 1.], *args):
         super(PinPoint, self).__init__(*args)
         self.verts = np.array([0, 0, 0], np.float32)
@@ -120,21 +213,17 @@ class PinPoint(QtCore.QObject):
         self.vao = None
         self.vboVerts = None
 
-        self.material = material.ConstantMaterial()
+        if PinPoint.sharedMaterial is None:
+            PinPoint.sharedMaterial = material.ConstantMaterial()
+        self.material = PinPoint.sharedMaterial
         self.color = color
 
     def init(self):
-        self.vao = gl.glGenVertexArrays(1)
+        self.material.retain()
+        self.vao = GPU.createVertexArray('pins')
         gl.glBindVertexArray(self.vao)
 
-        self.vboVerts = gl.glGenBuffers(1)
-        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vboVerts)
-        gl.glBufferData(
-            gl.GL_ARRAY_BUFFER,
-            self.verts.nbytes,
-            self.verts,
-            gl.GL_DYNAMIC_DRAW
-        )
+        self.vboVerts = GPU.createBuffer(gl.GL_ARRAY_BUFFER, self.verts, gl.GL_DYNAMIC_DRAW, 'pins')
 
         gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
         gl.glBindVertexArray(0)
@@ -142,6 +231,14 @@ class PinPoint(QtCore.QObject):
         del self.verts
         self.verts = None
 
+    def release(self):
+        if self.vao is not None:
+            self.material.release()
+        GPU.release('vertexArray', self.vao)
+        GPU.release('buffer', self.vboVerts)
+        self.vao = None
+        self.vboVerts = None
+
     def updateViewProjection(self, view, projection):
         gl.glUseProgram(self.material.shaderProg)
         gl.glUniformMatrix4fv(
@@ -200,11 +297,111 @@ class PinPoint(QtCore.QObject):
         gl.glUseProgram(0)
 
 
+class BrushFootprint(QtCore.QObject):
+    # the vertices under the brush as points, brighter where the falloff
+    # weight is higher
+    def __init__(self, color=[.1, .8, 1., 1.], *args):
+        super(BrushFootprint, self).__init__(*args)
+        self.count = 0
+        self.matrix = np.identity(4, np.float32)
+        # set between frames, uploaded by the next draw
+        self.pending = None
+
+        self.vao = None
+        self.vboVerts = None
+
+        self.material = material.FootprintMaterial()
+        self.color = color
+
+    def init(self):
+        self.vao = GPU.createVertexArray('brush')
+
+    def release(self):
+        self.material.release()
+        GPU.release('vertexArray', self.vao)
+        GPU.release('buffer', self.vboVerts)
+        self.vao = None
+        self.vboVerts = None
+
+    def setPoints(self, positions, weights, matrix):
+        verts = np.empty((positions.shape[0], 4), np.float32)
+        verts[:, :3] = positions
+        verts[:, 3] = weights
+        self.pending = verts
+        self.matrix = np.asarray(matrix, np.float32)
+
+    def updateViewProjection(self, view, projection):
+        gl.glUseProgram(self.material.shaderProg)
+        gl.glUniformMatrix4fv(
+            gl.glGetUniformLocation(self.material.shaderProg, 'view'),
+            1,
+            gl.GL_FALSE,
+            view
+        )
+        gl.glUniformMatrix4fv(
+            gl.glGetUniformLocation(self.material.shaderProg, 'projection'),
+            1,
+            gl.GL_FALSE,
+            projection
+        )
+        gl.glUseProgram(0)
+
+    def draw(self):
+        if self.pending is not None:
+            self.count = self.pending.shape[0]
+            if self.count > 0:
+                self.vboVerts = GPU.updateBuffer(gl.GL_ARRAY_BUFFER, self.vboVerts, self.pending, gl.GL_DYNAMIC_DRAW, 'brush')
+            self.pending = None
+        if self.count == 0 or self.vao is None:
+            return
+
+        gl.glUseProgram(self.material.shaderProg)
+        gl.glBindVertexArray(self.vao)
+
+        gl.glEnableVertexAttribArray(0)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vboVerts)
+        gl.glVertexAttribPointer(
+            0,
+            4,
+            gl.GL_FLOAT,
+            gl.GL_FALSE,
+            0,
+            None
+        )
+
+        gl.glUniformMatrix4fv(
+            gl.glGetUniformLocation(self.material.shaderProg, 'model'),
+            1,
+            gl.GL_FALSE,
+            self.matrix
+        )
+        gl.glUniform4f(
+            gl.glGetUniformLocation(self.material.shaderProg, 'inputColor'),
+            *self.color
+        )
+
+        # drawn over the highlight pass, LEQUAL keeps it on the surface
+        gl.glDepthFunc(gl.GL_LEQUAL)
+        gl.glDrawArrays(gl.GL_POINTS, 0, self.count)
+        gl.glDepthFunc(gl.GL_LESS)
+
+        gl.glDisableVertexAttribArray(0)
+
+        gl.glBindVertexArray(0)
+        gl.glUseProgram(0)
+
+
 class RubberBrush(BrushBase):
+    pinColor = [1., 0., 0., 1.]
+    selectedColor = [1., .8, 0., 1.]
+
     def __init__(self, radius=10., *args):
         super(RubberBrush, self).__init__(radius, *args)
         self.cursorPin = PinPoint()
         self.pins = []
+        # pins picked with shift click, drags move all of them. with none
+        # picked the newest pin is dragged
+        self.selectedPins = np.zeros(0, np.int64)
         self.view = None
         self.projection = None
         self.operator = operators.Rubber()
@@ -236,7 +433,7 @@ class RubberBrush(BrushBase):
             return
 
         if self.alternative and self.view is not None and self.projection is not None:
-            newPin = PinPoint()
+            newPin = PinPoint(self.pinColor)
             newPin.init()
             tempMat = QtGui.QMatrix4x4()
             tempMat.translate(*self.lastHit)
@@ -249,29 +446,95 @@ class RubberBrush(BrushBase):
 
             self.operator.appendPin(self.lastHitID, self.lastHit)
             self.alternative = False
+            self.markDirty('pins')
+
+    def mousePress(self, modifiers, buttons):
+        if buttons == QtCore.Qt.LeftButton and modifiers == QtCore.Qt.ShiftModifier and self.active:
+            self.togglePin(self.lastHit)
+
+    def togglePin(self, position):
+        # the pin nearest position within the brush radius goes in or out of
+        # the selection
+        coords = self.operator.pinCoords
+        if position is None or coords.shape[0] == 0:
+            return
+        distances = np.linalg.norm(coords - position, axis=1)
+        pinIndex = int(np.argmin(distances))
+        if distances[pinIndex] > self.radius:
+            return
+        if pinIndex in self.selectedPins:
+            self.selectedPins = self.selectedPins[self.selectedPins != pinIndex]
+        else:
+            self.selectedPins = np.append(self.selectedPins, pinIndex)
+        for index, pin in enumerate(self.pins):
+            pin.color = self.selectedColor if index in self.selectedPins else self.pinColor
+        self.markDirty('pins')
+
+    def draggedPins(self):
+        if self.selectedPins.shape[0] > 0:
+            return self.selectedPins
+        return np.array([self.operator.pinCoords.shape[0] - 1])
 
     def mouseMoveEvent(self, x, y, modifiers, buttons, viewportCoords, viewMatrix, projectionMatrix, cameraPosition, upsign, dx, dy):
         hit = super(RubberBrush, self).mouseMoveEvent(x, y, modifiers, buttons, viewportCoords, viewMatrix, projectionMatrix, cameraPosition, upsign, dx, dy)
         self.cursorPin.matrix = self.matrix
 
         self.operating = False
-        if buttons == QtCore.Qt.LeftButton and not self.alternative:
-            self.operator.solveDelta(-1, dx, dy, cameraPosition, upsign)
+        if buttons == QtCore.Qt.LeftButton and not self.alternative and self.operator.pinCoords.shape[0] > 0:
+            self.operator.beginStroke()
+            pinIndices = self.draggedPins()
+            if modifiers == QtCore.Qt.ShiftModifier:
+                # spins the group about the view axis through its centre
+                axis = self.operator.pivot(pinIndices) - cameraPosition
+                self.operator.transformPins(pinIndices, rotate=operators.rotationMatrix(axis, dx * -2. * np.pi))
+            elif modifiers == (QtCore.Qt.ControlModifier | QtCore.Qt.ShiftModifier):
+                self.operator.transformPins(pinIndices, scale=np.exp(dy * 4.))
+            else:
+                self.operator.solveDelta(pinIndices, dx, dy, cameraPosition, upsign)
             self.operating = True
-
-            vertID = self.operator.pinVertIDs[-1][0]
-            tempMat = QtGui.QMatrix4x4()
-            tempMat.translate(*(self.activeMesh.points[vertID] + self.activeMesh.offsets[vertID]))
-            tempMat.rotate(QtGui.QQuaternion(1., 0., 0., -1.).normalized())
-            tempMat.rotate(QtGui.QQuaternion(1. / np.linalg.norm(self.lastHitNormal), *self.lastHitNormal).normalized())
-            self.pins[-1].matrix = np.array(tempMat.data(), np.float32).reshape(4, 4)
+            self.markDirty('offsets', 'pins')
+
+            # the markers follow the vertices, not the targets, the solve
+            # only gets them close
+            if self.activeMesh.offsets is None:
+                return hit
+            vertIDs = self.operator.pinVertIDs[pinIndices]
+            positions = self.activeMesh.points[vertIDs] + self.activeMesh.offsets[vertIDs]
+            for pinIndex, position in zip(pinIndices, positions):
+                self.pins[pinIndex].matrix[3, :3] = position
         if buttons == QtCore.Qt.MidButton:
             self.operating = True
             self.adjustingRadius = True
 
         return hit
 
+    def mouseRelease(self):
+        self.operator.endStroke()
+
+    def clearPins(self):
+        for pin in self.pins:
+            pin.release()
+        self.pins = []
+        self.selectedPins = np.zeros(0, np.int64)
+        self.operator.clearPins()
+        self.markDirty('pins')
+
+    def undo(self):
+        return self.restorePins(self.operator.undo())
+
+    def redo(self):
+        return self.restorePins(self.operator.redo())
+
+    def restorePins(self, restored):
+        if restored is None:
+            return False
+        for pin, coords in zip(self.pins, self.operator.pinCoords):
+            pin.matrix[3, :3] = coords
+        self.markDirty('offsets', 'pins')
+        return True
+
     def draw(self):
+        super(RubberBrush, self).draw()
         if (self.active and not self.operating) or self.adjustingRadius:
             self.cursorPin.draw()
         for pin in self.pins:
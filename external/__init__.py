@@ -1,2 +1,24 @@
-import _ExocortexAlembicPython as alembic
-import pyigl as igl
+import importlib
+
+
+class LazyModule(object):
+    # the bindings are big native modules, they are only imported the first
+    # time something is looked up on them
+    def __init__(self, name):
+        self.__dict__['name'] = name
+        self.__dict__['module'] = None
+
+    def load(self):
+        if self.module is None:
+            self.__dict__['module'] = importlib.import_module(self.name)
+        return self.module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.load(), attr, value)
+
+
+alembic = LazyModule('_ExocortexAlembicPython')
+igl = LazyModule('pyigl')
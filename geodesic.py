@@ -0,0 +1,115 @@
+from collections import OrderedDict
+import numpy as np
+
+
+# heat method, Crane et al. "Geodesics in Heat"
+# both linear systems only depend on the mesh so they are factored once and
+# every query is a pair of back substitutions plus a few sparse products
+class HeatGeodesics(object):
+    def __init__(self, positions, triangles, timeScale=1., cacheSize=8):
+        # scipy is only needed once a brush asks for geodesic falloff
+        from scipy import sparse
+        from scipy.sparse import linalg
+        positions = np.asarray(positions, np.float64)
+        triangles = np.asarray(triangles, np.int64).reshape(-1, 3)
+        vertexCount = positions.shape[0]
+
+        corners = positions[triangles]
+        # edge opposite to each corner, counter clockwise
+        edges = np.stack([
+            corners[:, 2] - corners[:, 1],
+            corners[:, 0] - corners[:, 2],
+            corners[:, 1] - corners[:, 0],
+        ], axis=1)
+        normals = np.cross(edges[:, 0], edges[:, 1])
+        doubleAreas = np.linalg.norm(normals, axis=1)
+        doubleAreas[doubleAreas == 0] = 1e-12
+        normals /= doubleAreas[:, None]
+
+        # cotangent of the angle at each corner, from its two adjacent edges
+        cots = np.empty((triangles.shape[0], 3))
+        for c in range(3):
+            a = -edges[:, (c + 1) % 3]
+            b = edges[:, (c + 2) % 3]
+            cots[:, c] = np.einsum('ij,ij->i', a, b) / doubleAreas
+
+        # cotan laplacian, negative semi definite
+        rows = []
+        cols = []
+        vals = []
+        for c in range(3):
+            i = triangles[:, (c + 1) % 3]
+            j = triangles[:, (c + 2) % 3]
+            w = .5 * cots[:, c]
+            rows.extend([i, j, i, j])
+            cols.extend([j, i, i, j])
+            vals.extend([w, w, -w, -w])
+        L = sparse.coo_matrix(
+            (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(vertexCount, vertexCount)
+        ).tocsc()
+
+        masses = np.bincount(triangles.ravel(), np.repeat(doubleAreas / 6., 3), minlength=vertexCount)
+        M = sparse.diags(masses)
+
+        edgeLengths = np.linalg.norm(edges, axis=2)
+        self.time = timeScale * np.mean(edgeLengths) ** 2
+
+        self.heatSolve = linalg.factorized((M - self.time * L).tocsc())
+        # L is singular, a tiny mass term pins the constant
+        self.poissonSolve = linalg.factorized((L - 1e-8 * M).tocsc())
+
+        # gradient of a hat function on a face is N x e / 2A for the opposite edge
+        basis = np.cross(normals[:, None, :], edges) / doubleAreas[:, None, None]
+        faceRows = np.repeat(np.arange(triangles.shape[0] * 3).reshape(-1, 1, 3), 3, axis=1)
+        self.gradient = sparse.csr_matrix(
+            (basis.ravel(), (faceRows.ravel(), np.repeat(triangles, 3))),
+            shape=(triangles.shape[0] * 3, vertexCount)
+        )
+
+        # integrated divergence, 1/2 sum of cot weighted edge projections
+        rows = []
+        cols = []
+        vals = []
+        faceIDs = np.arange(triangles.shape[0])
+        for c in range(3):
+            i = triangles[:, c]
+            e1 = corners[:, (c + 1) % 3] - corners[:, c]
+            e2 = corners[:, (c + 2) % 3] - corners[:, c]
+            w = .5 * (cots[:, (c + 2) % 3, None] * e1 + cots[:, (c + 1) % 3, None] * e2)
+            for axis in range(3):
+                rows.append(i)
+                cols.append(faceIDs * 3 + axis)
+                vals.append(w[:, axis])
+        self.divergence = sparse.csr_matrix(
+            (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(vertexCount, triangles.shape[0] * 3)
+        )
+
+        self.vertexCount = vertexCount
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()
+
+    def distances(self, seed):
+        seed = int(seed)
+        if seed in self.cache:
+            self.cache[seed] = self.cache.pop(seed)
+            return self.cache[seed]
+
+        impulse = np.zeros(self.vertexCount)
+        impulse[seed] = 1.
+        heat = self.heatSolve(impulse)
+
+        field = (self.gradient * heat).reshape(-1, 3)
+        lengths = np.linalg.norm(field, axis=1)
+        lengths[lengths == 0] = 1.
+        field = -field / lengths[:, None]
+
+        phi = self.poissonSolve(self.divergence * field.ravel())
+        phi -= phi[seed]
+        np.maximum(phi, 0., out=phi)
+
+        self.cache[seed] = phi
+        while len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+        return phi
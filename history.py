@@ -0,0 +1,155 @@
+import zlib
+import numpy as np
+from PySide import QtCore
+
+
+class SparseDelta(object):
+    def __init__(self, mesh, vertIDs, before, after, pinsBefore, pinsAfter, quantize=False, compress=False):
+        self.mesh = mesh
+        self.quantize = quantize
+        self.compress = compress
+        self.count = vertIDs.shape[0]
+
+        # vertex ids are sorted, so storing them as deltas keeps them small
+        # and lets zlib squeeze the runs of neighbouring vertices
+        self.vertIDs = self.pack(np.diff(vertIDs, prepend=0).astype(np.uint32))
+        self.before = self.pack(before, self.quantize)
+        self.after = self.pack(after, self.quantize)
+
+        # pins are a handful of coordinates, no need to get clever
+        self.pinsBefore = pinsBefore
+        self.pinsAfter = pinsAfter
+
+    def pack(self, arr, quantize=False):
+        if quantize:
+            arr = arr.astype(np.float16)
+        data = arr.tobytes()
+        if self.compress:
+            data = zlib.compress(data, 1)
+        return (data, arr.dtype, arr.shape)
+
+    def unpack(self, packed):
+        data, dtype, shape = packed
+        if self.compress:
+            data = zlib.decompress(data)
+        return np.frombuffer(data, dtype).reshape(shape)
+
+    def ids(self):
+        return np.cumsum(self.unpack(self.vertIDs), dtype=np.int64)
+
+    def nbytes(self):
+        total = len(self.vertIDs[0]) + len(self.before[0]) + len(self.after[0])
+        if self.pinsBefore is not None:
+            total += self.pinsBefore.nbytes + self.pinsAfter.nbytes
+        return total
+
+    def apply(self, which):
+        vertIDs = self.ids()
+        if which == 'before':
+            values = self.unpack(self.before)
+            pins = self.pinsBefore
+        else:
+            values = self.unpack(self.after)
+            pins = self.pinsAfter
+
+        if self.count > 0:
+            self.mesh.offsets[vertIDs] = values.astype(np.float32)
+            self.mesh.updateOffsets(vertIDs)
+
+        return vertIDs, pins
+
+
+class DeformationHistory(QtCore.QObject):
+    def __init__(self, maxBytes=64 * 1024 * 1024, quantize=False, compress=False, *args):
+        super(DeformationHistory, self).__init__(*args)
+        self.maxBytes = maxBytes
+        self.quantize = quantize
+        self.compress = compress
+
+        self.undoStack = []
+        self.redoStack = []
+
+        # a single full copy only lives for the duration of a stroke
+        self.strokeMesh = None
+        self.strokeOffsets = None
+        self.strokePins = None
+
+    def stroking(self):
+        return self.strokeMesh is not None
+
+    def beginStroke(self, mesh, pinCoords):
+        if mesh is None or mesh.offsets is None:
+            return
+        self.strokeMesh = mesh
+        self.strokeOffsets = mesh.offsets.copy()
+        self.strokePins = np.array(pinCoords, np.float64).reshape(-1, 3)
+
+    def endStroke(self, pinCoords):
+        if not self.stroking():
+            return None
+
+        mesh = self.strokeMesh
+        before = self.strokeOffsets
+        vertIDs = np.where(np.any(mesh.offsets != before, axis=1))[0]
+
+        pinsBefore = self.strokePins
+        pinsAfter = np.array(pinCoords, np.float64).reshape(-1, 3)[:pinsBefore.shape[0]]
+        if np.array_equal(pinsBefore, pinsAfter):
+            pinsBefore = None
+            pinsAfter = None
+
+        self.strokeMesh = None
+        self.strokeOffsets = None
+        self.strokePins = None
+
+        if vertIDs.shape[0] == 0 and pinsBefore is None:
+            return None
+
+        entry = SparseDelta(
+            mesh,
+            vertIDs,
+            before[vertIDs],
+            mesh.offsets[vertIDs],
+            pinsBefore,
+            pinsAfter,
+            quantize=self.quantize,
+            compress=self.compress
+        )
+        self.undoStack.append(entry)
+        self.redoStack = []
+        self.evict()
+        return entry
+
+    def nbytes(self):
+        return sum(entry.nbytes() for entry in self.undoStack + self.redoStack)
+
+    def evict(self):
+        # oldest undo entries go first, redo entries are newer than all of them
+        total = self.nbytes()
+        while total > self.maxBytes and len(self.undoStack) > 0:
+            total -= self.undoStack.pop(0).nbytes()
+        while total > self.maxBytes and len(self.redoStack) > 0:
+            total -= self.redoStack.pop(0).nbytes()
+
+    def undo(self):
+        if len(self.undoStack) == 0:
+            return None
+        entry = self.undoStack.pop()
+        vertIDs, pins = entry.apply('before')
+        self.redoStack.append(entry)
+        return entry.mesh, vertIDs, pins
+
+    def redo(self):
+        if len(self.redoStack) == 0:
+            return None
+        entry = self.redoStack.pop()
+        vertIDs, pins = entry.apply('after')
+        self.undoStack.append(entry)
+        return entry.mesh, vertIDs, pins
+
+    def clear(self):
+        self.undoStack = []
+        self.redoStack = []
+        self.strokeMesh = None
+        self.strokeOffsets = None
+        self.strokePins = None
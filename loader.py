@@ -1,15 +1,22 @@
 import os
+from timeit import default_timer
 import numpy as np
-from PIL import Image
+from PySide import QtCore
 from external import alembic
 import OpenGL.GL as gl
 from objects import Branch, PolyMesh, Camera
+from common import LazyValue, LazyReport
+from resources import GPU
+from playback import TimeSampling
+from profiling import PROFILER, timed
 
 
 def loadTexture(texEnum, filePath):
+    from PIL import Image
     pixels = np.asarray(Image.open(filePath).convert('RGBA'), dtype=np.uint8)
 
-    texid = gl.glGenTextures(1)
+    # a full mip chain adds about a third
+    texid = GPU.createTexture('textures', pixels.nbytes * 4 // 3, filePath)
     gl.glActiveTexture(texEnum)
     gl.glBindTexture(gl.GL_TEXTURE_2D, texid)
 
@@ -37,7 +44,8 @@ def loadTexture(texEnum, filePath):
 
 
 def loadCubeMap(fileRight, fileLeft, fileTop, fileBottom, fileFront, fileBack):
-    texid = gl.glGenTextures(1)
+    from PIL import Image
+    texid = GPU.createTexture('textures', 6 * 256 * 256 * 3 * 4 // 3, fileRight)
     gl.glActiveTexture(gl.GL_TEXTURE_CUBE_MAP)
     gl.glBindTexture(gl.GL_TEXTURE_CUBE_MAP, texid)
 
@@ -102,62 +110,70 @@ ALEMBIC_OPS = {
 }
 
 
+# every op gets the property as a LazyValue and hands the branch a lazy
+# conversion of it, nothing is read from the archive until it is used
 def bboxOp(data, branch):
-    branch.bbox = np.array(data, np.float32)
+    branch.bbox = data.map(lambda values: np.array(values, np.float32))
 
 
-def pointsOp(prop, branch):
+def pointsOp(data, prop, branch):
     if branch.kind == 'PolyMesh':
-        branch.points = np.array(prop.getValues(0), np.float32).reshape(-1, 3)
+        branch.points = data.map(lambda values: np.array(values, np.float32).reshape(-1, 3))
         branch.pointProp = prop
 
 
 def indicesOp(data, branch):
     if branch.kind == 'PolyMesh':
-        branch.indices = np.array(data, np.uint32)
+        branch.indices = data.map(lambda values: np.array(values, np.uint32))
 
 
 def countsOp(data, branch):
     if branch.kind == 'PolyMesh':
-        branch.counts = np.array(data, np.uint32)
+        branch.counts = data.map(lambda values: np.array(values, np.uint32))
 
 
 def uvValsOp(data, branch):
     if branch.kind == 'PolyMesh':
-        branch.uvs = np.array(data, np.float32).reshape(-1, 2)
+        branch.uvs = data.map(lambda values: np.array(values, np.float32).reshape(-1, 2))
 
 
 def uvIndicesOp(data, branch):
+    # uvs stay indexed, see PolyMesh.expandedUVs
     if branch.kind == 'PolyMesh':
-        branch.uvs = branch.uvs[np.array(data, np.uint32)]
+        branch.uvIndices = data.map(lambda values: np.array(values, np.uint32))
         branch.hasUVs = True
 
 
 def xformOp(data, branch):
-    branch.matrix = np.array(data, np.float32).T
+    branch.matrix = data.map(lambda values: np.array(values, np.float32).T)
+
+
+CAMERA_CORE_FIELDS = (
+    'focalLength',
+    'horizontalAperture',
+    'horizontalFilmOffset',
+    'verticalAperture',
+    'verticalFilmOffset',
+    'lensSqueezeRatio',
+    'overscanLeft',
+    'overscanRight',
+    'overscanTop',
+    'overscanBottom',
+    'fStop',
+    'focusDistance',
+    'shutterOpen',
+    'shutterClose',
+    'nearClippingPlane',
+    'farClippingPlane',
+)
 
 
 def coreOp(data, branch):
     if branch.kind == 'Camera':
-        branch.focalLength = data[0]
-        branch.horizontalAperture = data[1]
-        branch.horizontalFilmOffset = data[2]
-        branch.verticalAperture = data[3]
-        branch.verticalFilmOffset = data[4]
-        branch.lensSqueezeRatio = data[5]
-        branch.overscanLeft = data[6]
-        branch.overscanRight = data[7]
-        branch.overscanTop = data[8]
-        branch.overscanBottom = data[9]
-        branch.fStop = data[10]
-        branch.focusDistance = data[11]
-        branch.shutterOpen = data[12]
-        branch.shutterClose = data[13]
-        branch.nearClippingPlane = data[14]
-        branch.farClippingPlane = data[15]
-
-
-def parseProperties(prop, objPath, objType, branch, compound=None):
+        branch.core = data.map(lambda values: dict(zip(CAMERA_CORE_FIELDS, values)))
+
+
+def parseProperties(prop, objPath, objType, branch, compound=None, report=None):
     if prop.isCompound():
         propName = prop.getName()
         for subPropName in prop.getPropertyNames():
@@ -166,57 +182,153 @@ def parseProperties(prop, objPath, objType, branch, compound=None):
                 objPath,
                 objType,
                 branch,
-                compound=propName
+                compound=propName,
+                report=report
             )
     else:
         propName = prop.getName()
+        reportName = propName if compound is None else '%s/%s' % (compound, propName)
         if propName == 'P':
             ALEMBIC_OPS['P'](
-                (prop, branch)
+                (LazyValue(lambda: prop.getValues(0), reportName, report), prop, branch)
             )
         elif propName in ALEMBIC_OPS:
             ALEMBIC_OPS[propName](
-                (prop.getValues(0), branch)
+                (LazyValue(lambda: prop.getValues(0), reportName, report), branch)
             )
         elif compound in ALEMBIC_OPS:
             ALEMBIC_OPS[compound][propName](
-                (prop.getValues(0), branch)
+                (LazyValue(lambda: prop.getValues(0), reportName, report), branch)
             )
         else:
             # print propName
             pass
 
 
-def rootFromAlembic(filePath):
+def openArchive(filePath):
     archive = alembic.getIArchive(filePath)
     root = Branch('/', rootName=os.path.basename(filePath), isRoot=True)
+    root.propertyReport = LazyReport()
+    root.filePath = filePath
+
+    root.timeSamplings = [
+        TimeSampling(timeSample.getType(), timeSample.getTimeSamples())
+        for timeSample in archive.getSampleTimes()
+    ]
+    return archive, root
 
-    sampleTimes = archive.getSampleTimes()
-    for timeSample in sampleTimes:
-        timeSample.getType()
-        timeSample.getTimeSamples()  # obj.getTsIndex()
 
-    for objPath in archive.getIdentifiers():
-        obj = archive.getObject(objPath)
-        objType = obj.getType()
-
-        branch = None
-        if objType.startswith('AbcGeom_PolyMesh'):
-            branch = PolyMesh(objPath)
-        elif objType.startswith('AbcGeom_Xform'):
-            branch = Branch(objPath)
-        elif objType.startswith('AbcGeom_Camera'):
-            branch = Camera(objPath)
-        else:
-            # print objType
-            continue
+def branchFromObject(archive, root, objPath):
+    obj = archive.getObject(objPath)
+    objType = obj.getType()
 
-        obj.getTsIndex()  # time sampling index
-        obj.getMetaData()
-        for p in obj.getPropertyNames():
-            prop = obj.getProperty(p)
-            parseProperties(prop, objPath, objType, branch)
+    branch = None
+    if objType.startswith('AbcGeom_PolyMesh'):
+        branch = PolyMesh(objPath)
+    elif objType.startswith('AbcGeom_Xform'):
+        branch = Branch(objPath)
+    elif objType.startswith('AbcGeom_Camera'):
+        branch = Camera(objPath)
+    else:
+        # print objType
+        return None
 
-        root.map[objPath] = branch
+    tsIndex = obj.getTsIndex()
+    if tsIndex < len(root.timeSamplings):
+        branch.timeSampling = root.timeSamplings[tsIndex]
+    obj.getMetaData()
+    for p in obj.getPropertyNames():
+        prop = obj.getProperty(p)
+        parseProperties(prop, objPath, objType, branch, report=root.propertyReport)
+
+    return branch
+
+
+@timed('rootFromAlembic')
+def rootFromAlembic(filePath):
+    archive, root = openArchive(filePath)
+    for objPath in archive.getIdentifiers():
+        branch = branchFromObject(archive, root, objPath)
+        if branch is not None:
+            # same as SceneLoader, so the headless tools skip the same frames
+            if branch.kind == 'PolyMesh':
+                branch.classifySamples()
+            root.map[objPath] = branch
 
     return root
+
+
+class SceneLoader(QtCore.QObject):
+    # parses an archive on a worker thread and hands the branches over in
+    # small batches. meshes arrive already triangulated so all that is left
+    # for the gui thread is the gpu upload, see App.processUploads
+    rootSignal = QtCore.Signal(object)
+    branchesSignal = QtCore.Signal(list)
+    # meshes whose lod levels are ready to go up, after everything is loaded
+    lodsSignal = QtCore.Signal(list)
+    finishedSignal = QtCore.Signal(str, int, float)
+
+    def __init__(self, filePath, targetThread, batchTime=.02, *args):
+        super(SceneLoader, self).__init__(*args)
+        self.filePath = filePath
+        # branches are handed to this thread so their signals stay direct
+        self.targetThread = targetThread
+        self.batchTime = batchTime
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        start = default_timer()
+        count = 0
+        try:
+            archive, root = openArchive(self.filePath)
+            root.moveToThread(self.targetThread)
+            self.rootSignal.emit(root)
+
+            meshes = []
+            batch = []
+            batchStart = default_timer()
+            for objPath in archive.getIdentifiers():
+                if self.cancelled:
+                    break
+                with PROFILER.scope('SceneLoader.branch'):
+                    branch = branchFromObject(archive, root, objPath)
+                    if branch is None:
+                        continue
+                    if branch.kind == 'PolyMesh':
+                        branch.prepMesh()
+                        branch.classifySamples()
+                        meshes.append(branch)
+                branch.moveToThread(self.targetThread)
+                batch.append(branch)
+                count += 1
+
+                if default_timer() - batchStart > self.batchTime:
+                    self.branchesSignal.emit(batch)
+                    batch = []
+                    batchStart = default_timer()
+
+            if len(batch) > 0:
+                self.branchesSignal.emit(batch)
+        finally:
+            self.finishedSignal.emit(self.filePath, count, default_timer() - start)
+
+        self.buildLods(meshes)
+
+    def buildLods(self, meshes):
+        # the full scene is already on screen by now, levels follow in batches
+        batch = []
+        batchStart = default_timer()
+        for mesh in meshes:
+            if self.cancelled:
+                return
+            if mesh.buildLods() > 0:
+                batch.append(mesh)
+            if default_timer() - batchStart > self.batchTime and len(batch) > 0:
+                self.lodsSignal.emit(batch)
+                batch = []
+                batchStart = default_timer()
+        if len(batch) > 0:
+            self.lodsSignal.emit(batch)
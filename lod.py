@@ -0,0 +1,103 @@
+import math
+import numpy as np
+
+
+def clusterTriangles(points, triangles, cells):
+    # vertex clustering (Rossignac and Borrel). vertices sharing a grid cell
+    # collapse onto the one closest to the cell average, so every level
+    # indexes the original vertex buffer and follows its animation
+    points = np.asarray(points, np.float32)
+    triangles = np.asarray(triangles, np.int64).reshape(-1, 3)
+    lo = points.min(axis=0)
+    cellSize = max(float(np.ptp(points, axis=0).max()), 1e-12) / cells
+    coords = np.minimum(((points - lo) / cellSize).astype(np.int64), cells - 1)
+    cellIDs = (coords[:, 0] * cells + coords[:, 1]) * cells + coords[:, 2]
+
+    uniqueIDs, inverse = np.unique(cellIDs, return_inverse=True)
+    inverse = inverse.ravel()
+    population = np.bincount(inverse).astype(np.float32)
+    means = np.stack([
+        np.bincount(inverse, points[:, axis]) / population for axis in range(3)
+    ], axis=1)
+    distances = np.linalg.norm(points - means[inverse], axis=1)
+    byCell = np.lexsort((distances, inverse))
+    firsts = np.ones(byCell.shape[0], bool)
+    firsts[1:] = inverse[byCell][1:] != inverse[byCell][:-1]
+    representatives = np.empty(uniqueIDs.shape[0], np.int64)
+    representatives[inverse[byCell][firsts]] = byCell[firsts]
+
+    collapsed = representatives[inverse][triangles]
+    keep = (
+        (collapsed[:, 0] != collapsed[:, 1]) &
+        (collapsed[:, 1] != collapsed[:, 2]) &
+        (collapsed[:, 2] != collapsed[:, 0])
+    )
+    collapsed = collapsed[keep]
+    if collapsed.shape[0] == 0:
+        return collapsed
+
+    # duplicates only count when they also face the same way, rows are
+    # rotated so the smallest id comes first without changing the winding
+    shift = np.argmin(collapsed, axis=1)
+    rows = np.arange(collapsed.shape[0])[:, np.newaxis]
+    rotated = collapsed[rows, (shift[:, np.newaxis] + np.arange(3)) % 3]
+    _, firstRows = np.unique(rotated, axis=0, return_index=True)
+    return collapsed[np.sort(firstRows)]
+
+
+def buildLevels(points, triangles, ratio=.25, minTriangles=256, maxLevels=4):
+    # each level aims for ratio times the triangles of the one before. the
+    # grid resolution is narrowed down until it gets there
+    triangles = np.asarray(triangles, np.int64).reshape(-1, 3)
+    levels = []
+    count = triangles.shape[0]
+    cells = max(2, int(math.sqrt(count)))
+    while len(levels) < maxLevels and count * ratio >= minTriangles:
+        target = count * ratio
+        level = clusterTriangles(points, triangles, cells)
+        while level.shape[0] > target and cells > 2:
+            cells = max(2, int(cells * math.sqrt(max(target, 1.) / level.shape[0]) * .95))
+            level = clusterTriangles(points, triangles, cells)
+        if level.shape[0] == 0 or level.shape[0] > count * .9:
+            break
+        levels.append(level)
+        count = level.shape[0]
+    return levels
+
+
+def boundingSphere(points):
+    points = np.asarray(points, np.float32)
+    if points.shape[0] == 0:
+        return np.zeros(3), 0.
+    lo = points.min(axis=0)
+    hi = points.max(axis=0)
+    return (lo + hi) * .5, float(np.linalg.norm(hi - lo) * .5)
+
+
+class LodView(object):
+    # what the renderer needs to pick a level for a mesh this frame. levels
+    # are only drawn while coarse is set, the camera moving or playback not
+    # keeping up. a level is fine enough when it spends at most one triangle
+    # per pixelsPerTriangle pixels of the mesh's projected bounding sphere
+    pixelsPerTriangle = 32.
+
+    def __init__(self, eye, fov, viewportHeight, coarse=False, fullDetail=None):
+        self.eye = np.asarray(eye, np.float64)
+        self.focalPixels = viewportHeight * .5 / math.tan(math.radians(fov) * .5)
+        self.coarse = coarse
+        # drawn at full resolution no matter what, the mesh being edited
+        self.fullDetail = fullDetail
+
+    def pixelRadius(self, center, radius):
+        distance = float(np.linalg.norm(np.asarray(center) - self.eye))
+        if distance <= radius:
+            return float('inf')
+        return radius * self.focalPixels / distance
+
+    def level(self, triangleCounts, center, radius):
+        # triangleCounts goes from full resolution to coarsest
+        budget = math.pi * self.pixelRadius(center, radius) ** 2 / self.pixelsPerTriangle
+        for level, count in enumerate(triangleCounts):
+            if count <= budget:
+                return level
+        return len(triangleCounts) - 1
@@ -1,16 +1,36 @@
 import sys
 import os
-from widgets import MainWindow as mkWindow
-from PySide import QtGui
+from startup import StartupProfiler
 
 
 if __name__ == '__main__':
+    startup = None
+    if '--profile-startup' in sys.argv:
+        sys.argv.remove('--profile-startup')
+        startup = StartupProfiler()
+        startup.install()
+
+    from PySide import QtGui, QtCore
+    from widgets import MainWindow as mkWindow
+    if startup is not None:
+        startup.mark('imports')
+
     app = QtGui.QApplication(sys.argv)
     app.setStyle('fusion')
     wnd = mkWindow()
+    if startup is not None:
+        startup.mark('window created')
+        wnd.viewer.initSignal.connect(lambda: startup.mark('gl initialized'))
     wnd.show()
 
     thisDir = os.getcwd()
     wnd.loadAlembic(os.path.join(thisDir, 'res', 'hunter.abc'))
 
+    if startup is not None:
+        def reportStartup():
+            startup.mark('first events processed')
+            startup.uninstall()
+            sys.stdout.write(startup.report() + '\n')
+        QtCore.QTimer.singleShot(0, reportStartup)
+
     sys.exit(app.exec_())
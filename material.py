@@ -1,40 +1,61 @@
 import OpenGL.GL as gl
 from OpenGL.GL import shaders
 from PySide import QtCore
+from profiling import timed
+from resources import GPU
 
 
 class BaseMaterial(QtCore.QObject):
+    # shaders are compiled the first time the program is asked for, so
+    # materials can be created before there is a context and the unused ones
+    # never cost a compile
+    # materials reading the normal attribute at location 2 set this, meshes
+    # only build and upload normals for those
+    needsNormals = False
+    # vertices per patch for materials with tessellation stages, meshes draw
+    # GL_PATCHES instead of triangles for those
+    patchVertices = 0
+
     def __init__(self, vertexShader=None, tessContShader=None, tessEvalShader=None, geometryShader=None, fragmentShader=None):
         super(BaseMaterial, self).__init__()
-        self.shaderProg = None
-        shaderList = []
-        if vertexShader is not None:
-            shaderList.append(shaders.compileShader(
-                vertexShader,
-                gl.GL_VERTEX_SHADER)
-            )
-        if tessContShader is not None:
-            shaderList.append(shaders.compileShader(
-                tessContShader,
-                gl.GL_TESS_CONTROL_SHADER)
-            )
-        if tessEvalShader is not None:
-            shaderList.append(shaders.compileShader(
-                tessEvalShader,
-                gl.GL_TESS_EVALUATION_SHADER)
-            )
-        if geometryShader is not None:
-            shaderList.append(shaders.compileShader(
-                geometryShader,
-                gl.GL_GEOMETRY_SHADER)
-            )
-        if fragmentShader is not None:
-            shaderList.append(shaders.compileShader(
-                fragmentShader,
-                gl.GL_FRAGMENT_SHADER)
-            )
+        self.program = None
+        self.sources = [
+            (vertexShader, gl.GL_VERTEX_SHADER),
+            (tessContShader, gl.GL_TESS_CONTROL_SHADER),
+            (tessEvalShader, gl.GL_TESS_EVALUATION_SHADER),
+            (geometryShader, gl.GL_GEOMETRY_SHADER),
+            (fragmentShader, gl.GL_FRAGMENT_SHADER),
+        ]
+
+    @property
+    def shaderProg(self):
+        if self.program is None:
+            self.program = self.compile()
+        return self.program
+
+    @timed('BaseMaterial.compile')
+    def compile(self):
+        shaderList = [
+            shaders.compileShader(source, stage)
+            for source, stage in self.sources
+            if source is not None
+        ]
         if len(shaderList) > 0:
-            self.shaderProg = shaders.compileProgram(*shaderList)
+            return GPU.track('program', shaders.compileProgram(*shaderList), 'programs', owner=type(self).__name__)
+        return None
+
+    def retain(self):
+        # for materials shared between objects, every user retains once and
+        # releases once. the first one compiles the program
+        if self.program is None:
+            self.program = self.compile()
+        else:
+            GPU.retain('program', self.program)
+        return self
+
+    def release(self):
+        if GPU.release('program', self.program):
+            self.program = None
 
 
 constantVertCode = '''
@@ -67,19 +88,57 @@ class ConstantMaterial(BaseMaterial):
         )
 
 
+footprintVertCode = '''
+#version 450 core
+// xyz position, w falloff weight
+layout(location = 0) in vec4 vert;
+uniform mat4 model;
+uniform mat4 view;
+uniform mat4 projection;
+out float weight;
+void main() {
+    gl_Position = projection * view * model * vec4(vert.xyz, 1.);
+    gl_PointSize = 4.;
+    weight = vert.w;
+}
+'''
+
+footprintFragCode = '''
+#version 450 core
+uniform vec4 inputColor;
+in float weight;
+out vec4 fragColor;
+void main() {
+    fragColor = vec4(inputColor.rgb * (.25 + .75 * weight), 1.);
+}
+'''
+
+
+class FootprintMaterial(BaseMaterial):
+    def __init__(self):
+        super(FootprintMaterial, self).__init__(
+            vertexShader=footprintVertCode,
+            fragmentShader=footprintFragCode
+        )
+
+
 vertCode = '''
 #version 450 core
-layout(location = 0) in vec3 vert;
+layout(location = 0) in vec4 vert;
+layout(location = 1) in vec3 offset;
 
 uniform mat4 model;
 uniform mat4 view;
 uniform mat4 projection;
+// compact positions come normalized to their bounding box
+uniform vec3 positionScale;
+uniform vec3 positionBias;
 
 out vec3 vPosition;
 
 void main()
 {
-    vPosition = vert;
+    vPosition = vert.xyz * positionScale + positionBias + offset;
     gl_Position = projection * view * model * vec4(vPosition, 1.);
 }
 '''
@@ -161,3 +220,129 @@ class MatcapMaterial(BaseMaterial):
             geometryShader=geometryCode,
             fragmentShader=fragCode
         )
+
+
+smoothVertCode = '''
+#version 450 core
+layout(location = 0) in vec4 vert;
+layout(location = 1) in vec3 offset;
+layout(location = 2) in vec4 normal;
+
+uniform vec3 positionScale;
+uniform vec3 positionBias;
+
+out vec3 vPosition;
+out vec3 vNormal;
+
+void main()
+{
+    vPosition = vert.xyz * positionScale + positionBias + offset;
+    vNormal = normalize(normal.xyz);
+}
+'''
+
+smoothTessContCode = '''
+#version 450 core
+
+layout(vertices = 3) out;
+
+in vec3 vPosition[];
+in vec3 vNormal[];
+
+uniform mat4 model;
+uniform mat4 view;
+uniform mat4 projection;
+uniform vec2 viewportSize;
+// target length of a tessellated edge on screen
+uniform float edgePixels = 12.;
+uniform float maxLevel = 16.;
+
+out vec3 tcPosition[];
+out vec3 tcNormal[];
+
+vec4 toClip(vec3 p)
+{
+    return projection * view * model * vec4(p, 1.);
+}
+
+// only depends on the two end points so neighbouring patches agree and
+// the surface stays watertight
+float edgeLevel(vec3 a, vec3 b)
+{
+    vec4 ca = toClip(a);
+    vec4 cb = toClip(b);
+    if (ca.w <= 0. || cb.w <= 0.) {
+        return 1.;
+    }
+    vec2 sa = ca.xy / ca.w * .5 * viewportSize;
+    vec2 sb = cb.xy / cb.w * .5 * viewportSize;
+    return clamp(distance(sa, sb) / edgePixels, 1., maxLevel);
+}
+
+void main()
+{
+    tcPosition[gl_InvocationID] = vPosition[gl_InvocationID];
+    tcNormal[gl_InvocationID] = vNormal[gl_InvocationID];
+
+    if (gl_InvocationID == 0) {
+        gl_TessLevelOuter[0] = edgeLevel(vPosition[1], vPosition[2]);
+        gl_TessLevelOuter[1] = edgeLevel(vPosition[2], vPosition[0]);
+        gl_TessLevelOuter[2] = edgeLevel(vPosition[0], vPosition[1]);
+        gl_TessLevelInner[0] = max(
+            gl_TessLevelOuter[0],
+            max(gl_TessLevelOuter[1], gl_TessLevelOuter[2])
+        );
+    }
+}
+'''
+
+smoothTessEvalCode = '''
+#version 450 core
+
+layout(triangles, fractional_odd_spacing, ccw) in;
+
+in vec3 tcPosition[];
+in vec3 tcNormal[];
+
+uniform mat4 model;
+uniform mat4 view;
+uniform mat4 projection;
+// 0 is the flat cage, 1 full phong tessellation
+uniform float shapeFactor = .75;
+
+out vec3 gPosition;
+out vec3 gNormal;
+
+vec3 tangentPlane(vec3 p, int i)
+{
+    return p - dot(p - tcPosition[i], tcNormal[i]) * tcNormal[i];
+}
+
+void main()
+{
+    vec3 b = gl_TessCoord;
+    vec3 base = b.x * tcPosition[0] + b.y * tcPosition[1] + b.z * tcPosition[2];
+    vec3 phong = b.x * tangentPlane(base, 0) + b.y * tangentPlane(base, 1) + b.z * tangentPlane(base, 2);
+    vec3 normal = normalize(b.x * tcNormal[0] + b.y * tcNormal[1] + b.z * tcNormal[2]);
+
+    gPosition = mix(base, phong, shapeFactor);
+    gNormal = normalize(transpose(inverse(mat3(view * model))) * normal);
+    gl_Position = projection * view * model * vec4(gPosition, 1.);
+}
+'''
+
+
+class SmoothPreviewMaterial(BaseMaterial):
+    # phong tessellation of the cage on the gpu (Boubekeur and Alexa 2008),
+    # levels follow the projected edge lengths. only the display is smooth,
+    # the solver and picking keep working on the cage
+    needsNormals = True
+    patchVertices = 3
+
+    def __init__(self):
+        super(SmoothPreviewMaterial, self).__init__(
+            vertexShader=smoothVertCode,
+            tessContShader=smoothTessContCode,
+            tessEvalShader=smoothTessEvalCode,
+            fragmentShader=fragCode
+        )
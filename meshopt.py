@@ -0,0 +1,116 @@
+import numpy as np
+
+
+# Sander et al. "Fast Triangle Reordering for Vertex Locality and Reduced
+# Overdraw" (tipsify). triangles are emitted in fans around a vertex, the
+# next fan is picked among the vertices just emitted that will still be in
+# the post transform cache. linear in the triangle count but sequential, so
+# it runs on plain lists on the loader thread
+def tipsify(triangles, vertexCount, cacheSize=16):
+    triangles = np.asarray(triangles).reshape(-1, 3)
+    flat = triangles.ravel().astype(np.int64)
+    # triangles around each vertex, as CSR
+    counts = np.bincount(flat, minlength=vertexCount)
+    offsets = np.concatenate([[0], np.cumsum(counts)]).tolist()
+    adjacent = (np.argsort(flat, kind='mergesort') // 3).tolist()
+    corners = triangles.tolist()
+
+    live = counts.tolist()
+    cacheTime = [0] * vertexCount
+    emitted = bytearray(len(corners))
+    deadEnd = []
+    order = []
+
+    time = cacheSize + 1
+    cursor = 0
+    fanning = 0 if len(corners) > 0 else -1
+    while fanning >= 0:
+        candidates = []
+        for t in adjacent[offsets[fanning]:offsets[fanning + 1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = 1
+            order.append(t)
+            for v in corners[t]:
+                deadEnd.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time - cacheTime[v] > cacheSize:
+                    cacheTime[v] = time
+                    time += 1
+
+        # best candidate is the oldest one that will still be cached after
+        # its remaining triangles went through
+        fanning = -1
+        bestPriority = -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = 0
+                if time - cacheTime[v] + 2 * live[v] <= cacheSize:
+                    priority = time - cacheTime[v]
+                if priority > bestPriority:
+                    fanning = v
+                    bestPriority = priority
+
+        if fanning < 0:
+            while len(deadEnd) > 0:
+                v = deadEnd.pop()
+                if live[v] > 0:
+                    fanning = v
+                    break
+        if fanning < 0:
+            while cursor < vertexCount:
+                if live[cursor] > 0:
+                    fanning = cursor
+                    break
+                cursor += 1
+
+    return triangles[np.array(order, np.int64)]
+
+
+def vertexOrder(triangles, vertexCount):
+    # vertices by first use in the index stream, unused ones at the end
+    flat = np.asarray(triangles).ravel()
+    used, first = np.unique(flat, return_index=True)
+    order = used[np.argsort(first, kind='stable')]
+    if order.shape[0] < vertexCount:
+        unused = np.setdiff1d(np.arange(vertexCount), used, assume_unique=True)
+        order = np.concatenate([order, unused])
+    return order.astype(np.int64)
+
+
+def compactIndices(triangles, vertexCount):
+    # 16 bit indices whenever every vertex fits
+    if vertexCount <= 65536:
+        return np.ascontiguousarray(triangles, np.uint16)
+    return np.ascontiguousarray(triangles, np.uint32)
+
+
+def acmr(triangles, cacheSize=32):
+    # average cache miss ratio of a fifo post transform cache, vertices
+    # transformed per triangle. 3 is the worst, around .6 the best
+    cache = []
+    cached = set()
+    misses = 0
+    for v in np.asarray(triangles).ravel().tolist():
+        if v in cached:
+            continue
+        misses += 1
+        cache.append(v)
+        cached.add(v)
+        if len(cache) > cacheSize:
+            cached.discard(cache.pop(0))
+    return misses / float(max(1, np.asarray(triangles).reshape(-1, 3).shape[0]))
+
+
+def optimizeIndices(triangles, vertexCount, reorderVertices=False, cacheSize=16):
+    # returns the index buffer to draw with and, when vertices are reordered,
+    # the order they have to be uploaded in
+    ordered = tipsify(triangles, vertexCount, cacheSize)
+    order = None
+    if reorderVertices:
+        order = vertexOrder(ordered, vertexCount)
+        rank = np.empty(vertexCount, np.int64)
+        rank[order] = np.arange(vertexCount)
+        ordered = rank[ordered]
+    return compactIndices(ordered, vertexCount), order
@@ -1,10 +1,20 @@
 import math
+import hashlib
 import numpy as np
 from external import igl
 import OpenGL.GL as gl
 from PySide import QtGui, QtCore
 from material import BaseMaterial
-from common import normalize
+from common import normalize, LazyAttribute
+from spatial import AABBTree, HashGrid, triangleAdjacency
+from geodesic import HeatGeodesics
+from playback import TimeSampling
+from samples import SampleStore
+from resources import GPU
+import meshopt
+import vertexformats
+import lod
+from profiling import timed
 
 
 # this is to cache the unpack indices so we dont' have to regenerate
@@ -15,9 +25,13 @@ UNPACK_TRIANGLES_COUNTMAPS = {}
 class Branch(QtCore.QObject):
 
     drawSignal = QtCore.Signal((BaseMaterial, bool))
-    updateSampleSignal = QtCore.Signal(int)
+    updateTimeSignal = QtCore.Signal(float)
     accumXformSignal = QtCore.Signal(np.ndarray)
 
+    # the loader assigns these lazily, see loader.parseProperties
+    matrix = LazyAttribute('matrix')
+    bbox = LazyAttribute('bbox')
+
     def __init__(self, path, kind='Branch', isRoot=False, rootName='/'):
         super(Branch, self).__init__(parent=None)
         self.isRoot = isRoot
@@ -25,6 +39,14 @@ class Branch(QtCore.QObject):
             self.name = rootName
             self.path = '/'
             self.map = {'/': self}
+            self.timeSamplings = []
+            # bumped by meshes whenever a sample actually went to the gpu
+            self.sampleUploads = 0
+            self.sampleSkips = 0
+            # streamed branches whose parent hasn't arrived yet, by parent path
+            self.orphans = {}
+            # set by the renderer every frame, see PolyMesh.lodLevel
+            self.lodView = None
         else:
             self.path = path
             self.name = path.split('/')[-1]
@@ -38,6 +60,10 @@ class Branch(QtCore.QObject):
         self.kind = kind
         self.bbox = None
         self.matrix = np.identity(4).T
+        # replaced by the archive's sampling on load, defaults to one sample per 24fps frame
+        self.timeSampling = TimeSampling()
+        # 'static', 'piecewise' or 'animated' once classified, see PolyMesh.classifySamples
+        self.motion = None
 
     @staticmethod
     def allParents(path):
@@ -90,8 +116,7 @@ class Branch(QtCore.QObject):
         for path, branch in self.map.iteritems():
             if path == '/':
                 continue
-            self.drawSignal.connect(branch.drawSlot)
-            self.updateSampleSignal.connect(branch.updateSampleSlot)
+            self.connectBranch(branch)
 
         for leafPath in self.iterateLeaves(self.map.keys()):
             rsortedParentPaths = list(reversed(sorted(self.allParents(leafPath))))
@@ -104,6 +129,30 @@ class Branch(QtCore.QObject):
         # signals children and expects them to propagate
         self.accumXformSignal.emit(self.matrix)
 
+    def connectBranch(self, branch):
+        branch.root = self
+        self.drawSignal.connect(branch.drawSlot)
+        # static branches look the same at every time, they never get ticks
+        if branch.motion != 'static':
+            self.updateTimeSignal.connect(branch.updateTimeSlot)
+
+    def addBranch(self, branch):
+        # progressive loading, links a branch into the hierarchy as it
+        # arrives. drawing and time updates are connected separately once
+        # the branch is ready for them, see App.processUploads
+        if not self.isRoot:
+            return
+        path = branch.path
+        self.map[path] = branch
+
+        parentPath = path.rsplit('/', 1)[0] or '/'
+        if parentPath in self.map:
+            self.setupChild(parentPath, path)
+        else:
+            self.orphans.setdefault(parentPath, []).append(path)
+        for childPath in self.orphans.pop(path, []):
+            self.setupChild(path, childPath)
+
     def drawSlot(self, material, parentVisible):
         gl.glUseProgram(material.shaderProg)
         gl.glUniformMatrix4fv(
@@ -120,11 +169,22 @@ class Branch(QtCore.QObject):
         self.visible = parentVisible or self.alwaysVisible
         self.draw(material)
 
-    def updateSampleSlot(self, sampleIndex):
+    def updateTimeSlot(self, time):
         if self.isRoot:
-            self.updateSampleSignal.emit(sampleIndex)  # signals all members
+            self.updateTimeSignal.emit(time)  # signals all members
         # TODO handle xform and bbox samples
-        self.updateSample(sampleIndex)
+        self.updateSample(self.timeSampling.sampleIndex(time, self.sampleCount()))
+
+    def sampleCount(self):
+        return 1
+
+    def release(self):
+        # gives back the gpu objects of this branch, or of the whole scene
+        # when called on the root
+        if self.isRoot:
+            for path, branch in self.map.items():
+                if path != '/':
+                    branch.release()
 
     def draw(self, material):
         pass
@@ -137,8 +197,12 @@ class Camera(Branch):
 
     cameraChangedSignal = QtCore.Signal((np.ndarray, np.ndarray))  # viewMatrix, projectionMatrix
 
+    # alembic camera schema values by name, see loader.CAMERA_CORE_FIELDS
+    core = LazyAttribute('core')
+
     def __init__(self, path):
         super(Camera, self).__init__(path, 'Camera')
+        self.core = None
 
         self.fov = 30
         self.aspect = 1.
@@ -151,6 +215,8 @@ class Camera(Branch):
         self.target = np.array([0., 0., 0.], np.float32)
         self.orbit(math.radians(-45), math.radians(-45))
         self.navigating = False
+        # wheel zooms have no release, App.settle ends them
+        self.wheeling = False
 
     def cameraChanged(self):
         self.cameraChangedSignal.emit(self.viewMatrix(), self.projectionMatrix())
@@ -238,18 +304,47 @@ class Camera(Branch):
             self.navigating = False
 
     def wheelEvent(self, event):
-        if (event.modifiers() & QtCore.Qt.ControlModifier):
+        self.wheel(event.delta(), event.modifiers())
+
+    def wheel(self, delta, modifiers):
+        if (modifiers & QtCore.Qt.ControlModifier):
             # TODO fov, focal length
             pass
         else:
-            self.zoom(event.delta() * (self.radius / 1000.))
+            self.wheeling = True
+            self.zoom(delta * (self.radius / 1000.))
 
 
 class PolyMesh(Branch):
+
+    # index buffers are reordered for the post transform cache at load.
+    # vertex reordering also makes fetches sequential but every upload then
+    # has to gather, so it is off by default
+    cacheOptimize = True
+    reorderVertices = False
+    # vertex encodings, see vertexformats. a mesh falls back to float32 on
+    # its own when the encoding error would go past positionTolerance times
+    # its short edge length
+    positionFormat = 'int16'
+    offsetFormat = 'float16'
+    positionTolerance = .01
+
+    points = LazyAttribute('points')
+    indices = LazyAttribute('indices')
+    counts = LazyAttribute('counts')
+    uvs = LazyAttribute('uvs')
+    uvIndices = LazyAttribute('uvIndices')
+
     def __init__(self, path):
         super(PolyMesh, self).__init__(path, 'PolyMesh')
         self.triCount = None
         self.trimap = None
+        # what actually goes to the gpu, see prepDrawIndices. trimap keeps
+        # the original triangle order and vertex ids for the solver and picking
+        self.drawIndices = None
+        self.indexType = gl.GL_UNSIGNED_INT
+        self.vertexOrder = None
+        self.vertexRank = None
 
         # these are going to be consumed on unpackTriangles
         # as they turn into buffers
@@ -258,15 +353,57 @@ class PolyMesh(Branch):
         self.points = None
         self.offsets = None
 
+        # face varying uvs are kept indexed, uvIndices has one entry per
+        # face corner in the order of indices
+        self.uvs = None
+        self.uvIndices = None
+        self.hasUVs = False
+
         # this is the sample property for points from alembic
         self.pointProp = None
+        # optional in memory copy of every point sample, see cacheSamples
+        self.sampleStore = None
+        # for every sample the first sample with the same content, and the
+        # content currently on the gpu. see classifySamples
+        self.sampleKeys = None
+        self.currentKey = None
 
         self.vao = None
         self.vboVerts = None
         self.vboIndices = None
+        # offsets get their own buffer the first time the mesh is deformed,
+        # normals the first time a material asks for them
+        self.vboOffsets = None
+        self.vboNormals = None
+        self.normalsDirty = True
+        # encodings in use and the decode uniforms for the positions
+        self.positionEncoding = 'float32'
+        self.offsetEncoding = 'float32'
+        self.positionScale = vertexformats.IDENTITY_SCALE
+        self.positionBias = vertexformats.IDENTITY_BIAS
+        self.edgeLength = 0.
+
+        # decimated index buffers into the same vertices, coarsest last.
+        # built in the background after load, see buildLods
+        self.lodIndices = None
+        self.lodBuffers = []
+        self.lodCenter = None
+        self.lodRadius = 0.
+
+        # picking acceleration, built on first query and refit after uploads
+        self.bvh = None
+        self.bvhDirty = False
+        self.triAdjacency = None
+        # brush radius queries, vertices moved since the last query are
+        # collected so the grid only re-buckets those
+        self.grid = None
+        self.gridDirtyIDs = []
+        # prefactored on the undeformed shape, see getGeodesics
+        self.geodesics = None
 
         self.initialized = False
 
+    @timed('PolyMesh.prepMesh')
     def prepMesh(self):
         # TODO make trimap as well so we can unpack samples with it
         trimap = []
@@ -338,6 +475,8 @@ class PolyMesh(Branch):
 
         self.trimap = np.array(trimap, np.uint32).reshape(-1, 3)
         self.triCount = self.trimap.shape[0] * 3
+        self.prepDrawIndices()
+        self.edgeLength = vertexformats.edgeLength(self.points, self.trimap)
 
         self.V = igl.eigen.MatrixXd(self.points.astype(float).tolist())
         self.F = igl.eigen.MatrixXi(self.trimap.astype(int).tolist())
@@ -349,32 +488,53 @@ class PolyMesh(Branch):
         self.indices = None
         self.counts = None
 
+    @timed('PolyMesh.prepDrawIndices')
+    def prepDrawIndices(self):
+        vertexCount = self.points.shape[0]
+        if self.cacheOptimize and self.trimap.shape[0] > 0:
+            self.drawIndices, self.vertexOrder = meshopt.optimizeIndices(
+                self.trimap, vertexCount, self.reorderVertices
+            )
+        else:
+            self.drawIndices = meshopt.compactIndices(self.trimap, vertexCount)
+            self.vertexOrder = None
+
+        self.vertexRank = None
+        if self.vertexOrder is not None:
+            self.vertexRank = np.empty(vertexCount, np.int64)
+            self.vertexRank[self.vertexOrder] = np.arange(vertexCount)
+        if self.drawIndices.dtype == np.uint16:
+            self.indexType = gl.GL_UNSIGNED_SHORT
+        else:
+            self.indexType = gl.GL_UNSIGNED_INT
+
+    def gpuArray(self, values, start=0, end=None):
+        # per vertex values in the order of the vertex buffers
+        if self.vertexOrder is None:
+            return values[start:end]
+        return values[self.vertexOrder[start:end]]
+
+    @timed('PolyMesh.init')
     def init(self):
         if self.initialized:
             return
 
-        self.prepMesh()
+        # streamed meshes were already prepared on the loader thread
+        if self.trimap is None:
+            self.prepMesh()
 
-        self.vao = gl.glGenVertexArrays(1)
+        self.vao = GPU.createVertexArray('meshes', self.path)
         gl.glBindVertexArray(self.vao)
 
-        self.vboIndices = gl.glGenBuffers(1)
-        gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, self.vboIndices)
-        gl.glBufferData(
+        self.vboIndices = GPU.createBuffer(
             gl.GL_ELEMENT_ARRAY_BUFFER,
-            self.trimap.nbytes,
-            self.trimap,
-            gl.GL_DYNAMIC_DRAW
+            self.drawIndices,
+            gl.GL_STATIC_DRAW,
+            'meshes',
+            self.path
         )
 
-        self.vboVerts = gl.glGenBuffers(1)
-        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vboVerts)
-        gl.glBufferData(
-            gl.GL_ARRAY_BUFFER,
-            self.points.nbytes,
-            self.points + self.offsets,
-            gl.GL_DYNAMIC_DRAW
-        )
+        self.uploadPositions()
 
         gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
         gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, 0)
@@ -382,6 +542,24 @@ class PolyMesh(Branch):
 
         self.initialized = True
 
+    def release(self):
+        GPU.release('vertexArray', self.vao)
+        GPU.release('buffer', self.vboIndices)
+        GPU.release('buffer', self.vboVerts)
+        GPU.release('buffer', self.vboOffsets)
+        GPU.release('buffer', self.vboNormals)
+        for vbo, triCount in self.lodBuffers:
+            GPU.release('buffer', vbo)
+        self.lodBuffers = []
+        self.vao = None
+        self.vboIndices = None
+        self.vboVerts = None
+        self.vboOffsets = None
+        self.vboNormals = None
+        self.normalsDirty = True
+        self.initialized = False
+        self.currentKey = None
+
     def draw(self, material):
         if self.vao is None:
             return
@@ -390,71 +568,294 @@ class PolyMesh(Branch):
             gl.glUseProgram(material.shaderProg)
             gl.glBindVertexArray(self.vao)
 
-            gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, self.vboIndices)
+            vboIndices, triCount = self.lodLevel()
+            gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, vboIndices)
 
-            gl.glEnableVertexAttribArray(0)
-            gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vboVerts)
-            gl.glVertexAttribPointer(
-                0,
-                3,
-                gl.GL_FLOAT,
-                gl.GL_FALSE,
-                0,
-                None
+            self.bindAttribute(0, self.vboVerts, self.positionEncoding)
+            gl.glUniform3f(
+                gl.glGetUniformLocation(material.shaderProg, 'positionScale'),
+                *self.positionScale
+            )
+            gl.glUniform3f(
+                gl.glGetUniformLocation(material.shaderProg, 'positionBias'),
+                *self.positionBias
             )
+            if self.vboOffsets is not None:
+                self.bindAttribute(1, self.vboOffsets, self.offsetEncoding)
+            else:
+                gl.glDisableVertexAttribArray(1)
+                gl.glVertexAttrib3f(1, 0., 0., 0.)
+            if material.needsNormals:
+                self.uploadNormals()
+                self.bindAttribute(2, self.vboNormals, 'normal')
+
+            primitive = gl.GL_TRIANGLES
+            if material.patchVertices > 0:
+                gl.glPatchParameteri(gl.GL_PATCH_VERTICES, material.patchVertices)
+                primitive = gl.GL_PATCHES
 
             gl.glPolygonMode(gl.GL_FRONT_AND_BACK, gl.GL_FILL)
             gl.glDrawElements(
-                gl.GL_TRIANGLES,
-                self.triCount,
-                gl.GL_UNSIGNED_INT,
+                primitive,
+                triCount,
+                self.indexType,
                 None
             )
 
             gl.glDisableVertexAttribArray(0)
             gl.glDisableVertexAttribArray(1)
+            gl.glDisableVertexAttribArray(2)
+            gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
             gl.glBindVertexArray(0)
             gl.glUseProgram(0)
 
+    def lodLevel(self):
+        # index buffer and index count to draw with for the root's current view
+        # levels only stand in while the view moves or playback is behind,
+        # a settled view always gets full detail
+        view = self.root.lodView if self.root is not None else None
+        if len(self.lodBuffers) == 0 or view is None or not view.coarse or view.fullDetail is self:
+            return self.vboIndices, self.triCount
+        # triCount is really the index count
+        counts = [self.triCount // 3] + [triCount // 3 for vbo, triCount in self.lodBuffers]
+        center = np.dot(np.append(self.lodCenter, 1.), np.asarray(self.matrix, np.float64).reshape(4, 4))
+        scale = np.linalg.norm(np.asarray(self.matrix, np.float64).reshape(4, 4)[:3, :3], axis=1).max()
+        level = view.level(counts, center[:3], self.lodRadius * scale)
+        if level == 0:
+            return self.vboIndices, self.triCount
+        return self.lodBuffers[level - 1]
+
+    @timed('PolyMesh.buildLods')
+    def buildLods(self):
+        # runs on the loader thread once every mesh is in, the clustering
+        # works on the current points and only the indices depend on it
+        points = self.points
+        indices = []
+        for triangles in lod.buildLevels(points, self.trimap):
+            if self.cacheOptimize:
+                triangles = meshopt.tipsify(triangles, points.shape[0])
+            if self.vertexRank is not None:
+                triangles = self.vertexRank[triangles]
+            indices.append(meshopt.compactIndices(triangles, points.shape[0]))
+        self.lodCenter, self.lodRadius = lod.boundingSphere(points)
+        self.lodIndices = indices
+        return len(indices)
+
+    def uploadLods(self):
+        if self.vao is None or self.lodIndices is None:
+            return
+        gl.glBindVertexArray(self.vao)
+        # same vertex count, so the levels share indexType with the full buffer
+        for indices in self.lodIndices:
+            vbo = GPU.createBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, indices, gl.GL_STATIC_DRAW, 'lods', self.path)
+            self.lodBuffers.append((vbo, indices.size))
+        gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, 0)
+        gl.glBindVertexArray(0)
+        self.lodIndices = None
+
+    def bindAttribute(self, location, vbo, encoding):
+        size, glType, normalized = vertexformats.ATTRIBUTES[encoding]
+        gl.glEnableVertexAttribArray(location)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, vbo)
+        gl.glVertexAttribPointer(location, size, glType, normalized, 0, None)
+
+    def sampleCount(self):
+        return self.pointProp.getNbStoredSamples()
+
+    def expandedUVs(self):
+        # per corner copy, only for consumers that can't index themselves
+        if self.uvIndices is None:
+            return self.uvs
+        return self.uvs[self.uvIndices]
+
+    @timed('PolyMesh.classifySamples')
+    def classifySamples(self):
+        # hashes every sample once, meshes holding a pose for a while or
+        # not moving at all then skip those frames during playback
+        count = self.sampleCount()
+        firsts = {}
+        keys = np.empty(max(count, 1), np.int32)
+        keys[0] = 0
+        for sampleIndex in range(count if count > 1 else 0):
+            if self.sampleStore is not None:
+                values = self.sampleStore.decode(sampleIndex)
+            else:
+                values = np.asarray(self.pointProp.getValues(sampleIndex), np.float32)
+            digest = hashlib.sha1(values.tobytes()).digest()
+            keys[sampleIndex] = firsts.setdefault(digest, sampleIndex)
+
+        if len(firsts) <= 1:
+            self.motion = 'static'
+        elif len(firsts) < count:
+            self.motion = 'piecewise'
+        else:
+            self.motion = 'animated'
+        self.sampleKeys = keys
+        return self.motion
+
+    @timed('PolyMesh.updateSample')
     def updateSample(self, sampleIndex):
+        # returns whether anything was uploaded
         if not self.initialized:
             self.init()
         if self.pointProp.getNbStoredSamples() == 1:
-            return
+            return False
         if sampleIndex >= self.pointProp.getNbStoredSamples():
             sampleIndex = self.pointProp.getNbStoredSamples() - 1
         elif sampleIndex < 0:
             sampleIndex = 0
 
-        self.points = np.array(
-            self.pointProp.getValues(sampleIndex),
-            np.float32
-        ).reshape(-1, 3)
+        key = self.sampleKeys[sampleIndex] if self.sampleKeys is not None else sampleIndex
+        if key == self.currentKey:
+            if self.root is not None:
+                self.root.sampleSkips += 1
+            return False
+        self.currentKey = key
 
+        if self.sampleStore is not None:
+            self.points = self.sampleStore.decode(sampleIndex)
+        else:
+            self.points = np.array(
+                self.pointProp.getValues(sampleIndex),
+                np.float32
+            ).reshape(-1, 3)
+
+        self.uploadPositions()
+        if self.root is not None:
+            self.root.sampleUploads += 1
+        return True
+
+    @timed('PolyMesh.cacheSamples')
+    def cacheSamples(self, quantization='int16', errorBound=None):
+        # reads every point sample once and keeps them quantized, playback
+        # then never goes back to the archive
+        count = self.sampleCount()
+        if count <= 1:
+            self.sampleStore = None
+            return None
+        rest = np.array(self.pointProp.getValues(0), np.float32).reshape(-1, 3)
+        store = SampleStore(rest, quantization, errorBound)
+        for sampleIndex in range(count):
+            store.append(self.pointProp.getValues(sampleIndex))
+        self.sampleStore = store
+        return store.stats()
+
+    def updateOffsets(self, vertIDs=None):
+        if not self.initialized:
+            self.init()
+
+        self.uploadOffsets(vertIDs)
+
+    def getBVH(self):
+        if self.bvh is None:
+            self.bvh = AABBTree(self.trimap, self.points + self.offsets)
+        elif self.bvhDirty:
+            self.bvh.refit(self.points + self.offsets)
+        self.bvhDirty = False
+        return self.bvh
+
+    def getSpatialGrid(self):
+        if self.grid is None:
+            self.grid = HashGrid(self.points + self.offsets)
+        elif len(self.gridDirtyIDs) > 0:
+            if any(vertIDs is None for vertIDs in self.gridDirtyIDs):
+                self.grid.update(self.points + self.offsets)
+            else:
+                self.grid.update(self.points + self.offsets, np.unique(np.concatenate(self.gridDirtyIDs)))
+        self.gridDirtyIDs = []
+        return self.grid
+
+    def getGeodesics(self):
+        # factored once on the undeformed points, rubber edits are local
+        # enough that the rest metric is a fine falloff measure
+        if self.geodesics is None:
+            self.geodesics = HeatGeodesics(self.points, self.trimap)
+        return self.geodesics
+
+    def getTriangleAdjacency(self):
+        # trimap never changes after prepMesh so this is computed once
+        if self.triAdjacency is None:
+            self.triAdjacency = triangleAdjacency(self.trimap, self.points.shape[0])
+        return self.triAdjacency
+
+    def tolerance(self):
+        return self.positionTolerance * self.edgeLength
+
+    def markMoved(self, vertIDs=None):
+        self.bvhDirty = True
+        self.normalsDirty = True
+        if self.grid is not None:
+            self.gridDirtyIDs.append(vertIDs)
+
+    def uploadPositions(self):
+        # samples are always uploaded whole, re-encoded against their own
+        # bounding box. static meshes only upload once
+        self.positionEncoding, data, self.positionScale, self.positionBias = vertexformats.encodePositions(
+            self.gpuArray(self.points), self.positionFormat, self.tolerance()
+        )
         gl.glBindVertexArray(self.vao)
-        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vboVerts)
-        gl.glBufferSubData(
+        self.vboVerts = GPU.updateBuffer(
             gl.GL_ARRAY_BUFFER,
-            0,
-            self.points.nbytes,
-            self.points + self.offsets,
+            self.vboVerts,
+            data,
+            gl.GL_STATIC_DRAW if self.motion == 'static' else gl.GL_DYNAMIC_DRAW,
+            'meshes',
+            self.path
         )
-
         gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
         gl.glBindVertexArray(0)
+        self.markMoved()
 
-    def updateOffsets(self):
-        if not self.initialized:
-            self.init()
+    def uploadOffsets(self, vertIDs=None):
+        # only the contiguous range covering vertIDs is re-uploaded, as long
+        # as it still fits the encoding of the buffer
+        if vertIDs is not None and len(vertIDs) == 0:
+            return
+        self.markMoved(vertIDs)
 
         gl.glBindVertexArray(self.vao)
-        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vboVerts)
-        gl.glBufferSubData(
-            gl.GL_ARRAY_BUFFER,
-            0,
-            self.points.nbytes,
-            self.points + self.offsets,
-        )
+        partial = False
+        if vertIDs is not None and self.vboOffsets is not None:
+            # vertex buffer positions, which differ when vertices are reordered
+            gpuIDs = vertIDs if self.vertexRank is None else self.vertexRank[vertIDs]
+            start = int(np.min(gpuIDs))
+            end = int(np.max(gpuIDs)) + 1
+            encoding, data = vertexformats.encodeOffsets(
+                self.gpuArray(self.offsets, start, end), self.offsetEncoding, self.tolerance()
+            )
+            if encoding == self.offsetEncoding:
+                rowBytes = data.nbytes // data.shape[0]
+                gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vboOffsets)
+                gl.glBufferSubData(gl.GL_ARRAY_BUFFER, start * rowBytes, data.nbytes, data)
+                partial = True
+
+        if not partial:
+            self.offsetEncoding, data = vertexformats.encodeOffsets(
+                self.gpuArray(self.offsets), self.offsetFormat, self.tolerance()
+            )
+            self.vboOffsets = GPU.updateBuffer(
+                gl.GL_ARRAY_BUFFER,
+                self.vboOffsets,
+                data,
+                gl.GL_DYNAMIC_DRAW,
+                'meshes',
+                self.path
+            )
 
         gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
         gl.glBindVertexArray(0)
+
+    def uploadNormals(self):
+        # smooth normals of the deformed shape, only for materials that read them
+        if self.vboNormals is not None and not self.normalsDirty:
+            return
+        normals = vertexformats.vertexNormals(self.points + self.offsets, self.trimap)
+        self.vboNormals = GPU.updateBuffer(
+            gl.GL_ARRAY_BUFFER,
+            self.vboNormals,
+            vertexformats.packNormals(self.gpuArray(normals)),
+            gl.GL_DYNAMIC_DRAW,
+            'meshes',
+            self.path
+        )
+        self.normalsDirty = False
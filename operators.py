@@ -4,6 +4,16 @@ import numpy as np
 from PySide import QtCore
 from external import igl
 from common import normalize
+from history import DeformationHistory
+from profiling import timed
+
+
+def rotationMatrix(axis, angle):
+    # rodrigues, for row vectors so points rotate as points.dot(matrix)
+    x, y, z = normalize(np.array([axis], np.float64))[0]
+    cos, sin = np.cos(angle), np.sin(angle)
+    cross = np.array([[0., -z, y], [z, 0., -x], [-y, x, 0.]])
+    return (cos * np.identity(3) + sin * cross + (1. - cos) * np.outer([x, y, z], [x, y, z])).T
 
 
 class Rubber(QtCore.QObject):
@@ -11,40 +21,110 @@ class Rubber(QtCore.QObject):
         super(Rubber, self).__init__(*args)
 
         self.arapData = None
-        self.pinVertIDs = []
-        self.pinCoords = []
+        # one row per pin, the vertex it holds and where it holds it
+        self.pinVertIDs = np.zeros(0, np.int64)
+        self.pinCoords = np.zeros((0, 3), np.float64)
         self.activeMesh = None
+        self.history = DeformationHistory()
 
+    @timed('Rubber.preCompute')
     def preCompute(self):
-        if len(self.pinVertIDs) <= 1 or self.activeMesh is None:
+        if self.pinVertIDs.shape[0] <= 1 or self.activeMesh is None:
             return
 
         self.arapData = igl.ARAPData()
 
-        arapPins = igl.eigen.MatrixXi(self.pinVertIDs)
+        arapPins = igl.eigen.MatrixXi(self.pinVertIDs.reshape(-1, 1).tolist())
         self.arapData.max_iter = 1
         igl.arap_precomputation(self.activeMesh.V, self.activeMesh.F, 3, arapPins, self.arapData)
 
+    def clearPins(self):
+        # the history refers to pins by position, it can't outlive them
+        self.pinVertIDs = np.zeros(0, np.int64)
+        self.pinCoords = np.zeros((0, 3), np.float64)
+        self.arapData = None
+        self.history.clear()
+
     def appendPin(self, vertID, pinPos):
-        self.pinVertIDs.append([vertID])
-        self.pinCoords.append(pinPos)
+        self.pinVertIDs = np.append(self.pinVertIDs, np.int64(vertID))
+        self.pinCoords = np.vstack([self.pinCoords, np.asarray(pinPos, np.float64).reshape(1, 3)])
         self.preCompute()
 
-    def solveDelta(self, pinIndex, dx, dy, cameraPosition, upsign):
-        if len(self.pinCoords) <= 0 or self.activeMesh is None:
+    def pivot(self, pinIndices):
+        return self.pinCoords[pinIndices].mean(axis=0)
+
+    @timed('Rubber.transformPins')
+    def transformPins(self, pinIndices, translate=None, rotate=None, scale=None, pivot=None):
+        # moves a group of pins at once, scaled then rotated about pivot (the
+        # group's centre by default) then translated. rotate is a 3x3 matrix
+        # for row vectors, see rotationMatrix, and scale a factor or one per
+        # axis. one solve for the whole group
+        if self.pinCoords.shape[0] <= 0 or self.activeMesh is None:
             return
+        pinIndices = np.atleast_1d(pinIndices)
+        if pinIndices.shape[0] == 0:
+            return
+        if pivot is None:
+            pivot = self.pivot(pinIndices)
+
+        coords = self.pinCoords[pinIndices] - pivot
+        if scale is not None:
+            coords *= scale
+        if rotate is not None:
+            coords = coords.dot(rotate)
+        coords += pivot
+        if translate is not None:
+            coords += translate
+        self.pinCoords[pinIndices] = coords
+
+        self.solve()
 
-        arapMove = np.array(self.pinCoords[pinIndex])
-        direction = normalize([np.array(self.pinCoords[pinIndex]) - cameraPosition])[0]
+    def screenDelta(self, pinIndices, dx, dy, cameraPosition, upsign):
+        # a mouse move as a translation in the view plane at the group's pivot
+        direction = normalize([self.pivot(pinIndices) - cameraPosition])[0]
         right = np.cross(direction, [0., upsign, 0.])
         up = np.cross(right, direction)
+        return right * -dx * 100. + up * dy * 100.
 
-        arapMove += right * -dx * 100.
-        arapMove += up * dy * 100.
-
-        self.pinCoords[pinIndex] = arapMove.astype(float).tolist()
+    @timed('Rubber.solveDelta')
+    def solveDelta(self, pinIndices, dx, dy, cameraPosition, upsign):
+        # pinIndices is one pin or a selection of them, they all move together
+        if self.pinCoords.shape[0] <= 0 or self.activeMesh is None:
+            return
+        pinIndices = np.atleast_1d(pinIndices)
+        self.transformPins(pinIndices, translate=self.screenDelta(pinIndices, dx, dy, cameraPosition, upsign))
 
-        igl.arap_solve(igl.eigen.MatrixXd(self.pinCoords), self.arapData, self.activeMesh.V)
+    def solve(self):
+        if self.arapData is None:
+            return
+        igl.arap_solve(igl.eigen.MatrixXd(self.pinCoords.tolist()), self.arapData, self.activeMesh.V)
         self.activeMesh.offsets = np.array(self.activeMesh.V, np.float32, order='C', copy=True).reshape(-1, 3)
         self.activeMesh.offsets -= self.activeMesh.points
         self.activeMesh.updateOffsets()
+
+    def beginStroke(self):
+        if not self.history.stroking():
+            self.history.beginStroke(self.activeMesh, self.pinCoords)
+
+    def endStroke(self):
+        return self.history.endStroke(self.pinCoords)
+
+    def undo(self):
+        return self.restore(self.history.undo())
+
+    def redo(self):
+        return self.restore(self.history.redo())
+
+    def restore(self, restored):
+        if restored is None:
+            return None
+        mesh, vertIDs, pins = restored
+
+        if pins is not None:
+            self.pinCoords[:pins.shape[0]] = pins
+
+        # arap_solve starts from V, keep it in step with the restored offsets
+        if mesh.offsets is not None:
+            mesh.V = igl.eigen.MatrixXd((mesh.points + mesh.offsets).astype(float).tolist())
+
+        return restored
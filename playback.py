@@ -0,0 +1,163 @@
+from collections import deque
+from timeit import default_timer
+import numpy as np
+from PySide import QtCore
+
+
+class TimeSampling(object):
+    # alembic time sampling as reported by the archive. acyclic (and cyclic)
+    # samplings list their sample times, uniform ones give the start and
+    # enough times to derive the period.
+    def __init__(self, kind='uniform', times=None, fps=24.):
+        self.kind = str(kind).lower()
+        self.times = np.array(times if times is not None else [0.], np.float64)
+        if self.times.shape[0] == 0:
+            self.times = np.array([0.])
+        self.fps = fps
+
+        self.start = self.times[0]
+        if self.times.shape[0] > 1:
+            self.period = self.times[1] - self.times[0]
+        else:
+            self.period = 1. / fps
+        if self.period <= 0:
+            self.period = 1. / fps
+
+    def sampleIndex(self, time, sampleCount):
+        if sampleCount <= 1:
+            return 0
+        if 'uniform' not in self.kind and self.times.shape[0] >= sampleCount:
+            # last sample at or before time
+            index = int(np.searchsorted(self.times[:sampleCount], time + 1e-9, side='right')) - 1
+        else:
+            index = int(np.floor((time - self.start) / self.period + 1e-6))
+        return min(max(index, 0), sampleCount - 1)
+
+    def sampleTime(self, index):
+        if 'uniform' not in self.kind and index < self.times.shape[0]:
+            return self.times[index]
+        return self.start + index * self.period
+
+
+class PlaybackClock(QtCore.QObject):
+    # maps wall time to frames, skipping the frames we were too slow to show
+    # unless playEveryFrame is set. either way a frame is only due once the
+    # one before it was shown, see frameShown, and 1 / fps after it
+    def __init__(self, fps=24., playEveryFrame=False, historySize=240, timer=default_timer, *args):
+        super(PlaybackClock, self).__init__(*args)
+        self.fps = fps
+        self.playEveryFrame = playEveryFrame
+        self.timer = timer
+
+        self.running = False
+        self.forward = True
+        self.frameRange = (0, 200)
+        self.startWall = 0.
+        self.startFrame = 0
+        self.frame = 0
+        # when playEveryFrame may hand out the next frame
+        self.nextAdvance = 0.
+        # a frame was handed out and hasn't been shown yet
+        self.waiting = False
+
+        self.lastShown = None
+        self.frameTimes = deque(maxlen=historySize)
+        self.shownFrames = 0
+        self.droppedFrames = 0
+        self.lastDrop = None
+
+    def start(self, frame, frameRange, forward=True):
+        self.running = True
+        self.forward = forward
+        self.frameRange = frameRange
+        self.rebase(frame)
+        self.waiting = False
+        self.lastShown = None
+        self.frameTimes.clear()
+        self.shownFrames = 0
+        self.droppedFrames = 0
+        self.lastDrop = None
+
+    def stop(self):
+        self.running = False
+
+    def rebase(self, frame):
+        self.startWall = self.timer()
+        self.nextAdvance = self.startWall + 1. / self.fps
+        self.startFrame = frame
+        self.frame = frame
+
+    def wrap(self, frame):
+        first, last = self.frameRange
+        length = last - first + 1
+        return first + (frame - first) % length
+
+    def tick(self):
+        # returns the frame to show now, or None when it hasn't changed
+        if not self.running:
+            return None
+
+        now = self.timer()
+        step = 1 if self.forward else -1
+        if self.playEveryFrame:
+            # the timer ticks faster than the frame rate, nothing moves until
+            # the frame is on screen and its time is up
+            if self.waiting or now < self.nextAdvance:
+                return None
+            target = self.frame + step
+            dropped = 0
+            # late ticks don't shift the cadence, slow frames don't bank time
+            nextAdvance = max(self.nextAdvance + 1. / self.fps, now)
+        else:
+            elapsed = now - self.startWall
+            target = self.startFrame + step * int(elapsed * self.fps)
+            if target == self.frame:
+                return None
+            dropped = abs(target - self.frame) - 1
+            if self.waiting:
+                # replaced before it was ever painted
+                dropped += 1
+
+        wrapped = self.wrap(target)
+        if wrapped != target:
+            # keep the loop seamless by restarting the clock from the wrapped frame
+            self.rebase(wrapped)
+        if self.playEveryFrame:
+            self.nextAdvance = nextAdvance
+        self.frame = wrapped
+        self.waiting = True
+        self.droppedFrames += dropped
+        if dropped > 0:
+            self.lastDrop = now
+        return self.frame
+
+    def behind(self, window=.5):
+        # whether frames were dropped within the last window seconds
+        return self.running and self.lastDrop is not None and self.timer() - self.lastDrop < window
+
+    def frameShown(self):
+        self.waiting = False
+        now = self.timer()
+        if self.lastShown is not None:
+            self.frameTimes.append(now - self.lastShown)
+        self.lastShown = now
+        self.shownFrames += 1
+
+    def stats(self):
+        if len(self.frameTimes) == 0:
+            return {'fps': 0., 'p50': 0., 'p90': 0., 'p99': 0., 'dropped': self.droppedFrames}
+        times = np.array(self.frameTimes) * 1000.
+        p50, p90, p99 = np.percentile(times, [50, 90, 99])
+        return {
+            'fps': 1000. / np.mean(times),
+            'p50': p50,
+            'p90': p90,
+            'p99': p99,
+            'dropped': self.droppedFrames,
+        }
+
+    def report(self):
+        stats = self.stats()
+        return '%.1f/%.0f fps  frame ms p50 %.1f p90 %.1f p99 %.1f  dropped %d' % (
+            stats['fps'], self.fps, stats['p50'], stats['p90'], stats['p99'], stats['dropped']
+        )
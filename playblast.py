@@ -0,0 +1,299 @@
+import os
+import sys
+import argparse
+import ctypes
+import multiprocessing
+from timeit import default_timer
+
+# the keys of CONTEXTS, known before OpenGL is imported
+PLATFORMS = ('egl', 'osmesa')
+
+
+def platformFromArgs(argv, default='osmesa'):
+    if '--platform' in argv and argv.index('--platform') + 1 < len(argv):
+        return argv[argv.index('--platform') + 1]
+    return default
+
+
+def defaultPlatform():
+    # an inherited PYOPENGL_PLATFORM (glx from a desktop session say) has no
+    # headless context, those fall back to osmesa
+    platform = os.environ.get('PYOPENGL_PLATFORM')
+    return platform if platform in PLATFORMS else 'osmesa'
+
+
+# PyOpenGL picks its platform on first import, so this has to happen before
+# anything below pulls in OpenGL
+os.environ['PYOPENGL_PLATFORM'] = platformFromArgs(sys.argv, defaultPlatform())
+
+import numpy as np
+import OpenGL.GL as gl
+from PIL import Image
+from app import App
+from loader import rootFromAlembic
+from scheduler import SCENE_DIRT
+
+
+def encodePNG(job):
+    # runs in the worker pool, gl rows are bottom to top
+    pixels, width, height, filePath = job
+    image = Image.frombuffer('RGBA', (width, height), pixels, 'raw', 'RGBA', 0, -1)
+    image.save(filePath, compress_level=1)
+    return filePath
+
+
+class OSMesaContext(object):
+    # software rasterizer, works on render nodes without a gpu or a display
+    def __init__(self, width, height):
+        from OpenGL import osmesa, arrays
+        attribs = arrays.GLintArray.asArray([
+            osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA,
+            osmesa.OSMESA_DEPTH_BITS, 24,
+            osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+            osmesa.OSMESA_CONTEXT_MAJOR_VERSION, 4,
+            osmesa.OSMESA_CONTEXT_MINOR_VERSION, 5,
+            0
+        ])
+        self.context = osmesa.OSMesaCreateContextAttribs(attribs, None)
+        if not self.context:
+            raise RuntimeError('could not create an OSMesa 4.5 core context')
+        self.buffer = arrays.GLubyteArray.zeros((height, width, 4))
+        if not osmesa.OSMesaMakeCurrent(self.context, self.buffer, gl.GL_UNSIGNED_BYTE, width, height):
+            raise RuntimeError('could not make the OSMesa context current')
+
+    def release(self):
+        from OpenGL import osmesa
+        osmesa.OSMesaDestroyContext(self.context)
+
+
+class EGLContext(object):
+    # surfaceless context, rendering only ever goes to our own framebuffer
+    def __init__(self, width, height):
+        from OpenGL import EGL
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major = EGL.EGLint()
+        minor = EGL.EGLint()
+        if not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+            raise RuntimeError('could not initialize EGL')
+
+        configAttribs = (EGL.EGLint * 5)(
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+            EGL.EGL_NONE
+        )
+        config = EGL.EGLConfig()
+        count = EGL.EGLint()
+        EGL.eglChooseConfig(self.display, configAttribs, ctypes.pointer(config), 1, ctypes.pointer(count))
+        if count.value == 0:
+            raise RuntimeError('no EGL config with desktop OpenGL')
+
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        contextAttribs = (EGL.EGLint * 7)(
+            EGL.EGL_CONTEXT_MAJOR_VERSION, 4,
+            EGL.EGL_CONTEXT_MINOR_VERSION, 5,
+            EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+            EGL.EGL_NONE
+        )
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, contextAttribs)
+        if not self.context:
+            raise RuntimeError('could not create an EGL 4.5 core context')
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self.context)
+
+    def release(self):
+        from OpenGL import EGL
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+        EGL.eglDestroyContext(self.display, self.context)
+        EGL.eglTerminate(self.display)
+
+
+CONTEXTS = {
+    'osmesa': OSMesaContext,
+    'egl': EGLContext,
+}
+
+
+class HeadlessScheduler(object):
+    # stands in for FrameScheduler, frames are rendered explicitly
+    def __init__(self):
+        self.dirty = set()
+
+    def markDirty(self, *kinds):
+        self.dirty.update(kinds)
+
+    def requestFrame(self):
+        pass
+
+    def takeDirty(self):
+        dirty = self.dirty
+        self.dirty = set()
+        return dirty
+
+
+class HeadlessViewer(object):
+    # the bits of Viewer that App talks to
+    def __init__(self, width, height):
+        self.viewportWidth = width
+        self.viewportHeight = height
+        self.scheduler = HeadlessScheduler()
+
+    def width(self):
+        return self.viewportWidth
+
+    def height(self):
+        return self.viewportHeight
+
+    def update(self):
+        pass
+
+    def makeCurrent(self):
+        pass
+
+
+class Playblast(object):
+    def __init__(self, width, height, platform='osmesa', pboCount=3):
+        self.width = width
+        self.height = height
+        self.context = CONTEXTS[platform](width, height)
+
+        self.fbo = gl.glGenFramebuffers(1)
+        self.colorBuffer = gl.glGenRenderbuffers(1)
+        self.depthBuffer = gl.glGenRenderbuffers(1)
+        gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, self.colorBuffer)
+        gl.glRenderbufferStorage(gl.GL_RENDERBUFFER, gl.GL_RGBA8, width, height)
+        gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, self.depthBuffer)
+        gl.glRenderbufferStorage(gl.GL_RENDERBUFFER, gl.GL_DEPTH24_STENCIL8, width, height)
+        gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, 0)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fbo)
+        gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, gl.GL_RENDERBUFFER, self.colorBuffer)
+        gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER, gl.GL_DEPTH_STENCIL_ATTACHMENT, gl.GL_RENDERBUFFER, self.depthBuffer)
+
+        # readbacks go through a ring of pixel buffers, a frame is only
+        # fetched once the ring wraps around and its copy has long finished
+        self.frameBytes = width * height * 4
+        self.pbos = [gl.glGenBuffers(1) for _ in range(max(1, pboCount))]
+        for pbo in self.pbos:
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, pbo)
+            gl.glBufferData(gl.GL_PIXEL_PACK_BUFFER, self.frameBytes, None, gl.GL_STREAM_READ)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        self.nextPBO = 0
+        self.inFlight = []
+
+        self.viewer = HeadlessViewer(width, height)
+        self.app = App(self.viewer, [0, 0, width, height])
+        # the app's cached scene is blitted into our framebuffer instead of the window's
+        self.app.sceneCache.defaultFramebuffer = self.fbo
+        self.app.initSlot()
+        self.app.resize([0, 0, width, height])
+
+    def setRoot(self, root):
+        self.app.setRoot(root)
+
+    def frameScene(self, padding=1.2):
+        meshes = [
+            branch for branch in self.app.root.map.values()
+            if branch.kind == 'PolyMesh' and branch.offsets is not None
+        ]
+        if len(meshes) == 0:
+            return
+        points = np.concatenate([mesh.points + mesh.offsets for mesh in meshes])
+        lo = points.min(axis=0)
+        hi = points.max(axis=0)
+
+        camera = self.app.currentCamera
+        camera.target = ((lo + hi) * .5).astype(np.float32)
+        camera.radius = padding * np.linalg.norm(hi - lo) * .5 / np.tan(np.radians(camera.fov) * .5)
+        camera.cameraChanged()
+
+    def readback(self, filePath):
+        pbo = self.pbos[self.nextPBO]
+        self.nextPBO = (self.nextPBO + 1) % len(self.pbos)
+
+        gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, self.fbo)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, pbo)
+        gl.glReadPixels(0, 0, self.width, self.height, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        self.inFlight.append((pbo, filePath))
+
+    def collect(self, flush=False):
+        # hands back the frames whose pixel buffer is about to be reused
+        ready = []
+        while len(self.inFlight) >= len(self.pbos) or (flush and len(self.inFlight) > 0):
+            pbo, filePath = self.inFlight.pop(0)
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, pbo)
+            pixels = gl.glGetBufferSubData(gl.GL_PIXEL_PACK_BUFFER, 0, self.frameBytes)
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+            ready.append((np.asarray(pixels, np.uint8).tobytes(), self.width, self.height, filePath))
+        return ready
+
+    def render(self, frames, outputPattern, fps=24., pool=None):
+        results = []
+        frameTimes = []
+
+        def encode(jobs):
+            for job in jobs:
+                if pool is not None:
+                    results.append(pool.apply_async(encodePNG, (job,)))
+                else:
+                    encodePNG(job)
+
+        for frame in frames:
+            start = default_timer()
+            self.app.updateTimeSlot(frame / fps)
+            self.app.draw(SCENE_DIRT)
+            self.readback(outputPattern % frame)
+            encode(self.collect())
+            frameTimes.append(default_timer() - start)
+
+        encode(self.collect(flush=True))
+        for result in results:
+            result.get()
+
+        frameTimes = np.array(frameTimes) * 1000.
+        if frameTimes.shape[0] == 0:
+            return {'frames': 0, 'meanMs': 0., 'p90Ms': 0.}
+        return {
+            'frames': frameTimes.shape[0],
+            'meanMs': float(frameTimes.mean()),
+            'p90Ms': float(np.percentile(frameTimes, 90)),
+        }
+
+    def release(self):
+        self.context.release()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='render an alembic archive to png frames without a window')
+    parser.add_argument('archive')
+    parser.add_argument('output', help='printf style pattern, e.g. out/frame.%%04d.png')
+    parser.add_argument('--range', nargs=2, type=int, default=[0, 200], metavar=('FIRST', 'LAST'))
+    parser.add_argument('--size', nargs=2, type=int, default=[1280, 720], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--fps', type=float, default=24.)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--platform', choices=sorted(CONTEXTS.keys()), default=defaultPlatform())
+    args = parser.parse_args(argv)
+
+    outputDir = os.path.dirname(args.output)
+    if outputDir and not os.path.isdir(outputDir):
+        os.makedirs(outputDir)
+
+    # fork the encoders before any gl state exists
+    pool = multiprocessing.Pool(args.workers) if args.workers > 0 else None
+
+    start = default_timer()
+    playblast = Playblast(args.size[0], args.size[1], args.platform)
+    playblast.setRoot(rootFromAlembic(args.archive))
+    playblast.app.updateTimeSlot(args.range[0] / args.fps)
+    playblast.frameScene()
+    stats = playblast.render(range(args.range[0], args.range[1] + 1), args.output, args.fps, pool)
+    playblast.release()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    sys.stdout.write('%d frames in %.2fs, %.1f ms/frame (p90 %.1f)\n' % (
+        stats['frames'], default_timer() - start, stats['meanMs'], stats['p90Ms']
+    ))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,165 @@
+import os
+import json
+import threading
+from collections import deque
+from functools import wraps
+from timeit import default_timer
+import numpy as np
+import OpenGL.GL as gl
+
+
+class NullScope(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_SCOPE = NullScope()
+
+
+class Scope(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, self.start, default_timer() - self.start)
+        return False
+
+
+class Profiler(object):
+    # cpu scopes and gpu timer queries, kept as trace events so a session can
+    # be dumped as chrome://tracing json. everything is a no op while disabled.
+    def __init__(self, enabled=False, maxEvents=500000, window=120):
+        self.enabled = enabled
+        self.origin = default_timer()
+        self.events = deque(maxlen=maxEvents)
+        self.recent = {}
+        self.window = window
+        self.lock = threading.Lock()
+
+        self.freeQueries = []
+        self.pendingQueries = []
+        self.activeQuery = None
+
+    def setEnabled(self, enabled):
+        self.enabled = enabled
+
+    def scope(self, name):
+        if not self.enabled:
+            return NULL_SCOPE
+        return Scope(self, name)
+
+    def record(self, name, start, duration, track=None):
+        if track is None:
+            track = threading.current_thread().name
+        with self.lock:
+            self.events.append((name, start - self.origin, duration, track))
+            if name not in self.recent:
+                self.recent[name] = deque(maxlen=self.window)
+            self.recent[name].append(duration)
+
+    def gpuBegin(self, name):
+        # TIME_ELAPSED queries can't nest, a second begin is ignored
+        if not self.enabled or self.activeQuery is not None:
+            return
+        if len(self.freeQueries) == 0:
+            self.freeQueries.extend(gl.glGenQueries(4))
+        query = self.freeQueries.pop()
+        gl.glBeginQuery(gl.GL_TIME_ELAPSED, query)
+        self.activeQuery = (name, query, default_timer())
+
+    def gpuEnd(self):
+        if self.activeQuery is None:
+            return
+        gl.glEndQuery(gl.GL_TIME_ELAPSED)
+        self.pendingQueries.append(self.activeQuery)
+        self.activeQuery = None
+
+    def collectGPU(self):
+        # results are read a frame or more later so the cpu never waits on them
+        if len(self.pendingQueries) == 0:
+            return
+        pending = []
+        for name, query, start in self.pendingQueries:
+            if not gl.glGetQueryObjectuiv(query, gl.GL_QUERY_RESULT_AVAILABLE):
+                pending.append((name, query, start))
+                continue
+            elapsed = gl.glGetQueryObjectui64v(query, gl.GL_QUERY_RESULT)
+            self.record(name, start, elapsed * 1e-9, track='GPU')
+            self.freeQueries.append(query)
+        self.pendingQueries = pending
+
+    def summary(self):
+        with self.lock:
+            recent = dict((name, np.array(durations)) for name, durations in self.recent.items())
+        return dict(
+            (name, {
+                'last': durations[-1] * 1000.,
+                'mean': durations.mean() * 1000.,
+                'max': durations.max() * 1000.,
+                'count': durations.shape[0],
+            })
+            for name, durations in recent.items()
+        )
+
+    def report(self):
+        lines = []
+        for name, stats in sorted(self.summary().items()):
+            lines.append('%-28s %7.2f ms  avg %7.2f  max %7.2f' % (name, stats['last'], stats['mean'], stats['max']))
+        return '\n'.join(lines)
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+            self.recent = {}
+
+    def exportChromeTrace(self, filePath):
+        with self.lock:
+            events = list(self.events)
+        tracks = {}
+        traceEvents = []
+        for name, start, duration, track in events:
+            if track not in tracks:
+                tracks[track] = len(tracks) + 1
+                traceEvents.append({
+                    'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tracks[track],
+                    'args': {'name': track}
+                })
+            traceEvents.append({
+                'name': name,
+                'cat': 'gpu' if track == 'GPU' else 'cpu',
+                'ph': 'X',
+                'ts': start * 1e6,
+                'dur': duration * 1e6,
+                'pid': 1,
+                'tid': tracks[track],
+            })
+        with open(filePath, 'w') as f:
+            json.dump({'traceEvents': traceEvents, 'displayTimeUnit': 'ms'}, f)
+        return len(traceEvents)
+
+
+PROFILER = Profiler(enabled=bool(os.environ.get('ELASTIK_PROFILE')))
+
+
+def timed(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            start = default_timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                PROFILER.record(name, start, default_timer() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import argparse
+from timeit import default_timer
+import numpy as np
+from PySide import QtCore
+
+# nothing here may import OpenGL at module level, replay has to pick the
+# headless platform first, see replay
+
+
+MOVE, PRESS, RELEASE, KEY, WHEEL = range(5)
+KIND_NAMES = ('move', 'press', 'release', 'key', 'wheel')
+
+EVENT_DTYPE = np.dtype([
+    ('time', np.float64),
+    ('kind', np.uint8),
+    ('x', np.int32),
+    ('y', np.int32),
+    ('dx', np.float32),
+    ('dy', np.float32),
+    ('buttons', np.int32),
+    ('modifiers', np.int32),
+    # key code for KEY, wheel delta for WHEEL
+    ('value', np.int32),
+])
+
+CAMERA_FIELDS = ('theta', 'phi', 'radius', 'targetX', 'targetY', 'targetZ', 'upsign', 'fov', 'aspect')
+
+
+def cameraState(camera):
+    return (
+        camera.theta, camera.phi, camera.radius,
+        camera.target[0], camera.target[1], camera.target[2],
+        camera.upsign, camera.fov, camera.aspect
+    )
+
+
+def applyCameraState(camera, state):
+    camera.theta, camera.phi, camera.radius = float(state[0]), float(state[1]), float(state[2])
+    camera.target = np.array(state[3:6], np.float32)
+    camera.upsign = float(state[6])
+    camera.fov = float(state[7])
+    camera.aspect = float(state[8])
+    camera.cameraChanged()
+
+
+class EventRecorder(object):
+    # what Viewer receives, stored along with the camera as it was when
+    # each event came in. saved as a compressed npz
+    def __init__(self, app):
+        self.app = app
+        self.start = default_timer()
+        self.events = []
+        self.cameras = []
+
+        root = app.root
+        activeMesh = app.activeMesh
+        self.meta = {
+            'archive': getattr(root, 'filePath', None),
+            'activeMesh': activeMesh.path if activeMesh is not None else None,
+            'mode': 'rubber' if app.currentBrush is app.brushes['rubber'] else 'default',
+            'radius': float(app.currentBrush.radius),
+            'time': float(app.currentTime),
+            'viewport': [int(value) for value in app.viewportCoords],
+        }
+
+    def record(self, kind, x=0, y=0, dx=0., dy=0., buttons=0, modifiers=0, value=0):
+        self.events.append((
+            default_timer() - self.start, kind, x, y, dx, dy, int(buttons), int(modifiers), value
+        ))
+        self.cameras.append(cameraState(self.app.currentCamera))
+
+    def save(self, filePath):
+        np.savez_compressed(
+            filePath,
+            events=np.array(self.events, EVENT_DTYPE),
+            cameras=np.array(self.cameras, np.float32).reshape(-1, len(CAMERA_FIELDS)),
+            meta=np.array(json.dumps(self.meta))
+        )
+        return len(self.events)
+
+
+def loadRecording(filePath):
+    data = np.load(filePath)
+    return data['events'], data['cameras'], json.loads(str(data['meta']))
+
+
+def latencyStats(times):
+    times = np.array(times)
+    if times.shape[0] == 0:
+        return None
+    p50, p90, p99 = np.percentile(times, [50, 90, 99])
+    return {
+        'count': int(times.shape[0]),
+        'min': float(times.min()),
+        'median': float(p50),
+        'mean': float(times.mean()),
+        'p90': float(p90),
+        'p99': float(p99),
+        'max': float(times.max()),
+    }
+
+
+def replay(filePath, archive=None, platform='osmesa', resync=True, out=sys.stdout):
+    # feeds a recording through App without a window. every event is handled
+    # on its own and followed by the frame it made dirty, the latency is
+    # the time for both
+    os.environ['PYOPENGL_PLATFORM'] = platform
+    import OpenGL.GL as gl
+    from playblast import Playblast
+    from loader import rootFromAlembic
+
+    events, cameras, meta = loadRecording(filePath)
+    viewport = meta['viewport']
+    playblast = Playblast(viewport[2], viewport[3], platform)
+    app = playblast.app
+    try:
+        playblast.setRoot(rootFromAlembic(archive or meta['archive']))
+        app.updateTimeSlot(meta['time'])
+        app.setMode(meta['mode'])
+        app.currentBrush.updateRadius(meta['radius'])
+        if meta['activeMesh'] is not None:
+            mesh = app.root.map[meta['activeMesh']]
+            mesh.init()
+            app.setActiveMesh(mesh)
+        if cameras.shape[0] > 0:
+            applyCameraState(app.currentCamera, cameras[0])
+        app.draw(playblast.viewer.scheduler.takeDirty() | set(['scene']))
+        gl.glFinish()
+
+        def settle():
+            # what the viewer's settle timer does, not part of any latency
+            app.settle()
+            dirty = playblast.viewer.scheduler.takeDirty()
+            if len(dirty) > 0:
+                app.draw(dirty)
+
+        latencies = dict((name, []) for name in KIND_NAMES + ('drag',))
+        lastWheel = None
+        for event, camera in zip(events, cameras):
+            if lastWheel is not None and event['time'] - lastWheel >= app.settleDelay:
+                settle()
+                lastWheel = None
+            if resync:
+                applyCameraState(app.currentCamera, camera)
+                playblast.viewer.scheduler.takeDirty()
+            kind = int(event['kind'])
+            buttons = QtCore.Qt.MouseButtons(int(event['buttons']))
+            modifiers = QtCore.Qt.KeyboardModifiers(int(event['modifiers']))
+
+            start = default_timer()
+            if kind == MOVE:
+                app.mouseMove(int(event['x']), int(event['y']), modifiers, buttons, float(event['dx']), float(event['dy']))
+            elif kind == PRESS:
+                app.mousePress(int(event['x']), int(event['y']), modifiers, buttons)
+            elif kind == RELEASE:
+                app.mouseRelease()
+            elif kind == KEY:
+                app.keyPress(int(event['value']), modifiers)
+            elif kind == WHEEL:
+                app.wheel(int(event['value']), modifiers)
+                lastWheel = float(event['time'])
+            dirty = playblast.viewer.scheduler.takeDirty()
+            if len(dirty) > 0:
+                app.draw(dirty)
+            gl.glFinish()
+            elapsed = default_timer() - start
+
+            # moves with a button down are strokes, those are the slow ones
+            if kind == MOVE and int(event['buttons']) != 0:
+                latencies['drag'].append(elapsed)
+            else:
+                latencies[KIND_NAMES[kind]].append(elapsed)
+    finally:
+        playblast.release()
+
+    results = {}
+    for name in sorted(latencies.keys()):
+        stats = latencyStats(latencies[name])
+        if stats is None:
+            continue
+        results['replay/%s[%s]' % (name, os.path.basename(filePath))] = stats
+        out.write('%-8s %6d events  p50 %7.2f ms  p90 %7.2f ms  p99 %7.2f ms  max %7.2f ms\n' % (
+            name, stats['count'], stats['median'] * 1000., stats['p90'] * 1000.,
+            stats['p99'] * 1000., stats['max'] * 1000.
+        ))
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='replay a recorded interaction headlessly and report latencies')
+    parser.add_argument('recording')
+    parser.add_argument('--archive', default=None, help='use this archive instead of the recorded one')
+    platform = os.environ.get('PYOPENGL_PLATFORM')
+    parser.add_argument('--platform', choices=['egl', 'osmesa'], default=platform if platform in ('egl', 'osmesa') else 'osmesa')
+    parser.add_argument('--no-resync', dest='resync', action='store_false', help="don't reset the camera to its recorded state before each event")
+    parser.add_argument('--output', default=None, help='json in the format benchmark.py compare reads')
+    args = parser.parse_args(argv)
+
+    results = replay(args.recording, args.archive, args.platform, args.resync)
+    if args.output is not None:
+        with open(args.output, 'w') as outFile:
+            json.dump({'meta': {'recording': args.recording}, 'results': results, 'skipped': {}}, outFile, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
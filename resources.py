@@ -0,0 +1,163 @@
+import OpenGL.GL as gl
+
+
+class Record(object):
+    def __init__(self, kind, handle, category, nbytes=0, owner=None, usage=None):
+        self.kind = kind
+        self.handle = handle
+        self.category = category
+        self.nbytes = nbytes
+        self.owner = owner
+        self.usage = usage
+        self.refs = 1
+        self.serial = 0
+
+
+class GPUResources(object):
+    # every gl object we create goes through here. objects are reference
+    # counted, and buffers whose last reference goes away are kept in a pool
+    # keyed by size and usage so the next buffer of the same size (the same
+    # archive reloaded, a pin placed again) skips the allocation
+    def __init__(self, poolLimit=256 * 1024 * 1024):
+        self.records = {}
+        self.pool = {}
+        self.pooledBytes = 0
+        self.poolLimit = poolLimit
+        self.serial = 0
+
+        self.allocations = 0
+        self.recycled = 0
+
+    def add(self, kind, handle, category, nbytes=0, owner=None, usage=None):
+        handle = int(handle)
+        record = Record(kind, handle, category, nbytes, owner, usage)
+        self.serial += 1
+        record.serial = self.serial
+        self.records[(kind, handle)] = record
+        return handle
+
+    def track(self, kind, handle, category, nbytes=0, owner=None):
+        # for objects made elsewhere, programs from the shader compiler say
+        return self.add(kind, handle, category, nbytes, owner)
+
+    def resize(self, kind, handle, nbytes):
+        self.records[(kind, int(handle))].nbytes = nbytes
+
+    def createBuffer(self, target, data, usage, category, owner=None):
+        nbytes = data.nbytes
+        key = (nbytes, usage)
+        if nbytes > 0 and len(self.pool.get(key, [])) > 0:
+            handle = self.pool[key].pop()
+            self.pooledBytes -= nbytes
+            self.recycled += 1
+            gl.glBindBuffer(target, handle)
+            gl.glBufferSubData(target, 0, nbytes, data)
+        else:
+            handle = gl.glGenBuffers(1)
+            self.allocations += 1
+            gl.glBindBuffer(target, handle)
+            gl.glBufferData(target, nbytes, data, usage)
+        return self.add('buffer', handle, category, nbytes, owner, usage)
+
+    def updateBuffer(self, target, handle, data, usage, category, owner=None):
+        # rewrites a buffer in place while its size holds, otherwise swaps it
+        # for one of the new size
+        record = self.records.get(('buffer', int(handle))) if handle is not None else None
+        if record is not None and record.nbytes == data.nbytes:
+            gl.glBindBuffer(target, handle)
+            gl.glBufferSubData(target, 0, data.nbytes, data)
+            return handle
+        self.release('buffer', handle)
+        return self.createBuffer(target, data, usage, category, owner)
+
+    def createVertexArray(self, category, owner=None):
+        return self.add('vertexArray', gl.glGenVertexArrays(1), category, 0, owner)
+
+    def createTexture(self, category, nbytes=0, owner=None):
+        return self.add('texture', gl.glGenTextures(1), category, nbytes, owner)
+
+    def retain(self, kind, handle):
+        # for objects with more than one owner, each owner releases once
+        self.records[(kind, int(handle))].refs += 1
+        return handle
+
+    def release(self, kind, handle):
+        # returns whether the object is gone, False while others still hold it
+        if handle is None:
+            return True
+        key = (kind, int(handle))
+        record = self.records.get(key)
+        if record is None:
+            return True
+        record.refs -= 1
+        if record.refs > 0:
+            return False
+        del self.records[key]
+
+        if kind == 'buffer':
+            poolKey = (record.nbytes, record.usage)
+            if record.nbytes > 0 and self.pooledBytes + record.nbytes <= self.poolLimit:
+                self.pool.setdefault(poolKey, []).append(record.handle)
+                self.pooledBytes += record.nbytes
+            else:
+                gl.glDeleteBuffers(1, [record.handle])
+        elif kind == 'vertexArray':
+            gl.glDeleteVertexArrays(1, [record.handle])
+        elif kind == 'texture':
+            gl.glDeleteTextures([record.handle])
+        elif kind == 'program':
+            gl.glDeleteProgram(record.handle)
+        elif kind == 'renderbuffer':
+            gl.glDeleteRenderbuffers(1, [record.handle])
+        elif kind == 'framebuffer':
+            gl.glDeleteFramebuffers(1, [record.handle])
+        return True
+
+    def trim(self):
+        # gives the pooled buffers back to the driver
+        for handles in self.pool.values():
+            for handle in handles:
+                gl.glDeleteBuffers(1, [handle])
+        self.pool = {}
+        self.pooledBytes = 0
+
+    def memory(self):
+        categories = {}
+        for record in self.records.values():
+            categories[record.category] = categories.get(record.category, 0) + record.nbytes
+        categories['pool'] = self.pooledBytes
+        return categories
+
+    def liveBytes(self):
+        return sum(record.nbytes for record in self.records.values())
+
+    def counts(self):
+        counts = {}
+        for record in self.records.values():
+            kinds = counts.setdefault(record.category, {})
+            kinds[record.kind] = kinds.get(record.kind, 0) + 1
+        return counts
+
+    def mark(self):
+        return self.serial
+
+    def leaksSince(self, mark):
+        # objects created after mark that are still alive
+        return sorted(
+            (record for record in self.records.values() if record.serial > mark),
+            key=lambda record: record.serial
+        )
+
+    def report(self):
+        lines = ['gpu %.1f MB live, %.1f MB pooled, %d allocations, %d recycled' % (
+            self.liveBytes() / 1048576., self.pooledBytes / 1048576., self.allocations, self.recycled
+        )]
+        memory = self.memory()
+        counts = self.counts()
+        for category in sorted(counts.keys()):
+            kinds = '  '.join('%s %d' % item for item in sorted(counts[category].items()))
+            lines.append('  %-12s %8.1f MB  %s' % (category, memory.get(category, 0) / 1048576., kinds))
+        return '\n'.join(lines)
+
+
+GPU = GPUResources()
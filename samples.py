@@ -0,0 +1,96 @@
+import numpy as np
+
+
+QUANTIZATIONS = ('int16', 'float16')
+
+
+class SampleStore(object):
+    # point samples kept in memory as deltas from the rest shape.
+    # int16 deltas are scaled into each frame's own delta bounds, float16
+    # deltas are divided by the mesh extent first so precision doesn't depend
+    # on where the mesh sits. frames that would go past errorBound are kept
+    # as plain float32, frames identical to the rest shape cost nothing.
+    def __init__(self, rest, quantization='int16', errorBound=None):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError('unknown quantization %s' % quantization)
+        self.rest = np.array(rest, np.float32).reshape(-1, 3)
+        self.quantization = quantization
+        self.extent = float(np.ptp(self.rest, axis=0).max()) if self.rest.shape[0] > 0 else 1.
+        if self.extent == 0:
+            self.extent = 1.
+        # absolute, in scene units. a ten thousandth of the mesh size by default
+        self.errorBound = errorBound if errorBound is not None else self.extent * 1e-4
+
+        self.frames = []
+        self.maxError = 0.
+
+    def __len__(self):
+        return len(self.frames)
+
+    def append(self, points):
+        points = np.asarray(points, np.float32).reshape(-1, 3)
+        delta = points - self.rest
+        if not delta.any():
+            self.frames.append(('rest', None))
+            return
+
+        if self.quantization == 'int16':
+            lo = delta.min(axis=0)
+            hi = delta.max(axis=0)
+            scale = (hi - lo) / 65535.
+            scale[scale == 0] = 1.
+            quantized = np.rint((delta - lo) / scale - 32768.).astype(np.int16)
+            frame = ('int16', (quantized, scale.astype(np.float32), (lo + 32768. * scale).astype(np.float32)))
+        else:
+            frame = ('float16', (delta / self.extent).astype(np.float16))
+
+        self.frames.append(frame)
+        error = float(np.abs(self.decode(len(self.frames) - 1) - points).max())
+        if error > self.errorBound:
+            self.frames[-1] = ('float32', points.copy())
+        else:
+            self.maxError = max(self.maxError, error)
+
+    def decode(self, index, out=None):
+        kind, data = self.frames[index]
+        if out is None:
+            out = np.empty_like(self.rest)
+
+        if kind == 'rest':
+            out[:] = self.rest
+        elif kind == 'int16':
+            quantized, scale, bias = data
+            np.multiply(quantized, scale, out=out)
+            out += bias
+            out += self.rest
+        elif kind == 'float16':
+            np.multiply(data, np.float32(self.extent), out=out)
+            out += self.rest
+        else:
+            out[:] = data
+        return out
+
+    def storedBytes(self):
+        total = self.rest.nbytes
+        for kind, data in self.frames:
+            if kind == 'int16':
+                total += sum(array.nbytes for array in data)
+            elif data is not None:
+                total += data.nbytes
+        return total
+
+    def rawBytes(self):
+        return self.rest.nbytes * len(self.frames)
+
+    def stats(self):
+        kinds = {}
+        for kind, data in self.frames:
+            kinds[kind] = kinds.get(kind, 0) + 1
+        return {
+            'frames': len(self.frames),
+            'kinds': kinds,
+            'rawBytes': self.rawBytes(),
+            'storedBytes': self.storedBytes(),
+            'maxError': self.maxError,
+            'errorBound': self.errorBound,
+        }
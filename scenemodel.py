@@ -0,0 +1,243 @@
+import re
+import bisect
+import numpy as np
+from PySide import QtCore
+
+
+def parentOf(path):
+    if path == '/':
+        return None
+    parentPath = path.rsplit('/', 1)[0]
+    return parentPath if parentPath else '/'
+
+
+class PathIndex(object):
+    # flat index over the scene paths, children are grouped once up front and
+    # only sorted when somebody asks for them. searching runs over a single
+    # lower cased string instead of the paths one by one.
+    def __init__(self, paths):
+        self.children = {}
+        self.sorted = set()
+        for path in paths:
+            parentPath = parentOf(path)
+            if parentPath is None:
+                continue
+            if parentPath not in self.children:
+                self.children[parentPath] = [path]
+            else:
+                self.children[parentPath].append(path)
+
+        self.paths = list(paths)
+        self.haystack = None
+        self.starts = None
+
+    def childrenOf(self, path):
+        children = self.children.get(path, [])
+        if path not in self.sorted:
+            children.sort()
+            self.sorted.add(path)
+        return children
+
+    def add(self, path):
+        # returns the parent and, when its children are already sorted, the
+        # row the path went in at
+        self.paths.append(path)
+        self.haystack = None
+        parentPath = parentOf(path)
+        if parentPath is None:
+            return None, None
+        children = self.children.setdefault(parentPath, [])
+        if parentPath in self.sorted:
+            row = bisect.bisect(children, path)
+            children.insert(row, path)
+            return parentPath, row
+        children.append(path)
+        return parentPath, None
+
+    def search(self, pattern):
+        if self.haystack is None:
+            self.haystack = '\n'.join(self.paths).lower()
+            lengths = np.array([len(path) + 1 for path in self.paths], np.int64)
+            self.starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+        offsets = np.array(
+            [match.start() for match in re.finditer(re.escape(pattern.lower()), self.haystack)],
+            np.int64
+        )
+        if offsets.shape[0] == 0:
+            return []
+        rows = np.unique(np.searchsorted(self.starts, offsets, side='right') - 1)
+        return [self.paths[row] for row in rows]
+
+
+class Node(object):
+    def __init__(self, path, parent, row):
+        self.path = path
+        self.parent = parent
+        self.row = row
+        self.children = []
+
+
+class SceneTreeModel(QtCore.QAbstractItemModel):
+    # nodes only exist for rows the view has fetched, so expanding a group is
+    # the first time anything below it costs memory
+    def __init__(self, root, fetchBatch=256, *args):
+        super(SceneTreeModel, self).__init__(*args)
+        self.root = root
+        self.fetchBatch = fetchBatch
+        self.pathIndex = PathIndex(root.map.keys())
+
+        self.filterText = ''
+        self.filtered = None
+        self.matchCount = 0
+        self.clearNodes()
+
+    def clearNodes(self):
+        # the invisible top node holds the root branch as its only row
+        self.top = Node(None, None, 0)
+        self.nodes = {}
+
+    def childPaths(self, path):
+        if path is None:
+            return ['/']
+        if self.filtered is not None:
+            return self.filtered.get(path, [])
+        return self.pathIndex.childrenOf(path)
+
+    def nodeFromIndex(self, index):
+        if index.isValid():
+            return index.internalPointer()
+        return self.top
+
+    def pathFromIndex(self, index):
+        return self.nodeFromIndex(index).path
+
+    def indexFromPath(self, path):
+        # fetches the ancestors on the way down if the view hasn't yet
+        if path in self.nodes:
+            node = self.nodes[path]
+            return self.createIndex(node.row, 0, node)
+        parentPath = parentOf(path)
+        if parentPath is not None:
+            parentIndex = self.indexFromPath(parentPath)
+            if not parentIndex.isValid():
+                return QtCore.QModelIndex()
+        else:
+            parentIndex = QtCore.QModelIndex()
+        while path not in self.nodes and self.canFetchMore(parentIndex):
+            self.fetchMore(parentIndex)
+        if path not in self.nodes:
+            return QtCore.QModelIndex()
+        node = self.nodes[path]
+        return self.createIndex(node.row, 0, node)
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        node = self.nodeFromIndex(parent)
+        if row < 0 or row >= len(node.children) or column != 0:
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is None or parent is self.top:
+            return QtCore.QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return len(self.nodeFromIndex(parent).children)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        node = self.nodeFromIndex(parent)
+        return len(node.children) > 0 or len(self.childPaths(node.path)) > 0
+
+    def canFetchMore(self, parent):
+        node = self.nodeFromIndex(parent)
+        return len(node.children) < len(self.childPaths(node.path))
+
+    def fetchMore(self, parent):
+        node = self.nodeFromIndex(parent)
+        paths = self.childPaths(node.path)
+        first = len(node.children)
+        last = min(first + self.fetchBatch, len(paths)) - 1
+        if last < first:
+            return
+        self.beginInsertRows(parent, first, last)
+        for row in range(first, last + 1):
+            child = Node(paths[row], node, row)
+            node.children.append(child)
+            self.nodes[child.path] = child
+        self.endInsertRows()
+
+    def addPaths(self, paths):
+        # streamed in while loading. rows the view has fetched get a proper
+        # insert, anything past those is picked up by fetchMore later. a
+        # filtered tree only shows the new paths once the filter changes
+        for path in paths:
+            parentPath, row = self.pathIndex.add(path)
+            if self.filtered is not None or row is None or parentPath not in self.nodes:
+                continue
+            node = self.nodes[parentPath]
+            if row > len(node.children):
+                continue
+            self.beginInsertRows(self.createIndex(node.row, 0, node), row, row)
+            child = Node(path, node, row)
+            node.children.insert(row, child)
+            self.nodes[path] = child
+            for i in range(row + 1, len(node.children)):
+                node.children[i].row = i
+            self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        path = index.internalPointer().path
+        if role == QtCore.Qt.DisplayRole:
+            return self.root.map[path].name
+        elif role == QtCore.Qt.ToolTipRole:
+            return path
+        elif role == QtCore.Qt.UserRole:
+            return path
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return 'Objects'
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+
+    def setFilter(self, text):
+        # matches and their ancestors make up the filtered tree, returns the
+        # number of matching paths
+        text = text.strip()
+        if text == self.filterText:
+            return self.matchCount
+        self.beginResetModel()
+        self.filterText = text
+        self.matchCount = 0
+        if len(text) == 0:
+            self.filtered = None
+        else:
+            matches = self.pathIndex.search(text)
+            self.matchCount = len(matches)
+            visible = set()
+            for path in matches:
+                while path is not None and path not in visible:
+                    visible.add(path)
+                    path = parentOf(path)
+            self.filtered = {}
+            for path in sorted(visible):
+                parentPath = parentOf(path)
+                if parentPath is not None:
+                    self.filtered.setdefault(parentPath, []).append(path)
+        self.clearNodes()
+        self.endResetModel()
+        return self.matchCount
@@ -0,0 +1,60 @@
+from PySide import QtCore
+
+
+# anything in SCENE_DIRT invalidates the cached scene image, the rest only
+# needs the overlay (hovered mesh highlight, cursor and pins) redrawn on top
+SCENE_DIRT = frozenset(['camera', 'sample', 'offsets', 'scene'])
+OVERLAY_DIRT = frozenset(['brush', 'pins', 'time'])
+
+
+class FrameScheduler(QtCore.QObject):
+    def __init__(self, viewer, *args):
+        super(FrameScheduler, self).__init__(*args)
+        self.viewer = viewer
+        self.dirty = set()
+
+        # a zero timeout fires once the event queue is drained, so every input
+        # event that arrived in between is handled by a single tick
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.tick)
+
+        self.ticks = 0
+        self.sceneFrames = 0
+        self.overlayFrames = 0
+        self.idleTicks = 0
+
+    def markDirty(self, *kinds):
+        self.dirty.update(kinds)
+        self.requestFrame()
+
+    def requestFrame(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def tick(self):
+        self.ticks += 1
+        self.viewer.makeCurrent()
+        self.viewer.processInput()
+        if len(self.dirty) > 0:
+            self.viewer.update()
+        else:
+            self.idleTicks += 1
+
+    def takeDirty(self):
+        dirty = self.dirty
+        self.dirty = set()
+        if len(dirty & SCENE_DIRT) > 0:
+            self.sceneFrames += 1
+        elif len(dirty) > 0:
+            self.overlayFrames += 1
+        return dirty
+
+    def stats(self):
+        return {
+            'ticks': self.ticks,
+            'sceneFrames': self.sceneFrames,
+            'overlayFrames': self.overlayFrames,
+            'idleTicks': self.idleTicks,
+        }
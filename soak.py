@@ -0,0 +1,276 @@
+import os
+import gc
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import resource
+from timeit import default_timer
+
+# playblast picks the gl platform from --platform, it has to be imported
+# before anything else pulls in OpenGL
+from playblast import Playblast, CONTEXTS, defaultPlatform
+import numpy as np
+import OpenGL.GL as gl
+from external import alembic
+from loader import rootFromAlembic
+from resources import GPU
+from scheduler import SCENE_DIRT
+from benchmark import gridMesh
+
+
+def writeArchive(filePath, objects, vertices, frames, fps=24.):
+    # objects xforms with an animated grid of about vertices points under each
+    resolution = max(2, int(round(np.sqrt(vertices))))
+    points, counts, indices = gridMesh(resolution)
+    columns = max(1, int(np.ceil(np.sqrt(objects))))
+
+    archive = alembic.getOArchive(filePath)
+    tsIndex = archive.createTimeSampling([frame / fps for frame in range(frames)])
+    for index in range(objects):
+        matrix = np.identity(4)
+        matrix[3, 0] = (index % columns) * 12.
+        matrix[3, 2] = (index // columns) * 12.
+        xform = archive.createObject('AbcGeom_Xform_v3', '/group%d' % index, 0)
+        xform.getProperty('.xform').setValues(matrix.ravel().tolist())
+
+        mesh = archive.createObject('AbcGeom_PolyMesh_v1', '/group%d/mesh%d' % (index, index), tsIndex)
+        mesh.getProperty('.faceCounts').setValues(counts.tolist())
+        mesh.getProperty('.faceIndices').setValues(indices.tolist())
+        pointProp = mesh.getProperty('P')
+        for frame in range(frames):
+            # a travelling wave, every frame differs so playback uploads each one
+            wave = points.copy()
+            wave[:, 1] += np.sin(points[:, 0] + frame * .3 + index) * .5
+            pointProp.setValues(wave.ravel().tolist())
+    # the archive is written out when the last reference goes away
+    del archive
+
+
+def currentRSS():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        return peakRSS()
+
+
+def peakRSS():
+    # kilobytes on linux, bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def percentiles(times):
+    times = np.array(times) * 1000.
+    if times.shape[0] == 0:
+        return {'meanMs': 0., 'p50Ms': 0., 'p90Ms': 0., 'maxMs': 0.}
+    p50, p90 = np.percentile(times, [50, 90])
+    return {'meanMs': float(times.mean()), 'p50Ms': float(p50), 'p90Ms': float(p90), 'maxMs': float(times.max())}
+
+
+class SoakDriver(object):
+    # load, play and deform loop on one headless context, reused across runs
+    # so scene reloads go through App.setRoot like they do in the viewer
+    def __init__(self, width=640, height=360, platform='osmesa'):
+        self.playblast = Playblast(width, height, platform)
+        self.app = self.playblast.app
+
+    def run(self, filePath, frames, solves, fps=24.):
+        stats = {}
+
+        start = default_timer()
+        root = rootFromAlembic(filePath)
+        stats['loadSeconds'] = default_timer() - start
+
+        start = default_timer()
+        self.playblast.setRoot(root)
+        self.app.updateTimeSlot(0.)
+        self.playblast.frameScene()
+        self.app.draw(SCENE_DIRT)
+        gl.glFinish()
+        stats['firstFrameSeconds'] = default_timer() - start
+
+        frameTimes = []
+        for frame in range(frames):
+            start = default_timer()
+            self.app.updateTimeSlot(frame / fps)
+            self.app.draw(SCENE_DIRT)
+            gl.glFinish()
+            frameTimes.append(default_timer() - start)
+        stats['playback'] = percentiles(frameTimes)
+
+        stats['solve'] = percentiles(self.solve(root, solves))
+
+        gc.collect()
+        stats['rss'] = currentRSS()
+        stats['peakRSS'] = peakRSS()
+        stats['gpuLive'] = GPU.liveBytes()
+        stats['gpuPooled'] = GPU.pooledBytes
+        stats['gpuObjects'] = len(GPU.records)
+        return stats
+
+    def solve(self, root, solves):
+        # three pins on the biggest mesh, the last one dragged like the brush does
+        meshes = [branch for branch in root.map.values() if branch.kind == 'PolyMesh']
+        if len(meshes) == 0 or solves == 0:
+            return []
+        mesh = max(meshes, key=lambda mesh: mesh.points.shape[0])
+        # pins and solves belong to the rubber brush, it only sees the mesh
+        # while it is the current one
+        previousMode = 'rubber' if self.app.currentBrush is self.app.brushes['rubber'] else 'default'
+        self.app.setMode('rubber')
+        self.app.setActiveMesh(mesh)
+        rubber = self.app.brushes['rubber'].operator
+        count = mesh.points.shape[0]
+        for vertID in (0, count // 2, count - 1):
+            rubber.appendPin(vertID, (mesh.points[vertID] + mesh.offsets[vertID]).astype(float).tolist())
+        # anything else and the solves below time nothing but the draw
+        assert rubber.arapData is not None, 'rubber was not set up on %s' % mesh.path
+
+        camera = self.app.currentCamera
+        times = []
+        rubber.beginStroke()
+        for _ in range(solves):
+            start = default_timer()
+            rubber.solveDelta(-1, .002, .001, camera.cameraPosition(), camera.upsign)
+            self.app.draw(SCENE_DIRT)
+            gl.glFinish()
+            times.append(default_timer() - start)
+        rubber.endStroke()
+        self.app.clearPins()
+        self.app.setActiveMesh(None)
+        self.app.setMode(previousMode)
+        return times
+
+    def release(self):
+        self.playblast.release()
+
+
+def growth(values, warmup):
+    # per iteration trend after warmup, by least squares
+    values = np.array(values, np.float64)[warmup:]
+    if values.shape[0] < 2:
+        return 0.
+    return float(np.polyfit(np.arange(values.shape[0]), values, 1)[0])
+
+
+def scale(driver, axes, base, solves, directory, out=sys.stdout):
+    # one curve per axis, the other two held at their base value
+    curves = {}
+    for axis in ('objects', 'vertices', 'frames'):
+        curves[axis] = []
+        for value in axes[axis]:
+            config = dict(base)
+            config[axis] = value
+            filePath = os.path.join(directory, 'scale_%(objects)d_%(vertices)d_%(frames)d.abc' % config)
+            if not os.path.exists(filePath):
+                writeArchive(filePath, config['objects'], config['vertices'], config['frames'])
+            stats = driver.run(filePath, config['frames'], solves)
+            stats.update(config)
+            curves[axis].append(stats)
+            out.write('%-8s %8d  load %7.2fs  first frame %6.2fs  frame %7.1f ms  solve %7.1f ms  rss %7.1f MB  gpu %7.1f MB\n' % (
+                axis, value, stats['loadSeconds'], stats['firstFrameSeconds'],
+                stats['playback']['meanMs'], stats['solve']['meanMs'],
+                stats['rss'] / 1048576., stats['gpuLive'] / 1048576.
+            ))
+
+        # log-log slope, 1 is linear in the axis
+        if len(curves[axis]) > 1:
+            x = np.log([stats[axis] for stats in curves[axis]])
+            for key in ('loadSeconds', 'firstFrameSeconds'):
+                y = np.log([max(stats[key], 1e-9) for stats in curves[axis]])
+                out.write('  %s grows as %s^%.2f\n' % (key, axis, np.polyfit(x, y, 1)[0]))
+    return curves
+
+
+def soak(driver, filePath, iterations, frames, solves, warmup=3, rssTolerance=1 << 20, out=sys.stdout):
+    # the same scene loaded over and over, everything it allocates has to
+    # come back once the next one replaces it
+    history = []
+    for iteration in range(iterations):
+        stats = driver.run(filePath, frames, solves)
+        history.append(stats)
+        out.write('%4d  rss %7.1f MB  gpu live %7.1f MB  pooled %7.1f MB  objects %d\n' % (
+            iteration, stats['rss'] / 1048576., stats['gpuLive'] / 1048576.,
+            stats['gpuPooled'] / 1048576., stats['gpuObjects']
+        ))
+
+    trends = {
+        'rssPerIteration': growth([stats['rss'] for stats in history], warmup),
+        'gpuLivePerIteration': growth([stats['gpuLive'] for stats in history], warmup),
+        'gpuObjectsPerIteration': growth([stats['gpuObjects'] for stats in history], warmup),
+    }
+    # gpu objects are counted exactly, any real trend is a leak. rss is noisier
+    leaking = (
+        trends['rssPerIteration'] > rssTolerance or
+        trends['gpuLivePerIteration'] > 1. or
+        trends['gpuObjectsPerIteration'] > .5
+    )
+    out.write('rss %+.1f KB, gpu %+.1f KB, %+.2f gpu objects per iteration after %d warmup: %s\n' % (
+        trends['rssPerIteration'] / 1024., trends['gpuLivePerIteration'] / 1024.,
+        trends['gpuObjectsPerIteration'], warmup, 'GROWING' if leaking else 'stable'
+    ))
+    return history, trends, leaking
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='headless load, playback and solve loop over growing scenes')
+    parser.add_argument('--platform', choices=sorted(CONTEXTS.keys()), default=defaultPlatform())
+    parser.add_argument('--size', nargs=2, type=int, default=[640, 360], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--solves', type=int, default=20)
+    parser.add_argument('--output', default=None, help='json file for the results')
+    parser.add_argument('--keep', default=None, help='directory to write the archives to and keep them in')
+    commands = parser.add_subparsers(dest='command')
+
+    scaleParser = commands.add_parser('scale', help='scaling curves, one axis at a time')
+    scaleParser.add_argument('--objects', nargs='+', type=int, default=[1, 10, 100])
+    scaleParser.add_argument('--vertices', nargs='+', type=int, default=[1000, 10000, 100000])
+    scaleParser.add_argument('--frames', nargs='+', type=int, default=[24, 96])
+
+    soakParser = commands.add_parser('soak', help='reload one scene repeatedly and watch memory')
+    soakParser.add_argument('--iterations', type=int, default=50)
+    soakParser.add_argument('--warmup', type=int, default=3)
+    soakParser.add_argument('--objects', type=int, default=20)
+    soakParser.add_argument('--vertices', type=int, default=10000)
+    soakParser.add_argument('--frames', type=int, default=24)
+    soakParser.add_argument('--rss-tolerance', type=float, default=1., help='MB per iteration')
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        parser.print_help()
+        return 2
+
+    directory = args.keep or tempfile.mkdtemp(prefix='soak')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    driver = SoakDriver(args.size[0], args.size[1], args.platform)
+    status = 0
+    try:
+        if args.command == 'scale':
+            axes = {'objects': args.objects, 'vertices': args.vertices, 'frames': args.frames}
+            base = dict((axis, values[0]) for axis, values in axes.items())
+            report = {'curves': scale(driver, axes, base, args.solves, directory)}
+        else:
+            filePath = os.path.join(directory, 'soak.abc')
+            writeArchive(filePath, args.objects, args.vertices, args.frames)
+            history, trends, leaking = soak(
+                driver, filePath, args.iterations, args.frames, args.solves,
+                args.warmup, args.rss_tolerance * 1048576.
+            )
+            report = {'iterations': history, 'trends': trends, 'growing': leaking}
+            status = 1 if leaking else 0
+    finally:
+        driver.release()
+        if args.keep is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as outFile:
+            json.dump(report, outFile, indent=2, sort_keys=True)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,337 @@
+import numpy as np
+
+
+def unproject(mX, mY, viewportCoords, modelView, projection):
+    # mX, mY are window coordinates with the origin at the bottom left, same as igl
+    x = (mX - viewportCoords[0]) / float(viewportCoords[2]) * 2. - 1.
+    y = (mY - viewportCoords[1]) / float(viewportCoords[3]) * 2. - 1.
+
+    inverse = np.linalg.inv(np.dot(projection, modelView))
+    near = np.dot(inverse, [x, y, -1., 1.])
+    far = np.dot(inverse, [x, y, 1., 1.])
+    near = near[:3] / near[3]
+    far = far[:3] / far[3]
+
+    return near, far - near
+
+
+def intersectTriangles(origin, direction, a, b, c, epsilon=1e-12):
+    # vectorized Moller-Trumbore, returns t, u, v and a mask of the valid hits
+    e1 = b - a
+    e2 = c - a
+    p = np.cross(direction, e2)
+    det = np.einsum('ij,ij->i', e1, p)
+    valid = np.abs(det) > epsilon
+    invDet = np.where(valid, 1. / np.where(valid, det, 1.), 0.)
+
+    s = origin - a
+    u = np.einsum('ij,ij->i', s, p) * invDet
+    q = np.cross(s, e1)
+    v = np.dot(q, direction) * invDet
+    t = np.einsum('ij,ij->i', e2, q) * invDet
+
+    valid &= (u >= 0.) & (v >= 0.) & (u + v <= 1.) & (t >= 0.)
+    return t, u, v, valid
+
+
+def intersectBoxes(origin, invDirection, boxMin, boxMax):
+    # slab test against many boxes at once, returns entry distance and mask
+    with np.errstate(invalid='ignore'):
+        t0 = (boxMin - origin) * invDirection
+        t1 = (boxMax - origin) * invDirection
+    tNear = np.nanmax(np.minimum(t0, t1), axis=1)
+    tFar = np.nanmin(np.maximum(t0, t1), axis=1)
+    # padding leaves have inverted bounds and never hit
+    return tNear, (tFar >= np.maximum(tNear, 0.)) & np.all(boxMin <= boxMax, axis=1)
+
+
+def mortonCodes(centroids):
+    lo = centroids.min(axis=0)
+    extent = centroids.max(axis=0) - lo
+    extent[extent == 0] = 1.
+    cells = ((centroids - lo) / extent * 1023.).astype(np.uint32)
+
+    codes = np.zeros(centroids.shape[0], np.uint32)
+    for axis in range(3):
+        x = cells[:, axis]
+        x = (x | (x << 16)) & 0x030000FF
+        x = (x | (x << 8)) & 0x0300F00F
+        x = (x | (x << 4)) & 0x030C30C3
+        x = (x | (x << 2)) & 0x09249249
+        codes |= x << (2 - axis)
+    return codes
+
+
+class AABBTree(object):
+    # linear BVH: triangles sorted along a morton curve, grouped into fixed
+    # size leaves and stored as an implicit binary heap (node i has children
+    # 2i and 2i + 1, leaves start at leafOffset). the topology only depends on
+    # the rest positions, so following deformations is a bottom up refit.
+    def __init__(self, triangles, positions, leafSize=8):
+        self.triangles = np.asarray(triangles, np.int64).reshape(-1, 3)
+        self.leafSize = leafSize
+
+        triCount = self.triangles.shape[0]
+        leafCount = max(1, int(np.ceil(triCount / float(leafSize))))
+        self.leafOffset = 1 << int(np.ceil(np.log2(leafCount)))
+        self.depth = int(np.log2(self.leafOffset))
+
+        centroids = positions[self.triangles].mean(axis=1)
+        self.order = np.argsort(mortonCodes(centroids), kind='mergesort')
+
+        # padding slots point at -1 and are ignored on queries
+        slots = self.leafOffset * leafSize
+        self.leafTriangles = np.full(slots, -1, np.int64)
+        self.leafTriangles[:triCount] = self.order
+        self.leafTriangles = self.leafTriangles.reshape(self.leafOffset, leafSize)
+
+        self.boxMin = np.empty((self.leafOffset * 2, 3), np.float32)
+        self.boxMax = np.empty((self.leafOffset * 2, 3), np.float32)
+        self.refit(positions)
+
+    def refit(self, positions):
+        self.positions = positions
+        triCount = self.triangles.shape[0]
+        corners = positions[self.triangles[self.order]]
+        triMin = corners.min(axis=1)
+        triMax = corners.max(axis=1)
+
+        padded = self.leafOffset * self.leafSize
+        leafMin = np.full((padded, 3), np.inf, np.float32)
+        leafMax = np.full((padded, 3), -np.inf, np.float32)
+        leafMin[:triCount] = triMin
+        leafMax[:triCount] = triMax
+
+        start = self.leafOffset
+        self.boxMin[start:] = leafMin.reshape(-1, self.leafSize, 3).min(axis=1)
+        self.boxMax[start:] = leafMax.reshape(-1, self.leafSize, 3).max(axis=1)
+
+        while start > 1:
+            parent = start // 2
+            self.boxMin[parent:start] = np.minimum(self.boxMin[start::2][:parent], self.boxMin[start + 1::2][:parent])
+            self.boxMax[parent:start] = np.maximum(self.boxMax[start::2][:parent], self.boxMax[start + 1::2][:parent])
+            start = parent
+
+    def candidateLeaves(self, origin, direction, tMax=np.inf):
+        with np.errstate(divide='ignore'):
+            invDirection = 1. / direction
+
+        # breadth first, one vectorized box test per level
+        nodes = np.array([1], np.int64)
+        tNear, hits = intersectBoxes(origin, invDirection, self.boxMin[nodes], self.boxMax[nodes])
+        nodes = nodes[hits & (tNear <= tMax)]
+        for _ in range(self.depth):
+            if nodes.shape[0] == 0:
+                break
+            nodes = np.concatenate([nodes * 2, nodes * 2 + 1])
+            tNear, hits = intersectBoxes(origin, invDirection, self.boxMin[nodes], self.boxMax[nodes])
+            nodes = nodes[hits & (tNear <= tMax)]
+
+        return nodes - self.leafOffset
+
+    def intersectCandidates(self, origin, direction, candidates):
+        candidates = candidates[candidates >= 0]
+        if candidates.shape[0] == 0:
+            return -1, None, np.inf
+
+        faces = self.triangles[candidates]
+        t, u, v, valid = intersectTriangles(
+            origin,
+            direction,
+            self.positions[faces[:, 0]],
+            self.positions[faces[:, 1]],
+            self.positions[faces[:, 2]]
+        )
+        if not np.any(valid):
+            return -1, None, np.inf
+
+        t = np.where(valid, t, np.inf)
+        nearest = np.argmin(t)
+        barycentricCoords = np.array([1. - u[nearest] - v[nearest], u[nearest], v[nearest]])
+        return int(candidates[nearest]), barycentricCoords, t[nearest]
+
+    def intersect(self, origin, direction, tMax=np.inf):
+        origin = np.asarray(origin, np.float64)
+        direction = np.asarray(direction, np.float64)
+        leaves = self.candidateLeaves(origin, direction, tMax)
+        return self.intersectCandidates(origin, direction, self.leafTriangles[leaves].ravel())
+
+
+def gatherRanges(indices, starts, ends):
+    # concatenates indices[start:end] for every range without a python loop
+    counts = ends - starts
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, indices.dtype)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return indices[offsets + np.arange(total)]
+
+
+def expandCSR(indptr, indices, rows):
+    return gatherRanges(indices, indptr[rows], indptr[rows + 1])
+
+
+def triangleAdjacency(triangles, vertexCount):
+    # triangles sharing at least one vertex, as CSR arrays. neighbour lists
+    # keep duplicates and the triangle itself, callers unique what they gather.
+    corners = np.asarray(triangles, np.int64).ravel()
+    vertexTriangles = (np.argsort(corners, kind='mergesort') // 3).astype(np.int32)
+    vertexCounts = np.bincount(corners, minlength=vertexCount)
+    vertexPtr = np.concatenate([[0], np.cumsum(vertexCounts)])
+
+    neighbors = expandCSR(vertexPtr, vertexTriangles, corners)
+    triangleCounts = vertexCounts[corners].reshape(-1, 3).sum(axis=1)
+    indptr = np.concatenate([[0], np.cumsum(triangleCounts)])
+    return indptr, neighbors
+
+
+class CoherentPicker(object):
+    # consecutive mouse moves mostly land on the same or a neighbouring
+    # triangle, so the rings around the last hit are tested first. a ring hit
+    # can be hidden behind other geometry, so it is never returned as is, its
+    # distance bounds the BVH query instead and every box beyond it is
+    # skipped. the answer is always the one AABBTree.intersect gives
+    def __init__(self, rings=3):
+        self.rings = rings
+        self.lastTriID = -1
+
+        self.queries = 0
+        self.fastHits = 0
+        self.fallbacks = 0
+
+    def reset(self):
+        self.lastTriID = -1
+
+    def resetCounters(self):
+        self.queries = 0
+        self.fastHits = 0
+        self.fallbacks = 0
+
+    def hitRate(self):
+        if self.queries == 0:
+            return 0.
+        return self.fastHits / float(self.queries)
+
+    def neighborhood(self, indptr, neighbors, triID):
+        candidates = np.array([triID], np.int64)
+        frontier = candidates
+        for _ in range(self.rings):
+            ring = np.unique(expandCSR(indptr, neighbors, frontier))
+            frontier = np.setdiff1d(ring, candidates, assume_unique=True)
+            if frontier.shape[0] == 0:
+                break
+            candidates = np.union1d(candidates, frontier)
+        return candidates
+
+    def intersect(self, mesh, origin, direction):
+        origin = np.asarray(origin, np.float64)
+        direction = np.asarray(direction, np.float64)
+        bvh = mesh.getBVH()
+        self.queries += 1
+
+        if self.lastTriID != -1:
+            indptr, neighbors = mesh.getTriangleAdjacency()
+            candidates = self.neighborhood(indptr, neighbors, self.lastTriID)
+            ringID, _, ringT = bvh.intersectCandidates(origin, direction, candidates)
+            hitID = -1
+            if ringID != -1:
+                # the nearest hit is at most ringT away, so is the entry of
+                # every box on the way to it. the slack covers the boxes
+                # being float32
+                hitID, barycentricCoords, t = bvh.intersect(origin, direction, tMax=ringT * (1. + 1e-5) + 1e-9)
+            if hitID != -1:
+                self.fastHits += 1
+                self.lastTriID = hitID
+                return hitID, barycentricCoords, t
+
+        self.fallbacks += 1
+        hitID, barycentricCoords, t = bvh.intersect(origin, direction)
+        self.lastTriID = hitID
+        return hitID, barycentricCoords, t
+
+
+FALLOFFS = {
+    'constant': lambda x: np.ones_like(x),
+    'linear': lambda x: 1. - x,
+    'smooth': lambda x: (1. - x * x) ** 2,
+    'gaussian': lambda x: np.exp(-x * x * 4.),
+}
+
+
+class HashGrid(object):
+    # uniform grid over vertex positions, kept as vertex ids sorted by cell
+    # key so a cell is a searchsorted range. partial updates only move the
+    # vertices that changed cells.
+    BIAS = 1 << 20
+
+    def __init__(self, positions, cellSize=None):
+        if cellSize is None:
+            # a few average vertex spacings, assuming the points lie on a surface
+            diagonal = np.linalg.norm(positions.max(axis=0) - positions.min(axis=0))
+            cellSize = 4. * diagonal / max(1., np.sqrt(positions.shape[0]))
+        self.cellSize = max(float(cellSize), 1e-6)
+        self.rebuild(positions)
+
+    def cellCoords(self, positions):
+        return np.floor(positions / self.cellSize).astype(np.int64)
+
+    def cellKeys(self, coords):
+        coords = coords + self.BIAS
+        return (coords[..., 0] << 42) | (coords[..., 1] << 21) | coords[..., 2]
+
+    def rebuild(self, positions):
+        self.positions = positions
+        self.vertexKeys = self.cellKeys(self.cellCoords(positions))
+        self.sortedIDs = np.argsort(self.vertexKeys, kind='mergesort')
+        self.sortedKeys = self.vertexKeys[self.sortedIDs]
+
+    def update(self, positions, vertIDs=None):
+        if vertIDs is None or len(vertIDs) > positions.shape[0] // 4:
+            self.rebuild(positions)
+            return
+
+        self.positions = positions
+        vertIDs = np.asarray(vertIDs, np.int64)
+        newKeys = self.cellKeys(self.cellCoords(positions[vertIDs]))
+        changed = newKeys != self.vertexKeys[vertIDs]
+        if not np.any(changed):
+            return
+
+        moved = vertIDs[changed]
+        newKeys = newKeys[changed]
+        self.vertexKeys[moved] = newKeys
+
+        keep = np.isin(self.sortedIDs, moved, invert=True)
+        sortedIDs = self.sortedIDs[keep]
+        sortedKeys = self.sortedKeys[keep]
+
+        order = np.argsort(newKeys, kind='mergesort')
+        slots = np.searchsorted(sortedKeys, newKeys[order])
+        self.sortedIDs = np.insert(sortedIDs, slots, moved[order])
+        self.sortedKeys = np.insert(sortedKeys, slots, newKeys[order])
+
+    def candidates(self, center, radius):
+        lo = self.cellCoords(np.asarray(center) - radius)
+        hi = self.cellCoords(np.asarray(center) + radius)
+        spans = hi - lo + 1
+        # a radius spanning too many cells is cheaper as one brute force pass
+        if np.prod(spans) > max(64, self.sortedIDs.shape[0] // 8):
+            return self.sortedIDs
+
+        axes = [np.arange(lo[i], hi[i] + 1) for i in range(3)]
+        coords = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+        keys = self.cellKeys(coords)
+        starts = np.searchsorted(self.sortedKeys, keys, side='left')
+        ends = np.searchsorted(self.sortedKeys, keys, side='right')
+        return gatherRanges(self.sortedIDs, starts, ends)
+
+    def query(self, center, radius, falloff='smooth'):
+        center = np.asarray(center, np.float64)
+        vertIDs = self.candidates(center, radius)
+        distances = np.linalg.norm(self.positions[vertIDs] - center, axis=1)
+        inside = distances <= radius
+        vertIDs = vertIDs[inside]
+        distances = distances[inside]
+
+        weights = FALLOFFS[falloff](distances / max(radius, 1e-12))
+        return vertIDs, weights, distances
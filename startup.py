@@ -0,0 +1,69 @@
+import sys
+from timeit import default_timer
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+
+class StartupProfiler(object):
+    # wraps __import__ to time every module the first time it is loaded.
+    # nested imports are subtracted so each module only reports its own cost
+    def __init__(self):
+        self.origin = default_timer()
+        self.imports = []
+        self.marks = []
+        self.stack = []
+        self.originalImport = None
+
+    def install(self):
+        self.originalImport = builtins.__import__
+        builtins.__import__ = self.timedImport
+
+    def uninstall(self):
+        if self.originalImport is not None:
+            builtins.__import__ = self.originalImport
+            self.originalImport = None
+
+    @staticmethod
+    def moduleName(name, args, kwargs):
+        # relative imports are named after the package doing the import
+        level = kwargs.get('level', args[3] if len(args) > 3 else 0)
+        if level <= 0:
+            return name
+        importGlobals = kwargs.get('globals', args[0] if len(args) > 0 else None) or {}
+        package = importGlobals.get('__package__') or ''
+        return (package + '.' + name).strip('.')
+
+    def timedImport(self, name, *args, **kwargs):
+        fullName = self.moduleName(name, args, kwargs)
+        if fullName in sys.modules:
+            return self.originalImport(name, *args, **kwargs)
+
+        self.stack.append(0.)
+        start = default_timer()
+        try:
+            return self.originalImport(name, *args, **kwargs)
+        finally:
+            total = default_timer() - start
+            nested = self.stack.pop()
+            if len(self.stack) > 0:
+                self.stack[-1] += total
+            self.imports.append((fullName, total, total - nested, len(self.stack)))
+
+    def mark(self, name):
+        self.marks.append((name, default_timer() - self.origin))
+
+    def report(self, top=20):
+        lines = ['startup']
+        previous = 0.
+        for name, elapsed in self.marks:
+            lines.append('  %-32s %8.1f ms  (+%.1f)' % (name, elapsed * 1000., (elapsed - previous) * 1000.))
+            previous = elapsed
+
+        importTotal = sum(total for name, total, own, depth in self.imports if depth == 0)
+        lines.append('imports %.1f ms over %d modules, slowest by own time' % (importTotal * 1000., len(self.imports)))
+        slowest = sorted(self.imports, key=lambda item: item[2], reverse=True)[:top]
+        for name, total, own, depth in slowest:
+            lines.append('  %-32s %8.1f ms  (%.1f with nested)' % (name, own * 1000., total * 1000.))
+        return '\n'.join(lines)
@@ -0,0 +1,81 @@
+from playback import PlaybackClock
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+def play(clock, timer, seconds, tickRate, showEvery=1):
+    # ticks like the viewer's QTimer, painting every showEvery-th handed out frame
+    frames = []
+    handedOut = 0
+    for _ in range(int(round(seconds * tickRate))):
+        timer.now += 1. / tickRate
+        frame = clock.tick()
+        if frame is None:
+            continue
+        frames.append(frame)
+        handedOut += 1
+        if handedOut % showEvery == 0:
+            clock.frameShown()
+    return frames
+
+
+def startedClock(playEveryFrame):
+    timer = FakeTimer()
+    clock = PlaybackClock(24., playEveryFrame, timer=timer)
+    clock.start(0, (0, 1000))
+    return clock, timer
+
+
+def test_every_frame_keeps_the_frame_rate():
+    clock, timer = startedClock(True)
+    frames = play(clock, timer, 1., 24. * 4.)
+    assert 23 <= len(frames) <= 24
+    assert frames == list(range(1, len(frames) + 1))
+    assert clock.droppedFrames == 0
+
+
+def test_every_frame_waits_for_the_frame_to_be_shown():
+    clock, timer = startedClock(True)
+    timer.now += 1.
+    assert clock.tick() == 1
+    timer.now += 1.
+    assert clock.tick() is None
+    clock.frameShown()
+    assert clock.tick() == 2
+    assert clock.droppedFrames == 0
+
+
+def test_every_frame_slows_down_with_slow_frames():
+    # ten frames a second painted, none skipped
+    clock, timer = startedClock(True)
+    frames = play(clock, timer, 1., 10.)
+    assert frames == list(range(1, 11))
+    assert clock.droppedFrames == 0
+
+
+def test_real_time_keeps_the_frame_rate():
+    clock, timer = startedClock(False)
+    frames = play(clock, timer, 1., 24. * 4.)
+    assert 23 <= frames[-1] <= 24
+    assert clock.droppedFrames == 0
+
+
+def test_real_time_drops_slow_frames():
+    clock, timer = startedClock(False)
+    frames = play(clock, timer, 1., 10.)
+    assert 23 <= frames[-1] <= 24
+    assert clock.droppedFrames == frames[-1] - len(frames)
+    assert clock.behind()
+
+
+def test_real_time_counts_frames_never_shown():
+    clock, timer = startedClock(False)
+    frames = play(clock, timer, 1., 24. * 4., showEvery=2)
+    assert 23 <= frames[-1] <= 24
+    assert clock.droppedFrames == len(frames) // 2
@@ -0,0 +1,132 @@
+import numpy as np
+import OpenGL.GL as gl
+
+
+POSITION_FORMATS = ('float32', 'float16', 'int16')
+OFFSET_FORMATS = ('float32', 'float16')
+
+# components, gl type and normalized flag of each encoding. compact
+# positions are padded to four components so every vertex stays 4 byte aligned
+ATTRIBUTES = {
+    'float32': (3, gl.GL_FLOAT, gl.GL_FALSE),
+    'float16': (4, gl.GL_HALF_FLOAT, gl.GL_FALSE),
+    'int16': (4, gl.GL_SHORT, gl.GL_TRUE),
+    'normal': (4, gl.GL_INT_2_10_10_10_REV, gl.GL_TRUE),
+}
+
+IDENTITY_SCALE = np.ones(3, np.float32)
+IDENTITY_BIAS = np.zeros(3, np.float32)
+
+
+def bounds(points):
+    # scale and bias that map the bounding box onto [-1, 1]
+    lo = points.min(axis=0)
+    hi = points.max(axis=0)
+    scale = ((hi - lo) * .5).astype(np.float32)
+    scale[scale == 0] = 1.
+    bias = ((hi + lo) * .5).astype(np.float32)
+    return scale, bias
+
+
+def maxError(format, scale):
+    # worst rounding error of an encoding in scene units. int16 steps are
+    # uniform over the box, float16 loses the most right below 1 where its
+    # ulp is 2^-11
+    if format == 'int16':
+        return float(np.max(scale)) / 65534.
+    if format == 'float16':
+        return float(np.max(scale)) / 4096.
+    return 0.
+
+
+def encodePositions(points, format, tolerance=None):
+    # returns the format actually used, the data and the scale and bias the
+    # vertex shader decodes with. a mesh falls back to float32 when the
+    # encoding would move vertices further than tolerance
+    points = np.asarray(points, np.float32).reshape(-1, 3)
+    if format not in POSITION_FORMATS:
+        raise ValueError('unknown position format %s' % format)
+    if format == 'float32' or points.shape[0] == 0:
+        return 'float32', np.ascontiguousarray(points), IDENTITY_SCALE, IDENTITY_BIAS
+
+    scale, bias = bounds(points)
+    if tolerance is not None and maxError(format, scale) > tolerance:
+        return 'float32', np.ascontiguousarray(points), IDENTITY_SCALE, IDENTITY_BIAS
+
+    normalized = (points - bias) / scale
+    if format == 'int16':
+        encoded = np.zeros((points.shape[0], 4), np.int16)
+        encoded[:, :3] = np.rint(normalized * 32767.)
+    else:
+        encoded = np.zeros((points.shape[0], 4), np.float16)
+        encoded[:, :3] = normalized
+    return format, encoded, scale, bias
+
+
+def decodePositions(encoded, format, scale, bias):
+    # what the vertex shader sees, for checks on the cpu side
+    if format == 'float32':
+        return np.asarray(encoded, np.float32)
+    values = encoded[:, :3].astype(np.float32)
+    if format == 'int16':
+        values = np.maximum(values / 32767., -1.)
+    return values * scale + bias
+
+
+def encodeOffsets(offsets, format, tolerance=None):
+    # offsets sit around zero so half floats keep their relative precision,
+    # big ones fall back to float32
+    offsets = np.asarray(offsets, np.float32).reshape(-1, 3)
+    if format not in OFFSET_FORMATS:
+        raise ValueError('unknown offset format %s' % format)
+    if format == 'float16' and offsets.shape[0] > 0:
+        largest = float(np.abs(offsets).max())
+        if largest < 65504. and (tolerance is None or largest / 2048. <= tolerance):
+            encoded = np.zeros((offsets.shape[0], 4), np.float16)
+            encoded[:, :3] = offsets
+            return 'float16', encoded
+    return 'float32', np.ascontiguousarray(offsets)
+
+
+def packNormals(normals):
+    # signed normalized 10_10_10_2, x in the low bits, w left at zero
+    quantized = np.rint(np.clip(normals, -1., 1.) * 511.).astype(np.int32) & 0x3FF
+    return (quantized[:, 0] | (quantized[:, 1] << 10) | (quantized[:, 2] << 20)).astype(np.uint32)
+
+
+def unpackNormals(packed):
+    packed = np.asarray(packed, np.uint32).astype(np.int32)
+    components = np.stack([(packed >> shift) & 0x3FF for shift in (0, 10, 20)], axis=1)
+    components[components >= 512] -= 1024
+    return np.maximum(components / 511., -1.).astype(np.float32)
+
+
+def vertexNormals(points, triangles):
+    # area weighted, the cross product is already twice the area
+    points = np.asarray(points, np.float32)
+    triangles = np.asarray(triangles, np.int64).reshape(-1, 3)
+    corners = points[triangles]
+    faceNormals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    normals = np.zeros_like(points)
+    for corner in range(3):
+        for axis in range(3):
+            normals[:, axis] += np.bincount(
+                triangles[:, corner], faceNormals[:, axis], minlength=points.shape[0]
+            ).astype(np.float32)
+    lengths = np.linalg.norm(normals, axis=1)
+    lengths[lengths == 0] = 1.
+    return normals / lengths[:, np.newaxis]
+
+
+def edgeLength(points, triangles, percentile=5):
+    # a short but not degenerate edge length, quantization has to stay well
+    # below it or triangles start to fold
+    triangles = np.asarray(triangles, np.int64).reshape(-1, 3)
+    if triangles.shape[0] == 0:
+        return 0.
+    points = np.asarray(points, np.float32)
+    lengths = np.linalg.norm(points[triangles[:, 1]] - points[triangles[:, 0]], axis=1)
+    lengths = lengths[lengths > 0]
+    if lengths.shape[0] == 0:
+        return 0.
+    return float(np.percentile(lengths, percentile))
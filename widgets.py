@@ -1,13 +1,21 @@
 from PySide import QtCore, QtGui, QtOpenGL
-from loader import rootFromAlembic
+from loader import SceneLoader
 from app import App
+from scheduler import FrameScheduler
+from playback import PlaybackClock
+from profiling import PROFILER
+from samples import QUANTIZATIONS
+from resources import GPU
+from scenemodel import SceneTreeModel
+import recorder
 
 
 class Viewer(QtOpenGL.QGLWidget):
 
     initSignal = QtCore.Signal()
-    drawSignal = QtCore.Signal()
-    updateSampleSignal = QtCore.Signal(int)
+    drawSignal = QtCore.Signal(set)
+    updateTimeSignal = QtCore.Signal(float)
+    statusSignal = QtCore.Signal(str)
 
     def __init__(self, parent=None):
         # at the time of writing latest OpenGL version is 4.5
@@ -27,23 +35,100 @@ class Viewer(QtOpenGL.QGLWidget):
         self.oldmx = 0.
         self.oldmy = 0.
 
+        # mouse moves are merged and handled once per frame, see processInput
+        self.pendingMove = None
+        self.mergedEvents = 0
+        self.totalEvents = 0
+        self.processedBatches = 0
+        # set while an interaction is being recorded, see recorder.replay
+        self.recorder = None
+
+        # repaints only happen when something is marked dirty
+        self.scheduler = FrameScheduler(self)
+
         self.app = App(self, [0, 0, self.width(), self.height()])
 
         self.initSignal.connect(self.app.initSlot)
         self.drawSignal.connect(self.app.drawSlot)
-        self.updateSampleSignal.connect(self.app.updateSampleSlot)
+        self.updateTimeSignal.connect(self.app.updateTimeSlot)
 
         self.isPlaying = False
         self.playbackRange = (0, 200)
         self.currentFrame = 0
-        self.showFrame(self.currentFrame)
         self.fpsLimit = 24.
+        self.showFrame(self.currentFrame)
+        self.clock = PlaybackClock(self.fpsLimit)
+        # ticks faster than the frame rate, the clock decides when a frame is due
         self.timer = QtCore.QTimer(self)
-        self.timer.timeout.connect(self.update)
         self.forward = True
         self.timer.timeout.connect(self.adjustFrame)
+        # wheel zooms end when the wheel stops
+        self.settleTimer = QtCore.QTimer(self)
+        self.settleTimer.setSingleShot(True)
+        self.settleTimer.timeout.connect(self.app.settle)
         self.setCursor(QtCore.Qt.CrossCursor)
 
+        # in viewport stats, only refreshed while profiling is on
+        self.statsLabel = QtGui.QLabel(self)
+        self.statsLabel.setStyleSheet('background-color: rgba(0, 0, 0, 120); color: #ddd; font-family: monospace; padding: 4px;')
+        self.statsLabel.move(8, 8)
+        self.statsTimer = QtCore.QTimer(self)
+        self.statsTimer.timeout.connect(self.updateStats)
+        self.setProfiling(PROFILER.enabled)
+
+    def setProfiling(self, enabled):
+        PROFILER.setEnabled(enabled)
+        self.statsLabel.setVisible(enabled)
+        if enabled:
+            self.statsTimer.start(500)
+            self.updateStats()
+        else:
+            self.statsTimer.stop()
+
+    def updateStats(self):
+        picker = self.app.currentBrush.picker
+        inputStats = self.inputStats()
+        schedulerStats = self.scheduler.stats()
+        lines = [
+            PROFILER.report(),
+            'input    %.1f events/batch' % inputStats['eventsPerBatch'],
+            'frames   scene %d  overlay %d  idle ticks %d' % (
+                schedulerStats['sceneFrames'], schedulerStats['overlayFrames'], schedulerStats['idleTicks']
+            ),
+            'picking  fast path %.0f%% of %d' % (picker.hitRate() * 100., picker.queries),
+        ]
+        root = self.app.root
+        if root is not None and hasattr(root, 'propertyReport'):
+            lines.append('archive  ' + root.propertyReport.summary())
+        if root is not None:
+            motion = self.app.motionStats()
+            lines.append('meshes   static %d  piecewise %d  animated %d  unclassified %d' % (
+                motion['static'], motion['piecewise'], motion['animated'], motion[None]
+            ))
+            lines.append('samples  uploaded %d  skipped %d' % (root.sampleUploads, root.sampleSkips))
+        lines.append(GPU.report())
+        if self.isPlaying:
+            lines.append('playback ' + self.clock.report())
+        self.statsLabel.setText('\n'.join(lines))
+        self.statsLabel.adjustSize()
+
+    def exportTrace(self):
+        filePath, _ = QtGui.QFileDialog.getSaveFileName(self, 'Export Trace', 'trace.json', 'Trace (*.json)')
+        if filePath:
+            count = PROFILER.exportChromeTrace(filePath)
+            self.statusSignal.emit('exported %d trace events to %s' % (count, filePath))
+
+    def cacheSamples(self, quantization):
+        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            stats = self.app.cacheSamples(quantization)
+        finally:
+            QtGui.QApplication.restoreOverrideCursor()
+        self.statusSignal.emit('cached %d meshes as %s, %.1f MB instead of %.1f MB, max error %.2g' % (
+            stats['meshes'], quantization,
+            stats['storedBytes'] / 1048576., stats['rawBytes'] / 1048576., stats['maxError']
+        ))
+
     def changeSelectedPath(self, path):
         branch = self.app.root.map[path]
         if branch.kind == 'PolyMesh':
@@ -54,17 +139,35 @@ class Viewer(QtOpenGL.QGLWidget):
     def togglePlay(self, forward=True):
         self.isPlaying = not self.isPlaying
         if self.isPlaying:
-            self.timer.start(1000. / self.fpsLimit)
+            self.forward = forward
+            self.clock.start(self.currentFrame, self.playbackRange, forward)
+            self.timer.start(1000. / self.fpsLimit / 4.)
         else:
             self.timer.stop()
+            self.clock.stop()
+            self.statusSignal.emit(self.clock.report())
+            # lods dropped while playback was behind go back to full detail
+            if self.app.playbackBehind:
+                self.app.playbackBehind = False
+                self.scheduler.markDirty('scene')
+
+    def setPlayEveryFrame(self, playEveryFrame):
+        self.clock.playEveryFrame = playEveryFrame
 
     def adjustFrame(self, frame=None):
         if frame is not None:
             self.currentFrame = frame
-        if self.isPlaying and self.forward:
-            self.currentFrame += 1
+            if self.isPlaying:
+                self.clock.rebase(frame)
         elif self.isPlaying:
-            self.currentFrame -= 1
+            frame = self.clock.tick()
+            behind = self.clock.behind()
+            if behind != self.app.playbackBehind:
+                self.app.playbackBehind = behind
+                self.scheduler.markDirty('scene')
+            if frame is None:
+                return
+            self.currentFrame = frame
 
         if self.currentFrame > self.playbackRange[1]:
             self.currentFrame = self.playbackRange[0]
@@ -74,15 +177,21 @@ class Viewer(QtOpenGL.QGLWidget):
         self.showFrame()
 
     def showFrame(self, frame=None):
-        # TODO convert frame to sample indices
-        if frame is not None:
-            self.updateSampleSignal.emit(int(frame))
-        else:
-            self.updateSampleSignal.emit(int(self.currentFrame))
+        # frames are converted to archive time, every branch then picks the
+        # sample its own time sampling has for that time
+        if frame is None:
+            frame = self.currentFrame
+        self.updateTimeSignal.emit(frame / self.fpsLimit)
 
     def setRoot(self, root):
         self.app.setRoot(root)
-        self.updateSampleSignal.emit(int(self.currentFrame))
+        self.showFrame()
+
+    def addBranches(self, branches):
+        self.app.addBranches(branches)
+
+    def addLods(self, meshes):
+        self.app.addLods(meshes)
 
     def initializeGL(self):
         self.initSignal.emit()
@@ -91,7 +200,13 @@ class Viewer(QtOpenGL.QGLWidget):
         self.app.resize([0, 0, w, h])
 
     def paintGL(self, *args):
-        self.drawSignal.emit()
+        dirty = self.scheduler.takeDirty()
+        self.drawSignal.emit(dirty)
+
+        if self.isPlaying and 'time' in dirty:
+            self.clock.frameShown()
+            if self.clock.shownFrames % int(self.fpsLimit) == 0:
+                self.statusSignal.emit(self.clock.report())
 
     def mouseMoveEvent(self, event):
         width = self.width()
@@ -104,83 +219,202 @@ class Viewer(QtOpenGL.QGLWidget):
         self.oldmy = pixelY
         dx /= width
         dy /= height
+        if self.recorder is not None:
+            self.recorder.record(recorder.MOVE, pixelX, pixelY, dx, dy, event.buttons(), event.modifiers())
+
+        # a change of buttons or modifiers starts a new batch so the brushes
+        # never see a drag merged across a press or a key
+        pending = self.pendingMove
+        if pending is not None and (pending['buttons'] != event.buttons() or pending['modifiers'] != event.modifiers()):
+            self.flushInput()
+            pending = None
+
+        if pending is None:
+            self.pendingMove = {
+                'x': pixelX,
+                'y': pixelY,
+                'modifiers': event.modifiers(),
+                'buttons': event.buttons(),
+                'dx': dx,
+                'dy': dy,
+                'count': 1
+            }
+        else:
+            pending['x'] = pixelX
+            pending['y'] = pixelY
+            pending['dx'] += dx
+            pending['dy'] += dy
+            pending['count'] += 1
+
+        self.scheduler.requestFrame()
+
+    def processInput(self):
+        # runs picking, brushes and camera once for everything since the last tick
+        pending = self.pendingMove
+        if pending is None:
+            return
+        self.pendingMove = None
+
+        self.mergedEvents = pending['count']
+        self.totalEvents += pending['count']
+        self.processedBatches += 1
+
+        self.app.mouseMove(
+            pending['x'], pending['y'],
+            pending['modifiers'], pending['buttons'],
+            pending['dx'], pending['dy']
+        )
 
-        hit = False
-        if event.modifiers() != QtCore.Qt.AltModifier and not self.app.currentCamera.navigating:
-            hit = self.app.currentBrush.mouseMoveEvent(
-                event.pos().x(), event.pos().y(),
-                event.modifiers(), event.buttons(),
-                self.app.viewportCoords,
-                self.app.currentCamera.viewMatrix(),
-                self.app.currentCamera.projectionMatrix(),
-                self.app.currentCamera.cameraPosition(),
-                self.app.currentCamera.upsign,
-                dx, dy
-            )
-        if (not hit or self.app.currentCamera.navigating) and not self.app.currentBrush.operating:
-            self.app.currentCamera.mouseMoveEvent(event.buttons(), dx, dy)
+    def inputStats(self):
+        return {
+            'lastMerged': self.mergedEvents,
+            'events': self.totalEvents,
+            'batches': self.processedBatches,
+            'eventsPerBatch': self.totalEvents / float(max(1, self.processedBatches)),
+        }
 
-        self.app.updateHit()
-        self.update()
+    def flushInput(self):
+        if self.pendingMove is not None:
+            self.makeCurrent()
+            self.processInput()
 
     def mousePressEvent(self, event):
-        if event.modifiers() != QtCore.Qt.AltModifier and not self.app.currentCamera.navigating:
-            self.app.currentBrush.handleMouseButton(
-                event.pos().x(), event.pos().y(),
-                event.modifiers(), event.buttons(),
-                0, 0
-            )
+        self.flushInput()
+        if self.recorder is not None:
+            self.recorder.record(recorder.PRESS, event.pos().x(), event.pos().y(), buttons=event.buttons(), modifiers=event.modifiers())
+        self.app.mousePress(
+            event.pos().x(), event.pos().y(),
+            event.modifiers(), event.buttons()
+        )
+
+    def mouseReleaseEvent(self, event):
+        self.flushInput()
+        if self.recorder is not None:
+            self.recorder.record(recorder.RELEASE, event.pos().x(), event.pos().y())
+        self.app.mouseRelease()
 
     def keyPressEvent(self, event):
+        if self.recorder is not None:
+            self.recorder.record(recorder.KEY, modifiers=event.modifiers(), value=event.key())
+        if self.app.keyPress(event.key(), event.modifiers()):
+            return
         if event.key() == QtCore.Qt.Key_Space and event.modifiers() == QtCore.Qt.ControlModifier:
             menu = QtGui.QMenu(self)
             rubberAction = menu.addAction('Rubber')
             defaultAction = menu.addAction('Default')
+            menu.addSeparator()
+            everyFrameAction = menu.addAction('Play Every Frame')
+            everyFrameAction.setCheckable(True)
+            everyFrameAction.setChecked(self.clock.playEveryFrame)
+            profilingAction = menu.addAction('Profiling')
+            profilingAction.setCheckable(True)
+            profilingAction.setChecked(PROFILER.enabled)
+            exportTraceAction = menu.addAction('Export Trace...')
+            clearPinsAction = menu.addAction('Clear Pins')
+            smoothAction = menu.addAction('Smooth Preview')
+            smoothAction.setCheckable(True)
+            smoothAction.setChecked(self.app.material is self.app.materials['smooth'])
+            geodesicAction = menu.addAction('Geodesic Falloff')
+            geodesicAction.setCheckable(True)
+            geodesicAction.setChecked(self.app.currentBrush.geodesicFalloff)
+            recordAction = menu.addAction('Record Interaction')
+            recordAction.setCheckable(True)
+            recordAction.setChecked(self.recorder is not None)
+            cacheMenu = menu.addMenu('Cache Samples')
+            cacheActions = dict(
+                (cacheMenu.addAction(quantization), quantization)
+                for quantization in QUANTIZATIONS
+            )
             action = menu.exec_(self.mapToGlobal(QtCore.QPoint(self.oldmx, self.oldmy)))
             if action == defaultAction:
                 self.app.setMode('default')
             elif action == rubberAction:
                 self.app.setMode('rubber')
+            elif action == everyFrameAction:
+                self.setPlayEveryFrame(everyFrameAction.isChecked())
+            elif action == profilingAction:
+                self.setProfiling(profilingAction.isChecked())
+            elif action == exportTraceAction:
+                self.exportTrace()
+            elif action == clearPinsAction:
+                self.makeCurrent()
+                self.app.clearPins()
+            elif action == geodesicAction:
+                self.setGeodesicFalloff(geodesicAction.isChecked())
+            elif action == recordAction:
+                self.setRecording(recordAction.isChecked())
+            elif action == smoothAction:
+                self.makeCurrent()
+                self.app.setSmoothPreview(smoothAction.isChecked())
+            elif action in cacheActions:
+                self.cacheSamples(cacheActions[action])
         elif event.key() == QtCore.Qt.Key_Space:
             self.togglePlay()
 
     def wheelEvent(self, event):
-        self.app.currentCamera.wheelEvent(event)
+        if self.recorder is not None:
+            self.recorder.record(recorder.WHEEL, modifiers=event.modifiers(), value=event.delta())
+        self.app.wheel(event.delta(), event.modifiers())
+        self.settleTimer.start(self.app.settleDelay * 1000.)
+
+    def setGeodesicFalloff(self, enabled):
+        try:
+            self.app.setGeodesicFalloff(enabled)
+        except ImportError:
+            self.statusSignal.emit('geodesic falloff needs scipy')
+
+    def setRecording(self, recording):
+        if recording:
+            self.recorder = recorder.EventRecorder(self.app)
+            self.statusSignal.emit('recording interaction')
+            return
+        if self.recorder is None:
+            return
+        events = self.recorder
+        self.recorder = None
+        filePath, _ = QtGui.QFileDialog.getSaveFileName(self, 'Save Recording', 'interaction.npz', 'Recording (*.npz)')
+        if filePath:
+            count = events.save(filePath)
+            self.statusSignal.emit('saved %d events to %s' % (count, filePath))
 
 
 class ObjectTree(QtGui.QTreeView):
 
     pathSelectedSignal = QtCore.Signal(str)
 
+    # filtered trees are expanded fully up to this many matches
+    expandLimit = 2000
+
     def __init__(self, *args):
         super(ObjectTree, self).__init__(*args)
-
-    def selectionChanged(self, *args):
-        index = self.selectedIndexes()[0]
-        path = index.model().itemFromIndex(index).data(QtCore.Qt.UserRole)
-        self.pathSelectedSignal.emit(str(path))
-
-    def addRoot(self, root):
         self.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
-        model = QtGui.QStandardItemModel()
-        model.setHorizontalHeaderLabels(['Objects'])
-        self.setModel(model)
         self.setUniformRowHeights(True)
 
-        parents = {}
-        for path in sorted(root.map.keys()):
-            branch = root.map[path]
-            parentPath = '/' + '/'.join(path.split('/')[1:-1])
-            if parentPath not in parents:
-                parent = QtGui.QStandardItem(branch.name)
-                parent.setData(path, role=QtCore.Qt.UserRole)
-                parents[path] = parent
-                model.appendRow(parent)
-            else:
-                child = QtGui.QStandardItem(branch.name)
-                child.setData(path, role=QtCore.Qt.UserRole)
-                parents[path] = child
-                parents[parentPath].appendRow([child])
+    def selectionChanged(self, selected, deselected):
+        super(ObjectTree, self).selectionChanged(selected, deselected)
+        indexes = self.selectedIndexes()
+        if len(indexes) == 0:
+            return
+        self.pathSelectedSignal.emit(str(self.model().pathFromIndex(indexes[0])))
+
+    def addBranches(self, branches):
+        if self.model() is not None:
+            self.model().addPaths([branch.path for branch in branches])
+
+    def addRoot(self, root):
+        # rows are created by the model as they are expanded
+        self.setModel(SceneTreeModel(root))
+        self.expand(self.model().indexFromPath('/'))
+
+    def setFilter(self, text):
+        model = self.model()
+        if model is None:
+            return
+        matchCount = model.setFilter(text)
+        if 0 < matchCount <= self.expandLimit:
+            self.expandAll()
+        else:
+            self.expand(model.indexFromPath('/'))
 
 
 class MainWindow(QtGui.QMainWindow):
@@ -197,20 +431,72 @@ class MainWindow(QtGui.QMainWindow):
         layout = QtGui.QGridLayout()
         centralWidget.setLayout(layout)
 
+        self.filterEdit = QtGui.QLineEdit()
+        self.filterEdit.setPlaceholderText('Filter')
+        layout.addWidget(self.filterEdit, 0, 0)
+
         self.objectTree = ObjectTree()
-        layout.addWidget(self.objectTree, 0, 0)
+        layout.addWidget(self.objectTree, 1, 0)
 
         self.viewer = Viewer()
-        layout.addWidget(self.viewer, 0, 1)
+        layout.addWidget(self.viewer, 0, 1, 2, 1)
         layout.setColumnStretch(1, 100)
 
         self.objectTree.pathSelectedSignal.connect(self.viewer.changeSelectedPath)
+        self.filterEdit.textChanged.connect(self.objectTree.setFilter)
+        self.viewer.statusSignal.connect(self.statusBar().showMessage)
+
+        self.loaderThread = None
+        self.loader = None
 
     def loadAlembic(self, filePath):
-        root = rootFromAlembic(filePath)
+        # the archive is read on a worker thread, the root shows up first and
+        # branches follow in batches while the window stays responsive
+        self.cancelLoading()
+        self.loaderThread = QtCore.QThread(self)
+        self.loader = SceneLoader(filePath, self.thread())
+        self.loader.moveToThread(self.loaderThread)
+        self.loaderThread.started.connect(self.loader.run)
+        self.loader.rootSignal.connect(self.setRoot)
+        self.loader.branchesSignal.connect(self.addBranches)
+        self.loader.lodsSignal.connect(self.addLods)
+        self.loader.finishedSignal.connect(self.loadingFinished)
+        self.statusBar().showMessage('loading %s' % filePath)
+        self.loaderThread.start()
+
+    def cancelLoading(self):
+        if self.loaderThread is None:
+            return
+        self.loader.cancel()
+        self.loaderThread.quit()
+        self.loaderThread.wait()
+        self.loaderThread = None
+        self.loader = None
+
+    # a cancelled loader can still have batches queued up, those are dropped
+    def setRoot(self, root):
+        if self.sender() is not self.loader:
+            return
         self.viewer.setRoot(root)
         self.objectTree.addRoot(root)
 
+    def addBranches(self, branches):
+        if self.sender() is not self.loader:
+            return
+        self.viewer.addBranches(branches)
+        self.objectTree.addBranches(branches)
+
+    def addLods(self, meshes):
+        if self.sender() is not self.loader:
+            return
+        self.viewer.addLods(meshes)
+
+    def loadingFinished(self, filePath, count, seconds):
+        if self.sender() is not self.loader:
+            return
+        self.statusBar().showMessage('loaded %d objects from %s in %.2fs' % (count, filePath, seconds))
+        self.loaderThread.quit()
+
 
 # TODO
 # modified from